@@ -1,162 +1,288 @@
-# messages.py - Bot text content
-
-# Initial Greeting
-msg_1 = "سلام 👋✨"
-
-# Intro messages after name input
-msg_three_steps = """فقط توی سه گام ساده با ما همراه باش …
-
-و ببین چطور می‌تونی از همون جلسه‌ی اول، راحت جمله بسازی و توی موقعیت‌های واقعی بدون استرس حرف بزنی! 😍
-
-✨ این مینی‌دوره طوری طراحی شده که قدم ‌به‌ قدم ترست از مکالمه بریزه و اعتمادبه‌نفس بگیری.
-
-اگه همین مسیر رو با پشتیبان اختصاصی‌ات ادامه بدی، نتیجه‌ای می‌گیری که واقعاً غافلگیرت می‌کنه 🔥"""
-
-msg_voice_instruction = """🎧 اول ویس پایین رو کامل گوش بده،
- بعد جواب چند تا سؤال کوتاه رو بده،
-✅ تا مینی‌دوره‌ی سه جلسه‌ای‌ت برات فعال بشه.
-
-و به عنوان هدیه، از تیم ما یک مشاوره اختصاصی هم می‌گیری ❤️
-
-راستی! حتماً پیج اینستاگرام ما رو هم دنبال کن، چون کلی آموزش رایگان، خبرهای داغ و دوره‌های خفن اونجا منتظرت هستن!"""
-
-msg_instagram = """پیج اینستاگرام ما👇"""
-
-# Important voice label
-important_voice_msg = """❌ ویس مهم ❌"""
-
-# Questionnaire
-question_1 = """سطح زبانت الان چطوره؟ {name} عزیز 📚"""
-question_1_options = [
-    "مبتدی (تقریباً هیچی بلد نیستم) 📗",
-    "متوسط (می‌فهمم ولی سخت صحبت می‌کنم) ✏️", 
-    "پیشرفته (بلدم ولی می‌خوام حرفه‌ای‌تر بشم) 🚀",
-    "مطمئن نیستم 🤷"
-]
-
-question_2 = """هدفت از یادگیری زبان چیه؟ 🎯"""
-question_2_options = [
-    "🎓 مهاجرت 🌍 / ادامه تحصیل",
-    "شغل بهتر/ درآمد دلاری 💼", 
-    "سفر و گردشگری ✈️",
-    "علاقه شخصی ✨"
-]
-
-question_3 = """خب اینم بگو که
-روزی چند دقیقه می‌تونی وقت بذاری؟ ⏰"""
-question_3_options = [
-    "۱۵ - ۲۰ دقیقه",
-    "۳۰ - ۴۵ دقیقه", 
-    "۶۰ دقیقه به بالا"
-]
-
-question_4 = """چرا قبلاً به نتیجه دلخواهت نرسیدی؟ 🤔"""
-question_4_options = [
-    "کلاس ها خسته کننده بودن",
-    "پشتیبانی درست نداشتم",
-    "فقط گرامر بودن کاربردی نبود", 
-    "انگیزه م کم شد"
-]
-
-# Post-questionnaire responses
-registration_success = """{name} عزیز اطلاعاتت با موفقیت ثبت شد ! 🤩
-اینم لینک کانال مینی‌دوره‌ی ۳ جلسه‌ای جادوی مکالمه 🪄
-برای مشاهده کافیه رو لینک پایین کلیک کنی"""
-
-watch_reminder = """جلسه‌ها خیلی کوتاهن
-همین الان یکم تایم بذار و ببینشون
-تا حدود یک ساعت دیگه دوباره بهت پیام میدم تا نظرتو بپرسم ✨"""
-
-# Follow-up messages
-follow_up_1 = """خب 👀
-جلسه‌ی اول جادوی مکالمه رو دیدی یا نه هنوز؟"""
-follow_up_1_options = ["بله دیدم", "نه فرصت نکردم"]
-
-no_time_response = """اشکال نداره ، جلسه ها فقط ۱۰ دقیقه ان ⏰
-خیلی زمانت رو نمیگیره
-همین الان ببین تا از دستت نره
-راستی لینک دوره فعلا فعاله ولی بزودی منقضی میشه ،اگر هنوز عضو نشدی سریع عضو شو تا دوره رو از دست ندی!"""
-
-follow_up_2 = """خب 👀
-جلسه‌ی اول جادوی مکالمه رو دیدی؟"""
-follow_up_2_options = ["بله دیدم"]
-
-rating_request = """عالیه!
-🙌 از ۱ تا ۱۰ چه امتیازی می‌دی؟
-و بیشتر چه چیزی برات جالب بود؟ ✨"""
-
-course_intro = """خب ، حالا تصور کن به جای فقط سه جلسه ، همین روشی که توی مینی‌دوره دیدی رو توی هشتاد جلسه‌ی کامل تو دوره ی اکتیوویژن داشته باشی .
-یعنی از نقطه‌ی صفر قدم به قدم ، تا جایی که می‌تونی مثل یه آمریکایی حرفه‌ای و راحت انگلیسی حرف بزنی . 🗣✨
-
-توی این مسیر تنها نیستی . یه پشتیبان اختصاصی بیست‌وچهار ساعته کنارت هست که هرجا سوال داشتی یا نیاز به کمک داشتی ، راهنماییت می‌کنه .
-
-تمرین‌هایی که توی دوره داری ، فقط تئوری و خشک نیستن؛ کاملاً واقعی و کاربردین . دقیقا همون جمله‌ها و موقعیت‌هایی که توی سفر، کار، مهاجرت یا حتی زندگی روزمره بهشون نیاز داری"""
-
-testimonial_intro = """نظر ربکای عزیز رو ببین 😍👇"""
-
-success_stories = """اینم چندتا از زبان آموزای خفنمون که تونستیم بهشون کمک کنیم به هدفی که داشتن برسن
-
-تو چرا نرسی !"""
-
-consultation_offer = """اگه آماده‌ای دوره ی اصلی اکتیوویژن رو شروع کنی ، همین الان رو دکمه پایین کلیک کن تا ۵۰ درصد تخفیف ویژه برات فعال بشه و وارد قرعه‌کشی آیفون هم بشی 🎁"""
-
-# Phone number requests
-phone_request_urgent = """این فرصت فقط تا ۲۴ ساعت آینده برات فعاله
- ⏰
- اگه می‌خوای تخفیف و مشاوره اختصاصی رو از دست ندی، همین الان روی دکمه‌ی ارسال شماره کلیک کن و شمارتو برامون ارسال کن تا کارشناس های VIP ما باهات ارتباط بگیرن👇"""
-
-phone_request = """لطفا شمارتو با دکمه "ارسال شماره"
-ارسال کن تا برات یک مشاوره رایگان رزرو کنم"""
-
-contact_time_question = """راستی چه زمانی باهات ارتباط بگیریم؟ 📞"""
-contact_time_options = [
-    "صبح (۱۰–۱۳)",
-    "بعدازظهر (۱۴–۱۸)", 
-    "شب (۱۸–۲۱)"
-]
-
-final_message = """عالیه ! ✅
-منتظر تماس کارشناس اختصاصیت باش تا باهات تماس بگیره و کمکت کنه مسیر یادگیریتو شروع کنی 😍"""
-
-# Final photo caption
-final_photo_caption = """🎉 یه سورپرایز دیگه داریم!
-نه‌تنها می‌تونی تا پایان امشب دوره‌ی اکتیوویژن رو با ۵۰٪ تخفیف ثبت‌نام کنی،
-بلکه وارد جشنواره تابستانه هم می‌شی 🌞
-و شانس برنده شدن آیفون ۱۶ 📱 رو هم داری.
-
-این ترکیب تخفیف + قرعه‌کشی، فقط تا آخر امشب فعاله.
-
-پس اگه آماده‌ای، همین همین الان روی دکمه‌ی ارسال شماره کلیک کن و شمارتو برامون ارسال کن تا کارشناس های VIP ما باهات ارتباط بگیرن👇"""
-
-# Admin messages
-admin_welcome = """خوش آمدید ادمین عزیز! 👋
-لطفاً یکی از گزینه‌های زیر را انتخاب کنید:"""
-
-admin_stats = """📊 آمار ربات:
-تعداد کل کاربران: {total_users}
-تعداد کاربران VIP (با شماره): {vip_users}"""
-
-# Bulk message flows
-bulk_quiz = """لطفاً نتیجه این محاسبه را بنویسید:
-{num1} + {num2} = ?"""
-
-bulk_file_request = """لطفاً فایل CSV یا Excel شامل userid های مورد نظر را ارسال کنید."""
-
-bulk_message_request = """حالا پیامی که می‌خواهید برای کاربران ارسال شود را بفرستید.
-(می‌تواند متن، عکس، ویدیو یا هر نوع محتوای دیگری باشد)"""
-
-bulk_confirm = """آیا مطمئن هستید که این پیام برای {count} کاربر ارسال شود؟"""
-
-bulk_result = """✅ ارسال انبوه تکمیل شد:
-✅ موفق: {success} کاربر  
-❌ ناموفق: {failed} کاربر"""
-
-# Error messages
-error_invalid_file = """❌ فایل نامعتبر است. لطفاً فایل CSV یا Excel ارسال کنید."""
-error_quiz_wrong = """❌ پاسخ اشتباه است. عملیات لغو شد."""
-error_general = """خطایی رخ داد. لطفاً دوباره تلاش کنید."""
-
-# Misc  
-name_request = "لطفا اسمت رو برامون بنویس✨"
-instagram_link = "www.instagram.com/too.america"
-channel_link_template = "{invite_link}"
\ No newline at end of file
+# admin.py - Admin panel: statistics, export and bulk broadcasts
+
+import io
+import os
+import random
+import logging
+import threading
+from telebot import types
+from config import ADMIN_IDS, AdminState
+from broadcast import BroadcastEngine, ACTIVE
+from export import UserExport
+from leads import LeadFeed
+from ingest import RecipientImport, SUPPORTED_EXTENSIONS
+from keyboards import KeyboardRegistry
+from messages import *
+
+def build_admin_keyboards():
+    registry = KeyboardRegistry()
+
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(admin_button_stats, callback_data="admin_stats"))
+    markup.row(types.InlineKeyboardButton(admin_button_export, callback_data="admin_export_xlsx"),
+               types.InlineKeyboardButton(admin_button_export_csv, callback_data="admin_export_csv"))
+    markup.row(types.InlineKeyboardButton(admin_button_leads_csv, callback_data="admin_leads_csv"),
+               types.InlineKeyboardButton(admin_button_leads_jsonl, callback_data="admin_leads_jsonl"))
+    markup.add(types.InlineKeyboardButton(admin_button_bulk, callback_data="bulk_start"))
+    registry.register('admin_menu', markup)
+
+    # Per-broadcast buttons; callback data "bulk_<action>_<broadcast_id>"
+    for name, buttons in (
+        ('bulk_confirm', ((bulk_button_send, 'send'), (bulk_button_abort, 'abort'))),
+        ('bulk_running', ((bulk_button_pause, 'pause'), (bulk_button_cancel, 'cancel'), (bulk_button_refresh, 'progress'))),
+        ('bulk_paused', ((bulk_button_resume, 'resume'), (bulk_button_cancel, 'cancel'), (bulk_button_refresh, 'progress'))),
+    ):
+        markup = types.InlineKeyboardMarkup()
+        markup.row(*[types.InlineKeyboardButton(text, callback_data=f"bulk_{action}___broadcast_id__")
+                     for text, action in buttons])
+        registry.register_template(name, markup, ('broadcast_id',))
+    return registry
+
+class AdminPanel:
+    """Admin menu and the bulk message flow.
+
+    A broadcast is prepared in steps (AdminState): a math captcha, a
+    CSV/Excel file of user ids, then the message to send, which is kept
+    where the admin sent it and copied to every recipient by the
+    BroadcastEngine. One progress message per broadcast is edited as it
+    runs and carries the pause/resume/cancel buttons.
+    """
+
+    def __init__(self, db, outbox, call_api):
+        self.db = db
+        self.outbox = outbox
+        self.call_api = call_api
+        self.keyboards = build_admin_keyboards()
+        self.broadcasts = BroadcastEngine(db, outbox, on_progress=self.show_progress)
+        self.exports = UserExport(db)
+        self.leads = LeadFeed(db)
+
+        self._sessions = {}          # admin_id -> {'state': AdminState..., ...}
+        self._progress_lock = threading.Lock()
+        self._progress_text = {}     # broadcast_id -> last text shown, to skip no-op edits
+
+    def start(self):
+        """Resume broadcasts interrupted by a restart."""
+        # Uploads staged by a previous run were never turned into broadcasts
+        self.db.discard_import()
+        self.broadcasts.recover()
+
+    def stop(self):
+        self.broadcasts.stop()
+
+    def is_admin(self, user_id):
+        return user_id in ADMIN_IDS
+
+    def show_admin_menu(self, chat_id):
+        self._sessions.pop(chat_id, None)
+        self.outbox.send_message(chat_id, admin_welcome, reply_markup=self.keyboards.get('admin_menu'))
+
+    def handle_admin_callback(self, call):
+        """Menu buttons: statistics and export."""
+        chat_id = call.message.chat.id
+        try:
+            if call.data == 'admin_stats':
+                stats = self.db.get_stats()
+                self.outbox.send_message(chat_id, admin_stats.format(**stats))
+            elif call.data.startswith('admin_export_'):
+                self.send_export(chat_id, call.data[len('admin_export_'):])
+            elif call.data.startswith('admin_leads_'):
+                self.send_new_leads(chat_id, call.from_user.id, call.data[len('admin_leads_'):])
+        except Exception as e:
+            logging.error(f"Error handling admin callback {call.data}: {e}")
+            self.outbox.send_message(chat_id, error_general)
+
+    def send_export(self, chat_id, fmt):
+        """Export in the background, editing a progress message until the files are sent."""
+        message_id = self.outbox.send_message(chat_id, export_started).result().message_id
+
+        def on_progress(done, total):
+            self.outbox.edit_message_text(export_progress.format(done=done, total=total), chat_id, message_id)
+
+        def on_done(paths, cached):
+            if paths is None:
+                self.outbox.edit_message_text(error_general, chat_id, message_id)
+                return
+            text = export_ready_cached if cached else export_ready.format(files=len(paths))
+            self.outbox.edit_message_text(text, chat_id, message_id)
+            for path in paths:
+                with open(path, 'rb') as f:
+                    self.outbox.send_document(chat_id, f).result()
+
+        self.exports.request(fmt, on_progress, on_done)
+
+    def send_new_leads(self, chat_id, admin_id, fmt):
+        """Hot leads since this admin's last pull; the cursor moves once the file is sent."""
+        consumer = f"admin_{admin_id}"
+        path, rows, cursor = self.leads.export(consumer, fmt)
+        if path is None:
+            self.outbox.send_message(chat_id, leads_none)
+            return
+        try:
+            with open(path, 'rb') as f:
+                self.outbox.send_document(chat_id, f, caption=leads_ready.format(rows=rows)).result()
+            self.leads.advance(consumer, cursor, rows)
+        finally:
+            os.remove(path)
+
+    def handle_admin_message(self, message):
+        """Route an admin's message by the step of the bulk flow they are in."""
+        admin_id = message.from_user.id
+        session = self._sessions.get(admin_id)
+        try:
+            if session is None:
+                self.show_admin_menu(message.chat.id)
+            elif session['state'] == AdminState.BULK_QUIZ:
+                self.check_quiz(message, session)
+            elif session['state'] == AdminState.BULK_FILE:
+                self.load_recipients(message, session)
+            elif session['state'] == AdminState.BULK_LOADING:
+                self.outbox.send_message(message.chat.id, bulk_file_loading)
+            elif session['state'] == AdminState.BULK_MESSAGE:
+                self.confirm_message(message, session)
+            else:
+                self.show_admin_menu(message.chat.id)
+        except Exception as e:
+            logging.error(f"Error handling admin message: {e}")
+            self._sessions.pop(admin_id, None)
+            self.outbox.send_message(message.chat.id, error_general)
+
+    def check_quiz(self, message, session):
+        if (message.text or '').strip() != str(session['answer']):
+            self._sessions.pop(message.from_user.id, None)
+            self.outbox.send_message(message.chat.id, error_quiz_wrong)
+            return
+        session['state'] = AdminState.BULK_FILE
+        self.outbox.send_message(message.chat.id, bulk_file_request)
+
+    def load_recipients(self, message, session):
+        """Ingest the file on a background thread; the admin's lane stays free meanwhile."""
+        document = message.document
+        if document is None or not (document.file_name or '').lower().endswith(SUPPORTED_EXTENSIONS):
+            self.outbox.send_message(message.chat.id, error_invalid_file)
+            return
+        session['state'] = AdminState.BULK_LOADING
+        self.outbox.send_message(message.chat.id, bulk_file_loading)
+        threading.Thread(target=self._load_recipients, args=(message.chat.id, message.from_user.id, document, session),
+                         name=f"bulk-file-{message.from_user.id}", daemon=True).start()
+
+    def _load_recipients(self, chat_id, admin_id, document, session):
+        upload = RecipientImport(self.db)
+        try:
+            try:
+                file_info = self.call_api('get_file', document.file_id)
+                content = self.call_api('download_file', file_info.file_path)
+                report = upload.load(io.BytesIO(content), document.file_name)
+            except Exception as e:
+                logging.error(f"Error reading bulk file {document.file_name}: {e}")
+                session['state'] = AdminState.BULK_FILE
+                self.outbox.send_message(chat_id, error_invalid_file)
+                return
+            self.outbox.send_message(chat_id, bulk_file_report.format(**report))
+            if not report['sendable']:
+                session['state'] = AdminState.BULK_FILE
+                self.outbox.send_message(chat_id, bulk_empty_file)
+                return
+            if self._sessions.get(admin_id) is not session:
+                return   # the admin left the flow while the file loaded
+
+            broadcast_id = self.db.create_broadcast(admin_id)
+            if broadcast_id is None:
+                raise RuntimeError("could not create broadcast")
+            count = upload.add_to_broadcast(broadcast_id)
+            session.update(state=AdminState.BULK_MESSAGE, broadcast_id=broadcast_id, count=count)
+            self.outbox.send_message(chat_id, bulk_message_request)
+        except Exception as e:
+            logging.error(f"Error loading bulk recipients: {e}")
+            if self._sessions.get(admin_id) is session:
+                self._sessions.pop(admin_id)
+            self.outbox.send_message(chat_id, error_general)
+        finally:
+            upload.discard()
+
+    def confirm_message(self, message, session):
+        broadcast_id = session['broadcast_id']
+        self.db.update_broadcast(broadcast_id, from_chat_id=message.chat.id, message_id=message.message_id)
+        session['state'] = AdminState.BULK_CONFIRM
+        self.outbox.send_message(
+            message.chat.id, bulk_confirm.format(count=session['count']),
+            reply_markup=self.keyboards.render('bulk_confirm', broadcast_id=broadcast_id)
+        )
+
+    def handle_bulk_callback(self, call):
+        """bulk_start, and bulk_<action>_<broadcast_id> for one broadcast."""
+        chat_id = call.message.chat.id
+        admin_id = call.from_user.id
+        try:
+            if call.data == 'bulk_start':
+                num1, num2 = random.randint(1, 20), random.randint(1, 20)
+                self._sessions[admin_id] = {'state': AdminState.BULK_QUIZ, 'answer': num1 + num2}
+                self.outbox.send_message(chat_id, bulk_quiz.format(num1=num1, num2=num2))
+                return
+
+            action, broadcast_id = call.data[len('bulk_'):].rsplit('_', 1)
+            broadcast_id = int(broadcast_id)
+            if action == 'send':
+                self._sessions.pop(admin_id, None)
+                self.outbox.delete_message(chat_id, call.message.message_id)
+                if not self.broadcasts.start(broadcast_id):
+                    self.outbox.send_message(chat_id, bulk_not_allowed)
+                    return
+                text, markup = self.render_progress(*self.broadcasts.progress(broadcast_id))
+                sent = self.outbox.send_message(chat_id, text, reply_markup=markup).result()
+                # The runner edits this message from its next progress report on
+                self.db.update_broadcast(broadcast_id, progress_chat_id=chat_id, progress_message_id=sent.message_id)
+                broadcast, counts = self.broadcasts.progress(broadcast_id)
+                if broadcast['status'] not in ACTIVE:
+                    # Finished before there was a message to report to
+                    self.show_progress(broadcast, counts, True)
+            elif action == 'abort':
+                self._sessions.pop(admin_id, None)
+                self.broadcasts.cancel(broadcast_id)
+                self.outbox.edit_message_text(bulk_aborted, chat_id, call.message.message_id)
+            elif action in ('pause', 'resume', 'cancel'):
+                if not getattr(self.broadcasts, action)(broadcast_id):
+                    self.outbox.send_message(chat_id, bulk_not_allowed)
+                self.show_progress(*self.broadcasts.progress(broadcast_id))
+            elif action == 'progress':
+                self.show_progress(*self.broadcasts.progress(broadcast_id))
+        except Exception as e:
+            logging.error(f"Error handling bulk callback {call.data}: {e}")
+            self.outbox.send_message(chat_id, error_general)
+
+    def render_progress(self, broadcast, counts, finished=False):
+        """(text, reply_markup) for a broadcast's progress message.
+
+        The result summary once the runner has `finished` a done or
+        cancelled broadcast; until then (a cancel still draining its
+        in-flight sends) the live counts.
+        """
+        sent = counts.get('sent', 0)
+        failed = counts.get('failed', 0)
+        blocked = counts.get('blocked', 0)
+        unknown = counts.get('unknown', 0)
+        status = broadcast['status']
+        if finished and status in ('done', 'cancelled'):
+            text = bulk_result.format(success=sent, failed=failed + blocked + unknown) + "\n" + bulk_result_details.format(
+                blocked=blocked, unknown=unknown, cancelled=counts.get('cancelled', 0))
+            return text, None
+        text = bulk_progress.format(
+            broadcast_id=broadcast['broadcast_id'], status=bulk_status_labels.get(status, status),
+            sent=sent, failed=failed, blocked=blocked,
+            pending=counts.get('pending', 0) + counts.get('queued', 0) + counts.get('sending', 0), total=broadcast['total']
+        )
+        return text, self.keyboards.render(f"bulk_{status}", broadcast_id=broadcast['broadcast_id']) if status in ACTIVE else None
+
+    def show_progress(self, broadcast, counts, finished=False):
+        """Edit the broadcast's progress message (BroadcastEngine on_progress hook)."""
+        if not broadcast or broadcast['progress_message_id'] is None:
+            return
+        text, markup = self.render_progress(broadcast, counts, finished)
+        broadcast_id = broadcast['broadcast_id']
+        with self._progress_lock:
+            # Telegram rejects an edit that changes nothing
+            if self._progress_text.get(broadcast_id) == (text, markup):
+                return
+            self._progress_text[broadcast_id] = (text, markup)
+        self.outbox.edit_message_text(text, broadcast['progress_chat_id'], broadcast['progress_message_id'],
+                                      reply_markup=markup)
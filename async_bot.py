@@ -0,0 +1,95 @@
+# async_bot.py - Opt-in asyncio runtime built on AsyncTeleBot
+
+import asyncio
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from telebot import asyncio_helper
+from telebot.async_telebot import AsyncTeleBot
+from config import BOT_TOKEN, ASYNC_HANDLER_WORKERS, ASYNC_HTTP_POOL_SIZE
+from bot import TelegramBot
+from outbox import Outbox
+from scheduler import LoopScheduler
+
+class AsyncTelegramBot(TelegramBot):
+    """TelegramBot on one asyncio event loop.
+
+    Polling and every Bot API request run on the loop over a single
+    pooled keep-alive aiohttp session (telebot's shared session manager),
+    so waiting on Telegram costs no threads. Handler logic is inherited
+    unchanged from TelegramBot: each update is queued on its user's lane
+    (`LaneDispatcher`), which is also where the blocking SQLite calls
+    happen. Queuing waits while a lane is full, so it is done on a single
+    feeder thread (keeping arrival order) and the loop only awaits it;
+    polling stalls instead of the loop. Job wake-ups are loop timers (`LoopScheduler`) instead of a
+    timer thread.
+    """
+
+    def __init__(self, db_file=None):
+        self.loop = asyncio.new_event_loop()
+        self.executor = ThreadPoolExecutor(max_workers=ASYNC_HANDLER_WORKERS, thread_name_prefix="handler")
+        self.loop.set_default_executor(self.executor)
+        self.feeder = ThreadPoolExecutor(max_workers=1, thread_name_prefix="feeder")
+        asyncio_helper.REQUEST_LIMIT = ASYNC_HTTP_POOL_SIZE
+        super().__init__(db_file)
+
+    def create_bot(self):
+        return AsyncTeleBot(BOT_TOKEN)
+
+    def create_outbox(self):
+        return Outbox(self.bot, loop=self.loop)
+
+    def create_scheduler(self):
+        return LoopScheduler(self.loop, self.executor)
+
+    def wrap_handler(self, handler, callback=False):
+        dispatch = super().wrap_handler(handler, callback)
+        async def run(update):
+            await self.loop.run_in_executor(self.feeder, dispatch, update)
+        return run
+
+    def call_api(self, method, *args, **kwargs):
+        # Called from handler threads, never from the loop itself
+        coroutine = getattr(self.bot, method)(*args, **kwargs)
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+
+    def answer_callback(self, call, received):
+        # Dispatch runs on the feeder thread; the answer is a task on the loop
+        asyncio.run_coroutine_threadsafe(self._answer_callback_async(call, received), self.loop)
+
+    async def _answer_callback_async(self, call, received):
+        try:
+            await self.bot.answer_callback_query(call.id)
+            self.callback_gate.acked(received)
+        except Exception as e:
+            self.callback_gate.ack_failed(call, e)
+
+    def start_bot(self):
+        try:
+            self.loop.run_until_complete(self.run())
+        except KeyboardInterrupt:
+            logging.info("Interrupted")
+            self.loop.run_until_complete(self.stop())
+        finally:
+            self.loop.close()
+
+    async def run(self):
+        logging.info("Bot started successfully (asyncio mode)")
+        try:
+            await self.bot.polling(non_stop=True, interval=0, timeout=20)
+        finally:
+            await self.stop()
+
+    async def stop(self):
+        if getattr(self, '_stopped', False):
+            return
+        self._stopped = True
+        # shutdown() blocks until queued sends are delivered, which needs
+        # the loop running, so it runs in the executor.
+        await self.loop.run_in_executor(None, self.shutdown)
+        await self.bot.close_session()
+        self.feeder.shutdown(wait=False)
+        self.executor.shutdown(wait=False)
+
+if __name__ == "__main__":
+    bot = AsyncTelegramBot()
+    bot.start_bot()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# bench_callback_ack.py - Tap-to-answer latency and duplicate taps, answered
+# in the handler vs answered on receipt with the in-flight guard
+#
+#   python benchmarks/bench_callback_ack.py --users 500 --work 40 --rtt 30
+#
+# Each user double-taps a button. A handler takes --work ms (DB write and
+# edit), answering a callback costs one --rtt ms round trip.
+
+import os
+import sys
+import time
+import argparse
+import threading
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lanes import LaneDispatcher
+from callbacks import CallbackGate
+from config import CALLBACK_ACK_WORKERS
+
+def taps(users, repeats, rate):
+    started = time.monotonic()
+    for i, (repeat, user_id) in enumerate((r, u) for u in range(users) for r in range(repeats)):
+        delay = started + i / rate - time.monotonic()
+        if delay > 0:
+            time.sleep(delay)
+        yield SimpleNamespace(id=f"{user_id}:{repeat}", from_user=SimpleNamespace(id=user_id),
+                              message=SimpleNamespace(message_id=1), inline_message_id=None, data='q1_0')
+
+def report(label, gate, handled):
+    stats = gate.stats()
+    print(f"{label:<16} ack p50={stats['ack_p50_ms']:>7.1f}ms p95={stats['ack_p95_ms']:>7.1f}ms "
+          f"max={stats['ack_max_ms']:>7.1f}ms  handler runs={handled[0]:<5} dropped={stats['duplicates']}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--repeats", type=int, default=2, help="taps per user")
+    parser.add_argument("--rate", type=float, default=300.0, help="taps per second")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--ack-workers", type=int, default=CALLBACK_ACK_WORKERS)
+    parser.add_argument("--work", type=float, default=40.0, help="handler time in ms")
+    parser.add_argument("--rtt", type=float, default=30.0, help="answerCallbackQuery round trip in ms")
+    args = parser.parse_args()
+    work, rtt = args.work / 1000, args.rtt / 1000
+    print(f"{args.users} users x {args.repeats} taps at {args.rate:.0f}/s, {args.workers} lanes, "
+          f"{args.work}ms handler, {args.rtt}ms round trip")
+
+    # Answered at the end of the handler, every tap handled
+    gate, lanes, handled, lock = CallbackGate(sample_size=1 << 20), LaneDispatcher(workers=args.workers), [0], threading.Lock()
+
+    def in_handler(call, received):
+        time.sleep(work)
+        with lock:
+            handled[0] += 1
+        time.sleep(rtt)
+        gate.acked(received)
+
+    for call in taps(args.users, args.repeats, args.rate):
+        lanes.submit(call.from_user.id, in_handler, call, time.monotonic())
+    lanes.stop()
+    report("in handler", gate, handled)
+
+    # Answered on receipt, repeat taps dropped while the first is pending
+    gate, lanes, handled = CallbackGate(sample_size=1 << 20), LaneDispatcher(workers=args.workers), [0]
+    acks = ThreadPoolExecutor(max_workers=args.ack_workers)
+
+    def answer(call, received):
+        time.sleep(rtt)
+        gate.acked(received)
+
+    def handler(call):
+        time.sleep(work)
+        with lock:
+            handled[0] += 1
+
+    for call in taps(args.users, args.repeats, args.rate):
+        acks.submit(answer, call, time.monotonic())
+        if gate.enter(call):
+            lanes.submit(call.from_user.id, gate.run, handler, call)
+    lanes.stop()
+    acks.shutdown()
+    report("on receipt", gate, handled)
+
+if __name__ == "__main__":
+    main()
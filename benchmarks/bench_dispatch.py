@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# bench_dispatch.py - Funnel dict routing vs the old startswith/if-elif chains
+#
+#   python benchmarks/bench_dispatch.py --updates 1000000
+
+import os
+import sys
+import time
+import random
+import argparse
+from types import SimpleNamespace
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import UserState
+from funnel import Funnel, QUESTIONS
+from keyboards import build_registry
+
+CALLBACK_DATA = ['q1_0', 'q2_3', 'q3_1', 'q4_2', 'follow1_1', 'follow2_0', 'contact_2', 'get_consultation']
+RESUME_STATES = [UserState.WAITING_NAME, UserState.WAITING_FIRST_CHECK, UserState.WAITING_SECOND_CHECK,
+                 UserState.WAITING_RATING, UserState.WAITING_PHONE, UserState.WAITING_CONTACT_TIME,
+                 UserState.QUESTION_2]
+
+def noop(*args):
+    pass
+
+def chain_callback(call):
+    # The routing handle_callback_query used to do
+    data = call.data
+    if data.startswith('q1_'):
+        noop(call)
+    elif data.startswith('q2_'):
+        noop(call)
+    elif data.startswith('q3_'):
+        noop(call)
+    elif data.startswith('q4_'):
+        noop(call)
+    elif data.startswith('follow1_'):
+        noop(call)
+    elif data.startswith('follow2_'):
+        noop(call)
+    elif data.startswith('contact_'):
+        noop(call)
+    elif data == 'get_consultation':
+        noop(call)
+
+def chain_resume(message, state):
+    # The routing resume_user_flow used to do
+    if state == UserState.WAITING_NAME:
+        noop(message)
+    elif state == UserState.WAITING_FIRST_CHECK:
+        noop(message)
+    elif state == UserState.WAITING_SECOND_CHECK:
+        noop(message)
+    elif state == UserState.WAITING_RATING:
+        noop(message)
+    elif state == UserState.WAITING_PHONE:
+        noop(message)
+    elif state == UserState.WAITING_CONTACT_TIME:
+        noop(message)
+    else:
+        noop(message)
+
+def timed(label, func, items):
+    t = time.perf_counter()
+    for item in items:
+        func(item)
+    elapsed = time.perf_counter() - t
+    print(f"{label:<18} {len(items) / elapsed:>12,.0f}/s  {elapsed / len(items) * 1e9:>6.0f} ns/update")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    funnel = Funnel(db=None, outbox=None, keyboards=build_registry(QUESTIONS))
+    for key in list(funnel.callbacks) + ['follow1', 'follow2', 'get_consultation']:
+        funnel.on_callback(key, noop)
+    for state in RESUME_STATES[:-1]:
+        funnel.on_resume(state, noop)
+
+    calls = [SimpleNamespace(data=random.choice(CALLBACK_DATA)) for _ in range(args.updates)]
+    states = [random.choice(RESUME_STATES) for _ in range(args.updates)]
+    message = SimpleNamespace()
+
+    print(f"{args.updates:,} updates")
+    timed("callback chain", chain_callback, calls)
+    timed("callback funnel", funnel.handle_callback, calls)
+    timed("resume chain", lambda state: chain_resume(message, state), states)
+    timed("resume funnel", lambda state: funnel.resume(message, state, None) or noop(message), states)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,89 @@
+#!/usr/bin/env python3
+# bench_ingest.py - Recipient file ingestion: pandas DataFrame vs the
+# streaming RecipientImport (rows/s and peak Python memory)
+#
+#   python benchmarks/bench_ingest.py --rows 1000000 --users 200000
+#
+# The file holds --rows ids drawn from a range twice the size of the users
+# table, so about half are unknown and some repeat.
+
+import io
+import os
+import sys
+import time
+import random
+import argparse
+import tempfile
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+from ingest import RecipientImport
+
+def make_file(path, ids):
+    if path.endswith('.xlsx'):
+        import xlsxwriter
+        workbook = xlsxwriter.Workbook(path, {'constant_memory': True})
+        sheet = workbook.add_worksheet()
+        sheet.write(0, 0, 'userid')
+        for row, user_id in enumerate(ids, 1):
+            sheet.write_number(row, 0, user_id)
+        workbook.close()
+    else:
+        with open(path, 'w') as f:
+            f.write('userid\n')
+            f.writelines(f"{user_id}\n" for user_id in ids)
+
+def measure(label, rows, func):
+    # Timed without tracemalloc (it slows every allocation), then run again for the peak
+    started = time.perf_counter()
+    result = func()
+    seconds = time.perf_counter() - started
+    tracemalloc.start()
+    func()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    print(f"{label:<22} {seconds:>7.2f}s {rows / seconds:>10.0f} rows/s  peak {peak / 1e6:>7.1f} MB  {result}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rows", type=int, default=1000000)
+    parser.add_argument("--users", type=int, default=200000, help="rows in the users table")
+    parser.add_argument("--format", choices=('csv', 'xlsx'), default='csv')
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp()
+    db = DatabaseManager(os.path.join(workdir, "bench.db"), journal=False)
+    with db._write() as cursor:
+        cursor.executemany("INSERT INTO users (user_id, is_blocked) VALUES (?, ?)",
+                           ((user_id, int(user_id % 50 == 0)) for user_id in range(1, args.users + 1)))
+    path = os.path.join(workdir, f"ids.{args.format}")
+    make_file(path, (random.randint(1, args.users * 2) for _ in range(args.rows)))
+    with open(path, 'rb') as f:
+        content = f.read()
+    print(f"{args.rows} ids, {len(content) / 1e6:.1f} MB {args.format}, {args.users} users")
+
+    try:
+        import pandas as pd
+
+        def with_pandas():
+            read = pd.read_excel if args.format == 'xlsx' else pd.read_csv
+            ids = pd.to_numeric(read(io.BytesIO(content))['userid'], errors='coerce').dropna()
+            return f"{len(set(int(user_id) for user_id in ids))} unique"
+        measure("pandas DataFrame", args.rows, with_pandas)
+    except ImportError:
+        print("pandas not installed, skipping")
+
+    def streaming():
+        upload = RecipientImport(db)
+        try:
+            report = upload.load(io.BytesIO(content), path)
+        finally:
+            upload.discard()
+        return f"{report['unique']} unique, {report['unknown']} unknown, {report['blocked']} blocked"
+    measure("streaming + staging", args.rows, streaming)
+    db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+#!/usr/bin/env python3
+# bench_lanes.py - Per-user lanes vs a shared thread pool for update handling
+#
+#   python benchmarks/bench_lanes.py --users 2000 --taps 3 --workers 32
+#
+# Every user sends a burst of updates (a double-tapped button, say) to a
+# handler that takes --work ms. A shared pool runs a user's updates at the
+# same time and out of order; lanes must show zero of either.
+
+import os
+import sys
+import time
+import random
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lanes import LaneDispatcher
+
+class Recorder:
+    def __init__(self, work):
+        self.work = work
+        self.lock = threading.Lock()
+        self.running = set()
+        self.last_seq = {}
+        self.overlaps = 0
+        self.reordered = 0
+        self.done = 0
+
+    def handle(self, user_id, seq):
+        with self.lock:
+            if user_id in self.running:
+                self.overlaps += 1
+            self.running.add(user_id)
+            if seq < self.last_seq.get(user_id, -1):
+                self.reordered += 1
+            self.last_seq[user_id] = seq
+        time.sleep(self.work)
+        with self.lock:
+            self.running.discard(user_id)
+            self.done += 1
+
+def updates(users, taps):
+    # Bursts interleave a little, like real traffic
+    items = [(user_id, seq) for user_id in range(users) for seq in range(taps)]
+    for i in range(0, len(items), taps * 8):
+        chunk = items[i:i + taps * 8]
+        chunk.sort(key=lambda item: (item[1], random.random()))
+        yield from chunk
+
+def run(label, submit, finish, recorder, items):
+    t = time.perf_counter()
+    for user_id, seq in items:
+        submit(user_id, seq)
+    finish()
+    elapsed = time.perf_counter() - t
+    print(f"{label:<12} {recorder.done / elapsed:>8,.0f} updates/s  "
+          f"same-user overlaps={recorder.overlaps:<6} out-of-order={recorder.reordered}")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--taps", type=int, default=3, help="updates per user")
+    parser.add_argument("--workers", type=int, default=32)
+    parser.add_argument("--work", type=float, default=2.0, help="handler time in ms")
+    args = parser.parse_args()
+    work = args.work / 1000
+    items = list(updates(args.users, args.taps))
+    print(f"{len(items):,} updates from {args.users:,} users, {args.workers} workers, {args.work}ms per update")
+
+    recorder = Recorder(work)
+    pool = ThreadPoolExecutor(max_workers=args.workers)
+    run("shared pool", lambda user_id, seq: pool.submit(recorder.handle, user_id, seq),
+        lambda: pool.shutdown(wait=True), recorder, items)
+
+    recorder = Recorder(work)
+    lanes = LaneDispatcher(workers=args.workers)
+    run("lanes", lambda user_id, seq: lanes.submit(user_id, recorder.handle, user_id, seq),
+        lambda: lanes.stop(wait=True), recorder, items)
+
+    stats = lanes.stats()
+    print(f"lanes: avg wait {stats['avg_wait_ms']:.1f}ms, max wait {stats['max_wait_ms']:.1f}ms, "
+          f"max depth {stats['max_depth']}, occupancy avg {stats['occupancy_avg']:.2f} max {stats['occupancy_max']:.2f}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,85 @@
+#!/usr/bin/env python3
+# bench_user_records.py - Memory of per-row dicts vs compact User records
+#
+# Builds the same N user rows the way sqlite3 hands them over (fresh str
+# objects per row) and measures the retained memory of each form.
+#
+#   python benchmarks/bench_user_records.py --users 1000000
+
+import os
+import sys
+import gc
+import argparse
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from messages import question_1_options, question_2_options, question_3_options, question_4_options, contact_time_options
+from models import UserRowFactory, SESSION_COLUMNS
+
+COLUMNS = (
+    'user_id', 'username', 'first_name', 'last_name', 'name', 'phone', 'state',
+    'question_1', 'question_2', 'question_3', 'question_4', 'contact_time',
+    'channel_link', 'selected_expert', 'registration_date', 'phone_date',
+    'is_completed', 'is_vip', 'is_hot_lead'
+)
+
+def fresh(text):
+    """A new str object with the same value, like a value decoded by sqlite3."""
+    return (text + ' ')[:-1]
+
+def make_row(i):
+    return (
+        i, fresh(f"user{i}"), fresh("Sara"), None, fresh("سارا"), fresh(f"+98912{i:07d}"), fresh("completed"),
+        fresh(question_1_options[i % 4]), fresh(question_2_options[i % 4]),
+        fresh(question_3_options[i % 3]), fresh(question_4_options[i % 4]),
+        fresh(contact_time_options[i % 3]), fresh(f"https://t.me/+invite{i}"),
+        fresh("forough" if i % 5 < 3 else "sadegh"), fresh("2026-10-01 12:00:00"),
+        fresh("2026-10-01 13:00:00"), 1, 1, i % 2
+    )
+
+class FakeCursor:
+    def __init__(self, columns):
+        self.description = tuple((column, None, None, None, None, None, None) for column in columns)
+
+def measure(label, build, users):
+    gc.collect()
+    tracemalloc.start()
+    records = build(users)
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:>24}: {current / 2**20:8.1f} MiB  ({current / users:6.0f} bytes/user)")
+    del records
+    return current
+
+def as_dicts(users):
+    return [dict(zip(COLUMNS, make_row(i))) for i in range(users)]
+
+def as_records(users):
+    factory = UserRowFactory(COLUMNS, loader=None)
+    cursor = FakeCursor(COLUMNS)
+    return [factory(cursor, make_row(i)) for i in range(users)]
+
+def as_session_records(users):
+    factory = UserRowFactory(COLUMNS, loader=None)
+    cursor = FakeCursor(SESSION_COLUMNS)
+    positions = [COLUMNS.index(column) for column in SESSION_COLUMNS]
+    records = []
+    for i in range(users):
+        row = make_row(i)
+        records.append(factory(cursor, tuple(row[p] for p in positions)))
+    return records
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=1_000_000)
+    args = parser.parse_args()
+
+    baseline = measure("dict per row", as_dicts, args.users)
+    compact = measure("User (all columns)", as_records, args.users)
+    session = measure("User (session columns)", as_session_records, args.users)
+    print(f"User records use {compact / baseline:.0%} of the dict form "
+          f"({session / baseline:.0%} for session-cache records)")
+
+if __name__ == "__main__":
+    main()
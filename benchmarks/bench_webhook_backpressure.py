@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+# bench_webhook_backpressure.py - Does a burst of slow updates reach the
+# webhook's 503 path? Lanes with effectively no capacity vs bounded lanes
+#
+#   python benchmarks/bench_webhook_backpressure.py --updates 3000 --work 50
+#
+# A real WebhookServer (on a free local port) feeds a LaneDispatcher whose
+# handlers take --work ms, like the bot's process_update. With unbounded
+# lanes the webhook queue stays nearly empty and memory grows in the lanes;
+# bounded lanes stall the workers, the queue fills and Telegram gets 503s.
+
+import os
+import sys
+import time
+import logging
+import argparse
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from lanes import LaneDispatcher
+from webhook import WebhookServer, replay, synthetic_updates
+
+def run(label, args, lane_capacity):
+    lanes = LaneDispatcher(workers=args.lanes, name=label, capacity=lane_capacity, timeout=60)
+
+    def process(payload):
+        user_id = payload['message']['from']['id']
+        lanes.submit(user_id, time.sleep, args.work / 1000)
+
+    server = WebhookServer(process, host='127.0.0.1', port=0, secret='', workers=args.workers,
+                           queue_size=args.queue_size, enqueue_timeout=args.enqueue_timeout)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    url = f"http://127.0.0.1:{server.httpd.server_address[1]}{server.path}"
+
+    started = time.perf_counter()
+    statuses, latencies = replay(url, synthetic_updates('start', args.updates), args.concurrency, secret='')
+    elapsed = time.perf_counter() - started
+    stats = server.stats()
+    lane_stats = lanes.stats()
+    server.stop()
+    lanes.stop()
+    print(f"{label:<10} {elapsed:>6.2f}s  statuses={statuses}  webhook max depth {stats['max_depth']}/{args.queue_size}  "
+          f"lane max depth {lane_stats['max_depth']}  ack p99 {latencies[int(len(latencies) * 0.99)] * 1000:.0f}ms")
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--updates", type=int, default=3000)
+    parser.add_argument("--work", type=float, default=50.0, help="handler time in ms")
+    parser.add_argument("--lanes", type=int, default=8)
+    parser.add_argument("--lane-size", type=int, default=10, help="bounded lane capacity")
+    parser.add_argument("--workers", type=int, default=8, help="webhook workers")
+    parser.add_argument("--queue-size", type=int, default=200)
+    parser.add_argument("--enqueue-timeout", type=float, default=0.5)
+    parser.add_argument("--concurrency", type=int, default=64)
+    args = parser.parse_args()
+    logging.getLogger().setLevel(logging.ERROR)   # one "queue full" warning per 503 otherwise
+    print(f"{args.updates} updates, {args.work}ms per handler, {args.lanes} lanes, {args.workers} webhook workers, "
+          f"queue {args.queue_size}, 503 after {args.enqueue_timeout}s")
+
+    run("unbounded", args, 1 << 30)
+    run("bounded", args, args.lane_size)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# bench_write_behind.py - Synchronous commits vs write-behind group commit
+#
+# Simulates funnel button taps: each tap stores an answer, advances the
+# state and saves the question message id (three writes per tap).
+#
+#   python benchmarks/bench_write_behind.py --users 2000 --threads 8
+
+import os
+import sys
+import time
+import argparse
+import tempfile
+import threading
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+def run(write_behind, users, threads):
+    with tempfile.TemporaryDirectory() as tmp:
+        db = DatabaseManager(os.path.join(tmp, "bench.db"), journal=False, write_behind=write_behind)
+        for user_id in range(users):
+            db.add_user(user_id)
+
+        def tap(worker):
+            for user_id in range(worker, users, threads):
+                for question in range(1, 5):
+                    db.update_question_answer(user_id, question, f"answer {question}")
+                    db.update_user_state(user_id, f"question_{question + 1}")
+                    db.save_message_id(user_id, question, "question")
+
+        started = time.perf_counter()
+        workers = [threading.Thread(target=tap, args=(i,)) for i in range(threads)]
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            worker.join()
+        queued = time.perf_counter() - started
+        db.close()
+        total = time.perf_counter() - started
+
+        # Verify nothing was lost by the final flush
+        check = DatabaseManager(os.path.join(tmp, "bench.db"), journal=False, write_behind=False)
+        missing = sum(1 for user_id in range(users) if check.get_user_state(user_id) != "question_5")
+        check.close()
+        return queued, total, missing
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--users", type=int, default=2000)
+    parser.add_argument("--threads", type=int, default=8)
+    args = parser.parse_args()
+
+    writes = args.users * 4 * 3
+    for label, mode in (("synchronous", False), ("write-behind", True)):
+        queued, total, missing = run(mode, args.users, args.threads)
+        print(f"{label:>13}: {writes} writes, handlers done in {queued:.2f}s "
+              f"({writes / queued:,.0f} writes/s), durable after {total:.2f}s, lost={missing}")
+
+if __name__ == "__main__":
+    main()
@@ -1,16 +1,26 @@
 # bot.py - Main bot entry point
 
 import telebot
+import queue
 import logging
-import threading
 import time
 import uuid
 import random
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from telebot import types
 from config import *
 from database import DatabaseManager
 from admin import AdminPanel
+from scheduler import Scheduler
+from outbox import Outbox, REMINDER
+from sequences import SequenceRunner
+from funnel import Funnel, QUESTIONS
+from keyboards import build_registry
+from jobs import JobRunner
+from lanes import LaneDispatcher
+from callbacks import CallbackGate
+from invites import InvitePool
+from media import MediaRegistry
 from messages import *
 
 # Setup logging
@@ -24,48 +34,206 @@ logging.basicConfig(
 )
 
 class TelegramBot:
-    def __init__(self):
-        self.bot = telebot.TeleBot(BOT_TOKEN)
-        self.db = DatabaseManager()
-        self.admin = AdminPanel(self.bot, self.db)
+    def __init__(self, db_file=None):
+        self.bot = self.create_bot()
+        self.db = DatabaseManager(db_file)
         
-        # Timer management
-        self.timers = {}
-        self.final_photo_timers = {}
+        # Every outgoing call is paced through one rate-limited dispatcher
+        self.outbox = self.create_outbox()
         
-        # Load pending timers from DB
-        self.timers = self.db.get_pending_timers()
-        self.final_photo_timers = self.db.get_pending_final_photo_timers()
+        # Admin menu and bulk broadcasts; interrupted broadcasts resume
+        self.admin = AdminPanel(self.db, self.outbox, self.call_api)
+        self.admin.start()
+        
+        # Photos, voices and videos resolved to working file_ids
+        self.media = MediaRegistry(self.db, self.call_api, self.outbox)
+        self.media.start()
+        
+        # Static keyboards are serialized once; per-user ones are templated
+        self.keyboards = build_registry(QUESTIONS)
+        
+        # Questionnaire table plus callback/state routing
+        self.setup_funnel()
+        
+        # Handlers run on per-user serial lanes: one update per user at a
+        # time, in arrival order, with users spread over LANE_WORKERS threads
+        self.lanes = LaneDispatcher()
+        
+        # Timer management: reminder jobs persist in the DB, the heap-based
+        # scheduler only wakes the job runner when the next one falls due
+        self.scheduler = self.create_scheduler()
+        self.jobs = JobRunner(self.db, self.scheduler)
+        # `states`: a reminder is skipped once the user has moved past it.
+        # Handlers let errors propagate so the runner retries them with backoff
+        self.jobs.register('first_reminder', lambda job: self.send_first_follow_up(job['payload']['chat_id'], job['user_id']),
+                           states=(UserState.WAITING_FIRST_CHECK,))
+        self.jobs.register('second_reminder', lambda job: self.send_second_follow_up(job['payload']['chat_id'], job['user_id']),
+                           states=(UserState.WAITING_FIRST_CHECK, UserState.WAITING_SECOND_CHECK))
+        self.jobs.register('final_photo', lambda job: self.send_final_photo(job['payload']['chat_id'], job['user_id']),
+                           states=(UserState.WAITING_PHONE,))
+        
+        # Multi-message flows with pauses, run as jobs instead of time.sleep;
+        # due steps go through the user's lane like the user's own updates
+        self.sequences = SequenceRunner(self.jobs, self.lanes.submit)
+        self.setup_sequences()
+        self.jobs.start()
+        
+        # Course channel invite links are minted ahead of registration
+        self.invites = InvitePool(self.db, self.scheduler, self.create_invite_link, MINI_COURSE_CHANNEL_ID)
+        self.invites.start()
 
+        # Button taps are answered before they are queued
+        self.callback_gate = CallbackGate()
+        self.ack_executor = ThreadPoolExecutor(max_workers=CALLBACK_ACK_WORKERS, thread_name_prefix="ack")
         self.setup_handlers()
+    
+    # Runtime hooks: AsyncTelegramBot (async_bot.py) overrides these and
+    # shares every handler below unchanged.
+    
+    def create_bot(self):
+        # Not threaded: handlers only enqueue onto self.lanes, which does the work
+        return telebot.TeleBot(BOT_TOKEN, threaded=False)
+    
+    def create_outbox(self):
+        return Outbox(self.bot)
+    
+    def create_scheduler(self):
+        return Scheduler()
+    
+    def wrap_handler(self, handler, callback=False):
+        """Adapt a handler method to what the bot library calls.
         
-        # Start background threads
-        threading.Thread(target=self.reminder_worker, daemon=True).start()
-        threading.Thread(target=self.final_photo_worker, daemon=True).start()
+        The returned callable only queues the update on its user's lane,
+        waiting while that lane is full. Callback queries are answered
+        first, and a repeat tap on a message whose previous tap is still
+        pending is not queued at all.
+        """
+        if callback:
+            def dispatch(call):
+                self.answer_callback(call, time.monotonic())
+                if self.callback_gate.enter(call):
+                    if not self.enqueue(call.from_user.id, self.callback_gate.run, handler, call):
+                        self.callback_gate.leave(call)
+        else:
+            def dispatch(update):
+                self.enqueue(self.lane_key(update), handler, update)
+        return dispatch
+    
+    def enqueue(self, key, func, *args):
+        """Queue a handler on the key's lane; False if the lane never made room."""
+        try:
+            self.lanes.submit(key, func, *args)
+            return True
+        except queue.Full as e:
+            logging.error(f"Dropping update for {key}: {e}")
+            return False
+    
+    @staticmethod
+    def lane_key(update):
+        """User id of a message or callback query (chat id if it has no sender)."""
+        user = getattr(update, 'from_user', None)
+        if user is not None:
+            return user.id
+        return update.chat.id if hasattr(update, 'chat') else update.message.chat.id
+    
+    def call_api(self, method, *args, **kwargs):
+        """Blocking Bot API call outside the outbox (e.g. creating invite links)."""
+        return getattr(self.bot, method)(*args, **kwargs)
+    
+    def answer_callback(self, call, received):
+        """Stop the client's spinner without waiting for the handler."""
+        self.ack_executor.submit(self._answer_callback, call, received)
+    
+    def _answer_callback(self, call, received):
+        try:
+            self.call_api('answer_callback_query', call.id)
+            self.callback_gate.acked(received)
+        except Exception as e:
+            self.callback_gate.ack_failed(call, e)
     
     def setup_handlers(self):
         """Initialize all bot message handlers."""
+        handle = self.wrap_handler
         
-        @self.bot.message_handler(commands=['start'])
-        def handle_start(message):
-            self.handle_start_command(message)
+        self.bot.message_handler(commands=['start'])(handle(self.handle_start_command))
+        self.bot.message_handler(content_types=['text', 'photo', 'video', 'animation'])(handle(self.handle_text_message))
+        self.bot.message_handler(content_types=['contact'])(handle(self.handle_contact_message))
+        self.bot.message_handler(content_types=['document', 'voice', 'audio', 'video_note', 'sticker'])(
+            handle(self.handle_document_message))
+        self.bot.callback_query_handler(func=lambda call: True)(handle(self.handle_callback_query, callback=True))
+    
+    def handle_document_message(self, message):
+        """Files and other media only matter to admins (bulk recipients and messages)."""
+        if self.admin.is_admin(message.from_user.id):
+            self.admin.handle_admin_message(message)
+    
+    def setup_funnel(self):
+        """Register the non-question funnel steps; questions come from funnel.QUESTIONS."""
+        self.funnel = Funnel(self.db, self.outbox, self.keyboards, actions={
+            'complete_registration': self.complete_registration
+        })
         
-        @self.bot.message_handler(content_types=['text', 'photo', 'video', 'animation'])
-        def handle_text_message(message):
-            self.handle_text_message(message)
+        self.funnel.on_callback('follow1', self.handle_follow_up_1)
+        self.funnel.on_callback('follow2', self.handle_follow_up_2)
+        self.funnel.on_callback('get_consultation', self.handle_get_consultation)
         
-        @self.bot.message_handler(content_types=['contact'])
-        def handle_contact(message):
-            self.handle_contact_message(message)
+        self.funnel.on_text(UserState.WAITING_NAME, self.handle_name_input)
+        self.funnel.on_text(UserState.WAITING_RATING, self.handle_rating_input)
         
-        @self.bot.message_handler(content_types=['document'])
-        def handle_document(message):
-            if self.admin.is_admin(message.from_user.id):
-                self.admin.handle_admin_message(message)
-        
-        @self.bot.callback_query_handler(func=lambda call: True)
-        def handle_callback(call):
-            self.handle_callback_query(call)
+        self.funnel.on_resume(UserState.WAITING_NAME,
+                              lambda message, user_data: self.outbox.send_message(message.chat.id, name_request))
+        self.funnel.on_resume(UserState.WAITING_FIRST_CHECK,
+                              lambda message, user_data: self.send_first_follow_up(message.chat.id, message.from_user.id))
+        self.funnel.on_resume(UserState.WAITING_SECOND_CHECK,
+                              lambda message, user_data: self.send_second_follow_up(message.chat.id, message.from_user.id))
+        self.funnel.on_resume(UserState.WAITING_RATING,
+                              lambda message, user_data: self.outbox.send_message(message.chat.id, rating_request))
+        self.funnel.on_resume(UserState.WAITING_PHONE,
+                              lambda message, user_data: self.request_phone_number_keyboard(message.chat.id))
+        self.funnel.on_resume(UserState.WAITING_CONTACT_TIME,
+                              lambda message, user_data: self.send_contact_time_question(message.chat.id))
+    
+    def setup_sequences(self):
+        """Declare the delayed message sequences: (seconds before step, step)."""
+        self.sequences.define('welcome', [
+            (0, self.text_step(msg_1)),
+            (1, self.send_name_request)
+        ])
+        self.sequences.define('intro', [
+            (0, self.text_step(msg_three_steps)),
+            (2, self.text_step(msg_voice_instruction)),
+            (2, self.send_instagram_step),
+            (2, self.send_expert_content),
+            (2, lambda chat_id, user_id, context: self.start_questions(chat_id, user_id, context['name']))
+        ])
+        self.sequences.define('registration', [
+            (0, self.send_registration_success),
+            (2, self.send_watch_reminder)
+        ])
+        important_voice = [
+            (0, self.text_step(important_voice_msg)),
+            (1, self.send_important_voice_step),
+            (2, lambda chat_id, user_id, context: self.request_phone_number_keyboard(chat_id))
+        ]
+        self.sequences.define('important_voice', important_voice)
+        self.sequences.define('course_intro', [
+            (0, self.text_step(course_intro)),
+            (2, self.video_step(testimonial_intro, "testimonial_video", "ویدیو نظرات اینجا ارسال می‌شود")),
+            (2, self.video_step(success_stories, "success_stories_video", "ویدیو")),
+            (2, important_voice[0][1])
+        ] + important_voice[1:])
+    
+    def text_step(self, text):
+        """Sequence step sending a fixed text."""
+        return lambda chat_id, user_id, context: self.outbox.send_message(chat_id, text)
+    
+    def video_step(self, text, video, placeholder):
+        """Sequence step sending a text followed by a video asset (or a placeholder text)."""
+        def step(chat_id, user_id, context):
+            self.outbox.send_message(chat_id, text)
+            if self.media.send(chat_id, video) is None:
+                self.outbox.send_message(chat_id, placeholder)
+        return step
     
     def handle_start_command(self, message):
         """Handle /start command."""
@@ -79,14 +247,16 @@ class TelegramBot:
                 self.admin.show_admin_menu(message.chat.id)
                 return
             
-            if self.db.user_exists(user_id):
-                user_data = self.db.get_user_data(user_id)
-                if user_data and user_data.get('is_completed'):
-                    self.bot.send_message(message.chat.id, "شما قبلاً فرآیند ثبت‌نام را تکمیل کرده‌اید! ✅")
+            user_data = self.db.get_session(user_id)
+            if user_data and user_data.get('is_blocked'):
+                # Unblocked the bot; include them in broadcasts again
+                self.db.set_user_blocked(user_id, False)
+            if user_data:
+                if user_data.get('is_completed'):
+                    self.outbox.send_message(message.chat.id, "شما قبلاً فرآیند ثبت‌نام را تکمیل کرده‌اید! ✅")
                     return
                 else:
-                    state = self.db.get_user_state(user_id)
-                    self.resume_user_flow(message, state)
+                    self.resume_user_flow(message, user_data['state'], user_data)
                     return
             
             self.db.add_user(user_id, username, first_name, last_name)
@@ -94,97 +264,48 @@ class TelegramBot:
             
         except Exception as e:
             logging.error(f"Error in start command: {e}")
-            self.bot.send_message(message.chat.id, error_general)
+            self.outbox.send_message(message.chat.id, error_general)
     
-    def resume_user_flow(self, message, state):
+    def resume_user_flow(self, message, state, user_data=None):
         """Resume user interaction based on last state."""
         try:
             chat_id = message.chat.id
             user_id = message.from_user.id
             
-            if state == UserState.WAITING_NAME:
-                self.bot.send_message(chat_id, name_request)
-            elif state == UserState.WAITING_FIRST_CHECK:
-                self.send_first_follow_up(chat_id, user_id)
-            elif state == UserState.WAITING_SECOND_CHECK:
-                self.send_second_follow_up(chat_id, user_id)
-            elif state == UserState.WAITING_RATING:
-                self.bot.send_message(chat_id, rating_request)
-            elif state == UserState.WAITING_PHONE:
-                self.request_phone_number_keyboard(chat_id)
-            elif state == UserState.WAITING_CONTACT_TIME:
-                self.send_contact_time_question(chat_id)
+            if self.funnel.resume(message, state, user_data):
+                return
+            
+            user_data = user_data or self.db.get_session(user_id)
+            if user_data and user_data.get('name'):
+                self.send_new_intro_messages(message, user_data['name'])
             else:
-                user_data = self.db.get_user_data(user_id)
-                if user_data and user_data.get('name'):
-                    self.send_new_intro_messages(message, user_data['name'])
-                else:
-                    self.bot.send_message(chat_id, name_request)
-                    self.db.update_user_state(user_id, UserState.WAITING_NAME)
+                self.outbox.send_message(chat_id, name_request)
+                self.db.update_user_state(user_id, UserState.WAITING_NAME)
                     
         except Exception as e:
             logging.error(f"Error resuming user flow: {e}")
     
     def send_welcome_messages(self, message):
         """Send initial welcome messages."""
-        try:
-            chat_id = message.chat.id
-            user_id = message.from_user.id
-            
-            self.bot.send_message(chat_id, msg_1)
-            time.sleep(1)
-            
-            self.bot.send_message(chat_id, name_request)
-            self.db.update_user_state(user_id, UserState.WAITING_NAME)
-            
-        except Exception as e:
-            logging.error(f"Error sending welcome messages: {e}")
+        self.sequences.start('welcome', message.from_user.id, message.chat.id)
+    
+    def send_name_request(self, chat_id, user_id, context=None):
+        self.outbox.send_message(chat_id, name_request)
+        self.db.update_user_state(user_id, UserState.WAITING_NAME)
     
     def send_new_intro_messages(self, message, name):
         """Send intro sequence after name is received."""
-        try:
-            chat_id = message.chat.id
-            user_id = message.from_user.id
-            
-            self.bot.send_message(chat_id, msg_three_steps)
-            time.sleep(2)
-            
-            self.bot.send_message(chat_id, msg_voice_instruction)
-            time.sleep(2)
-            
-            markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton("📱 دنبال کردن اینستاگرام", url=f"https://{instagram_link}"))
-            
-            self.bot.send_message(chat_id, msg_instagram, reply_markup=markup)
-            time.sleep(2)
-            
-            self.send_expert_content(chat_id, user_id, name)
-            
-        except Exception as e:
-            logging.error(f"Error sending new intro messages: {e}")
+        self.sequences.start('intro', message.from_user.id, message.chat.id, name=name)
     
-    def send_expert_content(self, chat_id, user_id, name):
+    def send_instagram_step(self, chat_id, user_id, context):
+        self.outbox.send_message(chat_id, msg_instagram, reply_markup=self.keyboards.get('instagram'))
+    
+    def send_expert_content(self, chat_id, user_id, context):
         """Select expert and send their content."""
-        try:
-            expert = self.select_random_expert()
-            self.db.save_selected_expert(user_id, expert)
-            
-            if expert == "forough":
-                if FOROUGH_PHOTO_FILE_ID:
-                    self.bot.send_photo(chat_id, FOROUGH_PHOTO_FILE_ID)
-                if FOROUGH_VOICE_1_FILE_ID:
-                    self.bot.send_voice(chat_id, FOROUGH_VOICE_1_FILE_ID)
-            else:
-                if SADEGH_PHOTO_FILE_ID:
-                    self.bot.send_photo(chat_id, SADEGH_PHOTO_FILE_ID)
-                if SADEGH_VOICE_1_FILE_ID:
-                    self.bot.send_voice(chat_id, SADEGH_VOICE_1_FILE_ID)
-            
-            time.sleep(2)
-            self.start_questions(chat_id, user_id, name)
-            
-        except Exception as e:
-            logging.error(f"Error sending expert content: {e}")
+        expert = self.select_random_expert()
+        self.db.save_selected_expert(user_id, expert)
+        
+        self.media.send_many(chat_id, [f"{expert}_photo", f"{expert}_voice_1"])
     
     def select_random_expert(self):
         """Select random expert (60% Forough, 40% Sadegh)."""
@@ -200,11 +321,7 @@ class TelegramBot:
                 return
             
             state = self.db.get_user_state(user_id)
-            
-            if state == UserState.WAITING_NAME:
-                self.handle_name_input(message)
-            elif state == UserState.WAITING_RATING:
-                self.handle_rating_input(message)
+            self.funnel.handle_text(message, state)
                 
         except Exception as e:
             logging.error(f"Error handling text message: {e}")
@@ -216,7 +333,7 @@ class TelegramBot:
             name = message.text.strip()
             
             if len(name) < 2:
-                self.bot.send_message(message.chat.id, "لطفاً نام معتبری وارد کنید.")
+                self.outbox.send_message(message.chat.id, "لطفاً نام معتبری وارد کنید.")
                 return
             
             self.db.update_user_name(user_id, name)
@@ -227,24 +344,9 @@ class TelegramBot:
     
     def start_questions(self, chat_id, user_id, name):
         """Begin the questionnaire."""
-        try:
-            question_text = question_1.format(name=name)
-            markup = self.create_question_markup(question_1_options, "q1_")
-            
-            sent_message = self.bot.send_message(chat_id, question_text, reply_markup=markup)
-            
-            self.db.save_message_id(user_id, sent_message.message_id, "question")
-            self.db.update_user_state(user_id, UserState.QUESTION_1)
-            
-        except Exception as e:
-            logging.error(f"Error starting questions: {e}")
-    
-    def create_question_markup(self, options, prefix):
-        """Generate inline keyboard for questions."""
-        markup = types.InlineKeyboardMarkup()
-        for i, option in enumerate(options):
-            markup.add(types.InlineKeyboardButton(option, callback_data=f"{prefix}{i}"))
-        return markup
+        sent_message = self.funnel.ask(chat_id, 'q1', name=name).result()
+        self.db.save_message_id(user_id, sent_message.message_id, "question")
+        self.db.update_user_state(user_id, UserState.QUESTION_1)
     
     def handle_callback_query(self, call):
         """Handle inline button clicks."""
@@ -255,123 +357,58 @@ class TelegramBot:
             if self.admin.is_admin(user_id) and data.startswith('bulk_'):
                 self.admin.handle_bulk_callback(call)
                 return
+            if self.admin.is_admin(user_id) and data.startswith('admin_'):
+                self.admin.handle_admin_callback(call)
+                return
             
-            if data.startswith('q1_'):
-                self.handle_question_1_answer(call)
-            elif data.startswith('q2_'):
-                self.handle_question_2_answer(call)
-            elif data.startswith('q3_'):
-                self.handle_question_3_answer(call)
-            elif data.startswith('q4_'):
-                self.handle_question_4_answer(call)
-            elif data.startswith('follow1_'):
-                self.handle_follow_up_1(call)
-            elif data.startswith('follow2_'):
-                self.handle_follow_up_2(call)
-            elif data.startswith('contact_'):
-                self.handle_contact_time(call)
-            elif data == 'get_consultation':
-                self.bot.delete_message(call.message.chat.id, call.message.message_id)
-                self.send_important_voice(call.message.chat.id, user_id)
+            self.funnel.handle_callback(call)
                 
         except Exception as e:
             logging.error(f"Error handling callback: {e}")
     
-    def handle_question_1_answer(self, call):
-        try:
-            user_id = call.from_user.id
-            option_index = int(call.data.split('_')[1])
-            answer = question_1_options[option_index]
-            
-            self.db.update_question_answer(user_id, 1, answer)
-            markup = self.create_question_markup(question_2_options, "q2_")
-            
-            self.bot.edit_message_text(question_2, call.message.chat.id, call.message.message_id, reply_markup=markup)
-            self.db.update_user_state(user_id, UserState.QUESTION_2)
-            
-        except Exception as e:
-            logging.error(f"Error handling question 1 answer: {e}")
-    
-    def handle_question_2_answer(self, call):
-        try:
-            user_id = call.from_user.id
-            option_index = int(call.data.split('_')[1])
-            answer = question_2_options[option_index]
-            
-            self.db.update_question_answer(user_id, 2, answer)
-            markup = self.create_question_markup(question_3_options, "q3_")
-            
-            self.bot.edit_message_text(question_3, call.message.chat.id, call.message.message_id, reply_markup=markup)
-            self.db.update_user_state(user_id, UserState.QUESTION_3)
-            
-        except Exception as e:
-            logging.error(f"Error handling question 2 answer: {e}")
-    
-    def handle_question_3_answer(self, call):
-        try:
-            user_id = call.from_user.id
-            option_index = int(call.data.split('_')[1])
-            answer = question_3_options[option_index]
-            
-            self.db.update_question_answer(user_id, 3, answer)
-            markup = self.create_question_markup(question_4_options, "q4_")
-            
-            self.bot.edit_message_text(question_4, call.message.chat.id, call.message.message_id, reply_markup=markup)
-            self.db.update_user_state(user_id, UserState.QUESTION_4)
-            
-        except Exception as e:
-            logging.error(f"Error handling question 3 answer: {e}")
-    
-    def handle_question_4_answer(self, call):
-        try:
-            user_id = call.from_user.id
-            option_index = int(call.data.split('_')[1])
-            answer = question_4_options[option_index]
-            
-            self.db.update_question_answer(user_id, 4, answer)
-            self.bot.delete_message(call.message.chat.id, call.message.message_id)
-            self.complete_registration(call.message.chat.id, user_id)
-            
-        except Exception as e:
-            logging.error(f"Error handling question 4 answer: {e}")
+    def handle_get_consultation(self, call, option_index=None):
+        self.outbox.delete_message(call.message.chat.id, call.message.message_id)
+        self.send_important_voice(call.message.chat.id, call.from_user.id)
     
     def complete_registration(self, chat_id, user_id):
         """Finalize registration and provide course link."""
-        try:
-            user_data = self.db.get_user_data(user_id)
-            name = user_data.get('name', 'کاربر')
-            
-            invite_link = self.generate_invite_link()
-            channel_link = channel_link_template.format(invite_link=invite_link)
-            
-            self.db.update_channel_link(user_id, channel_link)
-            
-            success_msg = registration_success.format(name=name)
-            markup = types.InlineKeyboardMarkup()
-            markup.add(types.InlineKeyboardButton("🎥 مشاهده مینی دوره", url=channel_link))
-            
-            self.bot.send_message(chat_id, success_msg, reply_markup=markup)
-            time.sleep(2)
-            
-            self.bot.send_message(chat_id, watch_reminder)
-            self.schedule_reminders(user_id, chat_id)
-            
-            self.db.update_user_state(user_id, UserState.WAITING_FIRST_CHECK)
-            
-        except Exception as e:
-            logging.error(f"Error completing registration: {e}")
+        self.sequences.start('registration', user_id, chat_id)
     
-    def generate_invite_link(self):
-        """Generate single-use invite link."""
-        try:
-            invite_link = self.bot.create_chat_invite_link(
-                chat_id=MINI_COURSE_CHANNEL_ID,
-                member_limit=1
-            )
-            return invite_link.invite_link
-        except Exception as e:
-            logging.error(f"Error generating invite link: {e}")
+    def send_registration_success(self, chat_id, user_id, context):
+        user_data = self.db.get_session(user_id)
+        name = user_data.get('name', 'کاربر')
+        
+        invite_link = self.generate_invite_link(user_id)
+        channel_link = channel_link_template.format(invite_link=invite_link)
+        
+        self.db.update_channel_link(user_id, channel_link)
+        
+        success_msg = registration_success.format(name=name)
+        markup = self.keyboards.render('course_link', channel_link=channel_link)
+        
+        self.outbox.send_message(chat_id, success_msg, reply_markup=markup)
+    
+    def send_watch_reminder(self, chat_id, user_id, context):
+        self.outbox.send_message(chat_id, watch_reminder)
+        self.schedule_reminders(user_id, chat_id)
+        
+        self.db.update_user_state(user_id, UserState.WAITING_FIRST_CHECK)
+    
+    def generate_invite_link(self, user_id):
+        """Single-use invite link for a user, taken from the pool."""
+        invite_link = self.invites.take(user_id)
+        if invite_link is None:
+            logging.error(f"No invite link for user {user_id}, sending the default link")
             return "https://t.me/your_default_link"
+        return invite_link
+    
+    def create_invite_link(self):
+        """Mint one single-use invite link (runs in the pool refill)."""
+        return self.call_api(
+            'create_chat_invite_link',
+            chat_id=MINI_COURSE_CHANNEL_ID,
+            member_limit=1
+        ).invite_link
     
     def schedule_reminders(self, user_id, chat_id):
         """Set up follow-up timers."""
@@ -379,115 +416,50 @@ class TelegramBot:
         first_reminder = now + timedelta(seconds=FIRST_REMINDER_DELAY)
         second_reminder = first_reminder + timedelta(seconds=SECOND_REMINDER_DELAY)
         
-        self.db.add_timer(user_id, first_reminder, second_reminder)
-        self.timers[user_id] = {
-            'first_reminder': first_reminder,
-            'second_reminder': second_reminder,
-            'chat_id': chat_id
-        }
-    
-    def reminder_worker(self):
-        """Background thread for checking timers."""
-        while True:
-            try:
-                now = datetime.now()
-                completed_timers = []
-                
-                for user_id, timer_data in self.timers.items():
-                    if (timer_data.get('first_reminder') and 
-                        now >= timer_data['first_reminder'] and 
-                        not timer_data.get('first_sent')):
-                        
-                        self.send_first_follow_up(timer_data['chat_id'], user_id)
-                        self.timers[user_id]['first_sent'] = True
-                    
-                    if (timer_data.get('second_reminder') and 
-                        now >= timer_data['second_reminder'] and 
-                        not timer_data.get('second_sent')):
-                        
-                        self.send_second_follow_up(timer_data['chat_id'], user_id)
-                        self.timers[user_id]['second_sent'] = True
-                        completed_timers.append(user_id)
-                
-                for user_id in completed_timers:
-                    del self.timers[user_id]
-                
-                time.sleep(60)
-                
-            except Exception as e:
-                logging.error(f"Error in reminder worker: {e}")
-                time.sleep(60)
+        self.jobs.add('first_reminder', user_id, first_reminder, {'chat_id': chat_id})
+        self.jobs.add('second_reminder', user_id, second_reminder, {'chat_id': chat_id})
     
-    def final_photo_worker(self):
-        """Background thread for final photo timer."""
-        while True:
-            try:
-                now = datetime.now()
-                completed_timers = []
-                
-                for user_id, timer_data in self.final_photo_timers.items():
-                    if now >= timer_data['send_time'] and not timer_data.get('sent'):
-                        self.send_final_photo(timer_data['chat_id'], user_id)
-                        self.final_photo_timers[user_id]['sent'] = True
-                        completed_timers.append(user_id)
-                
-                for user_id in completed_timers:
-                    del self.final_photo_timers[user_id]
-                
-                time.sleep(300)
-                
-            except Exception as e:
-                logging.error(f"Error in final photo worker: {e}")
-                time.sleep(300)
+    def cancel_reminders(self, user_id):
+        self.jobs.cancel(user_id, ('first_reminder', 'second_reminder'))
     
     def send_first_follow_up(self, chat_id, user_id):
-        try:
-            markup = self.create_question_markup(follow_up_1_options, "follow1_")
-            self.bot.send_message(chat_id, follow_up_1, reply_markup=markup)
-            self.db.update_user_state(user_id, UserState.WAITING_FIRST_CHECK)
-        except Exception as e:
-            logging.error(f"Error sending first follow up: {e}")
+        markup = self.keyboards.get('follow1')
+        self.outbox.send_message(chat_id, follow_up_1, reply_markup=markup, lane=REMINDER).result()
+        self.db.update_user_state(user_id, UserState.WAITING_FIRST_CHECK)
     
     def send_second_follow_up(self, chat_id, user_id):
-        try:
-            markup = self.create_question_markup(follow_up_2_options, "follow2_")
-            self.bot.send_message(chat_id, follow_up_2, reply_markup=markup)
-            self.db.update_user_state(user_id, UserState.WAITING_SECOND_CHECK)
-        except Exception as e:
-            logging.error(f"Error sending second follow up: {e}")
+        markup = self.keyboards.get('follow2')
+        self.outbox.send_message(chat_id, follow_up_2, reply_markup=markup, lane=REMINDER).result()
+        self.db.update_user_state(user_id, UserState.WAITING_SECOND_CHECK)
     
-    def handle_follow_up_1(self, call):
+    def handle_follow_up_1(self, call, option_index):
         try:
             user_id = call.from_user.id
-            option_index = int(call.data.split('_')[1])
             
-            if user_id in self.timers:
-                del self.timers[user_id]
+            self.cancel_reminders(user_id)
             
             if option_index == 0:
                 self.proceed_to_rating(call)
             else:
-                user_data = self.db.get_user_data(user_id)
+                user_data = self.db.get_session(user_id)
                 channel_link = user_data.get('channel_link', '')
                 
-                markup = types.InlineKeyboardMarkup()
                 if channel_link:
-                    markup.add(types.InlineKeyboardButton("🎥 مشاهده مینی دوره", url=channel_link))
+                    markup = self.keyboards.render('course_link', channel_link=channel_link)
+                else:
+                    markup = self.keyboards.get('empty')
                 
-                self.bot.edit_message_text(no_time_response, call.message.chat.id, call.message.message_id, reply_markup=markup)
+                self.outbox.edit_message_text(no_time_response, call.message.chat.id, call.message.message_id, reply_markup=markup)
                 
                 now = datetime.now()
                 second_reminder = now + timedelta(seconds=SECOND_REMINDER_DELAY)
                 
-                self.timers[user_id] = {
-                    'second_reminder': second_reminder,
-                    'chat_id': call.message.chat.id
-                }
+                self.jobs.add('second_reminder', user_id, second_reminder, {'chat_id': call.message.chat.id})
             
         except Exception as e:
             logging.error(f"Error handling follow up 1: {e}")
     
-    def handle_follow_up_2(self, call):
+    def handle_follow_up_2(self, call, option_index=None):
         try:
             self.proceed_to_rating(call)
         except Exception as e:
@@ -496,7 +468,7 @@ class TelegramBot:
     def proceed_to_rating(self, call):
         try:
             user_id = call.from_user.id
-            self.bot.edit_message_text(rating_request, call.message.chat.id, call.message.message_id)
+            self.outbox.edit_message_text(rating_request, call.message.chat.id, call.message.message_id)
             self.db.update_user_state(user_id, UserState.WAITING_RATING)
         except Exception as e:
             logging.error(f"Error proceeding to rating: {e}")
@@ -512,54 +484,20 @@ class TelegramBot:
             logging.error(f"Error handling rating input: {e}")
     
     def send_course_introduction(self, chat_id, user_id):
-            try:
-                self.bot.send_message(chat_id, course_intro)
-                time.sleep(2)
-                
-                self.bot.send_message(chat_id, testimonial_intro)
-                if TESTIMONIAL_VIDEO_FILE_ID:
-                    self.bot.send_video(chat_id, TESTIMONIAL_VIDEO_FILE_ID)
-                else:
-                    self.bot.send_message(chat_id, "ویدیو نظرات اینجا ارسال می‌شود")
-                
-                time.sleep(2)
-                
-                self.bot.send_message(chat_id, success_stories)
-                if SUCCESS_STORIES_VIDEO_FILE_ID:
-                    self.bot.send_video(chat_id, SUCCESS_STORIES_VIDEO_FILE_ID)
-                else:
-                    self.bot.send_message(chat_id, "ویدیو")
-                
-                time.sleep(2)
-                self.send_important_voice(chat_id, user_id)
-                
-            except Exception as e:
-                logging.error(f"Error sending course introduction: {e}")
-        
+        self.sequences.start('course_intro', user_id, chat_id)
+    
     def send_important_voice(self, chat_id, user_id):
-        try:
-            self.bot.send_message(chat_id, important_voice_msg)
-            time.sleep(1)
-            
-            expert = self.db.get_selected_expert(user_id)
-            
-            if expert == "forough" and FOROUGH_VOICE_2_FILE_ID:
-                self.bot.send_voice(chat_id, FOROUGH_VOICE_2_FILE_ID)
-            elif expert == "sadegh" and SADEGH_VOICE_2_FILE_ID:
-                self.bot.send_voice(chat_id, SADEGH_VOICE_2_FILE_ID)
-            
-            time.sleep(2)
-            self.request_phone_number_keyboard(chat_id)
-            
-        except Exception as e:
-            logging.error(f"Error sending important voice: {e}")
+        self.sequences.start('important_voice', user_id, chat_id)
+    
+    def send_important_voice_step(self, chat_id, user_id, context):
+        expert = self.db.get_selected_expert(user_id)
+        
+        if expert:
+            self.media.send(chat_id, f"{expert}_voice_2")
     
     def request_phone_number_keyboard(self, chat_id):
         try:
-            markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-            button = types.KeyboardButton("ارسال شماره", request_contact=True)
-            markup.add(button)
-            self.bot.send_message(chat_id, phone_request_urgent, reply_markup=markup)
+            self.outbox.send_message(chat_id, phone_request_urgent, reply_markup=self.keyboards.get('phone_request'))
         except Exception as e:
             logging.error(f"Error requesting phone number: {e}")
     
@@ -568,11 +506,11 @@ class TelegramBot:
             user_id = message.from_user.id
             phone_number = message.contact.phone_number
             
-            self.db.update_user_phone(user_id, phone_number)
-            self.db.set_hot_lead(user_id, True)
+            self.db.update_user_phone(user_id, phone_number, is_hot_lead=1, state=UserState.WAITING_CONTACT_TIME)
+            # The phone request at the end of a running sequence is moot now
+            self.sequences.cancel(user_id)
             
-            markup = types.ReplyKeyboardRemove()
-            self.bot.send_message(message.chat.id, "شماره شما با موفقیت ثبت شد ✅", reply_markup=markup)
+            self.outbox.send_message(message.chat.id, "شماره شما با موفقیت ثبت شد ✅", reply_markup=self.keyboards.get('remove'))
             
             self.send_contact_time_question(message.chat.id)
             
@@ -581,63 +519,54 @@ class TelegramBot:
     
     def send_contact_time_question(self, chat_id):
         try:
-            markup = self.create_question_markup(contact_time_options, "contact_")
-            self.bot.send_message(chat_id, contact_time_question, reply_markup=markup)
+            self.funnel.ask(chat_id, 'contact')
         except Exception as e:
             logging.error(f"Error sending contact time question: {e}")
     
-    def handle_contact_time(self, call):
-        try:
-            user_id = call.from_user.id
-            option_index = int(call.data.split('_')[1])
-            contact_time = contact_time_options[option_index]
-            
-            self.db.update_contact_time(user_id, contact_time)
-            
-            self.bot.edit_message_text(final_message, call.message.chat.id, call.message.message_id)
-            self.db.update_user_state(user_id, UserState.COMPLETED)
-            
-        except Exception as e:
-            logging.error(f"Error handling contact time: {e}")
-    
     def schedule_final_photo(self, user_id, chat_id):
         try:
             send_time = datetime.now() + timedelta(seconds=FINAL_PHOTO_DELAY)
             
-            self.final_photo_timers[user_id] = {
-                'send_time': send_time,
-                'chat_id': chat_id
-            }
-            self.db.add_final_photo_timer(user_id, send_time)
+            self.jobs.add('final_photo', user_id, send_time, {'chat_id': chat_id})
             
         except Exception as e:
             logging.error(f"Error scheduling final photo: {e}")
     
     def send_final_photo(self, chat_id, user_id):
-        try:
-            user_data = self.db.get_user_data(user_id)
-            if user_data and user_data.get('phone'):
-                return
-            
-            if FINAL_PHOTO_FILE_ID:
-                markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
-                button = types.KeyboardButton("ارسال شماره", request_contact=True)
-                markup.add(button)
-                
-                self.bot.send_photo(chat_id, FINAL_PHOTO_FILE_ID, caption=final_photo_caption, reply_markup=markup)
-                self.db.update_user_state(user_id, UserState.WAITING_PHONE)
-            
-        except Exception as e:
-            logging.error(f"Error sending final photo: {e}")
+        user_data = self.db.get_user_uncached(user_id, ('phone',))
+        if user_data and user_data['phone']:
+            return
+        sent = self.media.send(chat_id, "final_photo", lane=REMINDER, caption=final_photo_caption,
+                               reply_markup=self.keyboards.get('phone_request'))
+        if sent:
+            sent.result()
+            self.db.update_user_state(user_id, UserState.WAITING_PHONE)
     
     def start_bot(self):
-        try:
-            logging.info("Bot started successfully")
-            self.bot.polling(none_stop=True, interval=0, timeout=20)
-        except Exception as e:
-            logging.error(f"Bot error: {e}")
-            time.sleep(15)
-            self.start_bot()
+        logging.info("Bot started successfully")
+        while True:
+            try:
+                self.bot.polling(none_stop=True, interval=0, timeout=20)
+                break
+            except Exception as e:
+                logging.error(f"Bot error: {e}")
+                time.sleep(15)
+        self.shutdown()
+
+    def shutdown(self):
+        """Release resources once polling has stopped."""
+        logging.info("Shutting down bot")
+        self.lanes.stop()
+        logging.info(f"Update lanes: {self.lanes.stats()}")
+        self.ack_executor.shutdown(wait=True)
+        logging.info(f"Callback answers: {self.callback_gate.stats()}")
+        self.invites.stop()
+        logging.info(f"Invite link pool: {self.invites.stats()}")
+        self.jobs.stop()
+        self.scheduler.stop()
+        self.admin.stop()
+        self.outbox.close()
+        self.db.close()
 
 if __name__ == "__main__":
     bot = TelegramBot()
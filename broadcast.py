@@ -0,0 +1,205 @@
+# broadcast.py - Resumable bulk broadcasts sent through the outbox
+
+import time
+import logging
+import threading
+import functools
+from concurrent.futures import wait, FIRST_COMPLETED
+from config import BROADCAST_WINDOW, BROADCAST_PROGRESS_INTERVAL, BROADCAST_CHECKPOINT_INTERVAL
+from outbox import BULK
+
+ACTIVE = ('running', 'paused')
+
+class BroadcastEngine:
+    """Copies one admin message to every recipient of a broadcast.
+
+    Campaigns live in `broadcasts` and each recipient's outcome in
+    `broadcast_recipients`. A runner thread per broadcast keeps up to
+    `window` `copy_message` calls queued on the outbox BULK lane, so the
+    outbox paces them at its global rate while interactive replies still
+    go first. Claimed recipients are 'queued'; the outbox marks each one
+    'sending' in a committed write right before its call goes out, and
+    results are checkpointed every BROADCAST_CHECKPOINT_INTERVAL seconds.
+    After a crash `recover` puts queued rows back to pending and marks the
+    in-doubt 'sending' ones 'unknown' instead of sending them again, so
+    only calls that may have reached Telegram are given up on. A 403
+    marks the user blocked, and blocked users are skipped by later
+    broadcasts.
+
+    `on_progress(broadcast, counts, finished)` is called every
+    BROADCAST_PROGRESS_INTERVAL seconds while a broadcast runs and once
+    when it stops. Broadcasts are run by a single bot process.
+    """
+
+    def __init__(self, db, outbox, on_progress=None, window=None, progress_interval=None):
+        self.db = db
+        self.outbox = outbox
+        self.on_progress = on_progress
+        self.window = window or BROADCAST_WINDOW
+        self.progress_interval = BROADCAST_PROGRESS_INTERVAL if progress_interval is None else progress_interval
+
+        self._lock = threading.Lock()
+        self._runners = {}       # broadcast_id -> Thread
+        self._stopped = False
+
+    def create(self, admin_id, user_ids):
+        """Draft broadcast for `user_ids`; returns (broadcast_id, recipients)."""
+        broadcast_id = self.db.create_broadcast(admin_id)
+        if broadcast_id is None:
+            return None, 0
+        return broadcast_id, self.db.add_broadcast_recipients(broadcast_id, user_ids)
+
+    def start(self, broadcast_id, from_chat_id=None, message_id=None):
+        """Start a draft; the message to copy may be set here or beforehand."""
+        if message_id is not None:
+            self.db.update_broadcast(broadcast_id, from_chat_id=from_chat_id, message_id=message_id)
+        if not self.db.set_broadcast_status(broadcast_id, 'running', ('draft',)):
+            return False
+        self._spawn(broadcast_id)
+        return True
+
+    def pause(self, broadcast_id):
+        """The runner stops claiming; calls still queued go back to pending."""
+        return self.db.set_broadcast_status(broadcast_id, 'paused', ('running',))
+
+    def resume(self, broadcast_id):
+        if not self.db.set_broadcast_status(broadcast_id, 'running', ('paused',)):
+            return False
+        self._spawn(broadcast_id)
+        return True
+
+    def cancel(self, broadcast_id):
+        """Cancel a draft or an active broadcast; pending recipients are dropped."""
+        return self.db.set_broadcast_status(broadcast_id, 'cancelled', ('draft',) + ACTIVE)
+
+    def recover(self):
+        """After a restart: settle in-doubt recipients and restart running broadcasts."""
+        for broadcast in self.db.get_broadcasts(ACTIVE):
+            broadcast_id = broadcast['broadcast_id']
+            unknown, requeued = self.db.recover_broadcast(broadcast_id)
+            if requeued:
+                logging.info(f"Broadcast {broadcast_id}: {requeued} queued recipient(s) back to pending")
+            if unknown:
+                logging.warning(f"Broadcast {broadcast_id}: {unknown} recipient(s) were being sent to "
+                                f"when the bot stopped; marked unknown and not resent")
+            if broadcast['status'] == 'running':
+                logging.info(f"Resuming broadcast {broadcast_id}")
+                self._spawn(broadcast_id)
+
+    def progress(self, broadcast_id):
+        """(broadcast row, recipient counts by status)."""
+        return self.db.get_broadcast(broadcast_id), self.db.get_broadcast_progress(broadcast_id)
+
+    def _spawn(self, broadcast_id):
+        with self._lock:
+            if self._stopped:
+                return
+            runner = self._runners.get(broadcast_id)
+            if runner is not None and runner.is_alive():
+                # A pause followed quickly by resume: the old runner is
+                # still draining and will carry on once it sees 'running'
+                return
+            runner = threading.Thread(target=self._run, args=(broadcast_id,),
+                                      name=f"broadcast-{broadcast_id}", daemon=True)
+            self._runners[broadcast_id] = runner
+        runner.start()
+
+    def _run(self, broadcast_id):
+        broadcast = self.db.get_broadcast(broadcast_id)
+        if broadcast is None or broadcast['message_id'] is None:
+            logging.error(f"Broadcast {broadcast_id} has no message to copy")
+            self.db.set_broadcast_status(broadcast_id, 'cancelled', ACTIVE)
+            return
+        from_chat_id, message_id = broadcast['from_chat_id'], broadcast['message_id']
+        started = time.monotonic()
+        logging.info(f"Broadcast {broadcast_id} running")
+
+        in_flight = {}           # Future -> user_id
+        results = []             # (user_id, status, error) not yet checkpointed
+        checkpointed = polled = reported = time.monotonic()
+        status, more = 'running', True
+        while True:
+            # Top up once half the window has been sent; when the last claim
+            # came back empty, look again only after the window drains
+            if status == 'running' and not self._stopped and (
+                    not in_flight or (more and len(in_flight) <= self.window // 2)):
+                claimed = self.db.claim_broadcast_recipients(broadcast_id, self.window - len(in_flight))
+                more = bool(claimed)
+                for user_id in claimed:
+                    try:
+                        future = self.outbox.copy_message(
+                            user_id, from_chat_id, message_id, lane=BULK,
+                            on_dispatch=functools.partial(self.db.mark_broadcast_recipient_sending,
+                                                          broadcast_id, user_id))
+                    except RuntimeError as e:
+                        # Outbox closed under us; leave the rest for recover()
+                        results.append((user_id, 'pending', None))
+                        logging.error(f"Broadcast {broadcast_id}: {e}")
+                        continue
+                    in_flight[future] = user_id
+            if not in_flight:
+                break
+
+            done, _ = wait(in_flight, timeout=BROADCAST_CHECKPOINT_INTERVAL, return_when=FIRST_COMPLETED)
+            for future in done:
+                results.append(self._outcome(broadcast_id, in_flight.pop(future), future))
+
+            now = time.monotonic()
+            if results and (now - checkpointed >= BROADCAST_CHECKPOINT_INTERVAL or len(results) >= self.window):
+                self.db.finish_broadcast_recipients(broadcast_id, results)
+                results, checkpointed = [], now
+
+            if now - polled >= BROADCAST_CHECKPOINT_INTERVAL or self._stopped:
+                status, polled = self.db.get_broadcast(broadcast_id)['status'], now
+                if status != 'running' or self._stopped:
+                    # Paused, cancelled or shutting down: take back what has
+                    # not reached a worker yet
+                    outcome = 'cancelled' if status == 'cancelled' else 'pending'
+                    for future in [future for future in in_flight if future.cancel()]:
+                        results.append((in_flight.pop(future), outcome, None))
+            if now - reported >= self.progress_interval:
+                self._report(broadcast_id, False)
+                reported = now
+
+        if results:
+            self.db.finish_broadcast_recipients(broadcast_id, results)
+        if status == 'running' and not self._stopped:
+            self.db.set_broadcast_status(broadcast_id, 'done', ('running',))
+        counts = self._report(broadcast_id, True)
+        logging.info(f"Broadcast {broadcast_id} stopped after {time.monotonic() - started:.1f}s: {counts}")
+
+        with self._lock:
+            if self._runners.get(broadcast_id) is threading.current_thread():
+                del self._runners[broadcast_id]
+            # A resume that arrived while this runner was draining
+            respawn = (not self._stopped and status == 'paused'
+                       and self.db.get_broadcast(broadcast_id)['status'] == 'running')
+        if respawn:
+            self._spawn(broadcast_id)
+
+    def _outcome(self, broadcast_id, user_id, future):
+        error = future.exception()
+        if error is None:
+            return user_id, 'sent', None
+        if getattr(error, 'error_code', None) == 403:
+            # Bot blocked or account deactivated
+            self.db.set_user_blocked(user_id)
+            return user_id, 'blocked', str(error)[:200]
+        return user_id, 'failed', str(error)[:200]
+
+    def _report(self, broadcast_id, finished):
+        broadcast, counts = self.progress(broadcast_id)
+        if self.on_progress and broadcast:
+            try:
+                self.on_progress(broadcast, counts, finished)
+            except Exception as e:
+                logging.error(f"Error reporting progress of broadcast {broadcast_id}: {e}")
+        return counts
+
+    def stop(self, timeout=None):
+        """Stop every runner; running broadcasts stay 'running' and resume on the next start."""
+        with self._lock:
+            self._stopped = True
+            runners = list(self._runners.values())
+        for runner in runners:
+            runner.join(timeout)
@@ -0,0 +1,78 @@
+# callbacks.py - Immediate button-tap acknowledgement and in-flight guard
+
+import time
+import logging
+import threading
+
+class CallbackGate:
+    """Bookkeeping for callback queries between receipt and handling.
+
+    Every tap is answered at once (the bot calls `answer_callback_query`
+    before any DB or edit work) so the client spinner stops, and
+    `acked(received)` records the receipt-to-answer latency. `enter`
+    admits one tap per (user, message) at a time: a repeat tap on a message
+    whose previous tap is still queued or running is dropped, and the guard
+    is lifted when `run` finishes the handler.
+    """
+
+    def __init__(self, sample_size=1024):
+        self._lock = threading.Lock()
+        self._in_flight = set()
+        self._latencies = []     # ring of the latest ack latencies, seconds
+        self._sample_size = sample_size
+        self._next = 0
+        self.counters = {'received': 0, 'acked': 0, 'ack_failed': 0, 'duplicates': 0}
+
+    @staticmethod
+    def key(call):
+        message = call.message
+        return (call.from_user.id, message.message_id if message else call.inline_message_id)
+
+    def enter(self, call):
+        """False if the same button message is already being handled."""
+        key = self.key(call)
+        with self._lock:
+            self.counters['received'] += 1
+            if key in self._in_flight:
+                self.counters['duplicates'] += 1
+                return False
+            self._in_flight.add(key)
+            return True
+
+    def run(self, handler, call):
+        try:
+            handler(call)
+        finally:
+            self.leave(call)
+
+    def leave(self, call):
+        """Lift the guard once the tap has run, or when it could not be queued."""
+        with self._lock:
+            self._in_flight.discard(self.key(call))
+
+    def acked(self, received):
+        """Record an answer sent for a tap received at monotonic time `received`."""
+        latency = time.monotonic() - received
+        with self._lock:
+            self.counters['acked'] += 1
+            if len(self._latencies) < self._sample_size:
+                self._latencies.append(latency)
+            else:
+                self._latencies[self._next] = latency
+                self._next = (self._next + 1) % self._sample_size
+
+    def ack_failed(self, call, error):
+        with self._lock:
+            self.counters['ack_failed'] += 1
+        logging.warning(f"Could not answer callback {call.id}: {error}")
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            latencies = sorted(self._latencies)
+            stats['in_flight'] = len(self._in_flight)
+        if latencies:
+            stats['ack_p50_ms'] = latencies[len(latencies) // 2] * 1000
+            stats['ack_p95_ms'] = latencies[int(len(latencies) * 0.95)] * 1000
+            stats['ack_max_ms'] = latencies[-1] * 1000
+        return stats
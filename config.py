@@ -31,17 +31,121 @@ TESTIMONIAL_VIDEO_FILE_ID = "ENTER_FILE_ID"
 SUCCESS_STORIES_VIDEO_FILE_ID = "ENTER_FILE_ID"
 FINAL_PHOTO_FILE_ID = "ENTER_FILE_ID"
 
+# Media registry: name -> (kind, configured file_id, file under MEDIA_DIR).
+# Assets are checked at startup; one whose file_id is missing or rejected is
+# uploaded from MEDIA_DIR to MEDIA_STORAGE_CHAT_ID and the new file_id kept.
+MEDIA_DIR = "media"
+MEDIA_STORAGE_CHAT_ID = "ENTER_CHANNEL_ID"   # private channel the bot can post to
+MEDIA_CHECK_WORKERS = 8
+MEDIA_ASSETS = {
+    'forough_photo': ('photo', FOROUGH_PHOTO_FILE_ID, 'forough_photo.jpg'),
+    'forough_voice_1': ('voice', FOROUGH_VOICE_1_FILE_ID, 'forough_voice_1.ogg'),
+    'forough_voice_2': ('voice', FOROUGH_VOICE_2_FILE_ID, 'forough_voice_2.ogg'),
+    'sadegh_photo': ('photo', SADEGH_PHOTO_FILE_ID, 'sadegh_photo.jpg'),
+    'sadegh_voice_1': ('voice', SADEGH_VOICE_1_FILE_ID, 'sadegh_voice_1.ogg'),
+    'sadegh_voice_2': ('voice', SADEGH_VOICE_2_FILE_ID, 'sadegh_voice_2.ogg'),
+    'testimonial_video': ('video', TESTIMONIAL_VIDEO_FILE_ID, 'testimonial.mp4'),
+    'success_stories_video': ('video', SUCCESS_STORIES_VIDEO_FILE_ID, 'success_stories.mp4'),
+    'final_photo': ('photo', FINAL_PHOTO_FILE_ID, 'final_photo.jpg'),
+}
+
 # Database & Paths
 DB_FILE = "users.db"
 JSON_BACKUP_FILE = "users_data.json"
+JOURNAL_FILE = "users_journal.jsonl"
 LOG_FILE = "bot.log"
 EXCEL_EXPORT_DIR = "exports"
+EXPORT_ROWS_PER_FILE = 1048575    # Excel's sheet limit minus the header row
+EXPORT_PROGRESS_INTERVAL = 3.0    # seconds between progress message edits
+
+# SQLite connection settings (applied to every connection at startup)
+DB_JOURNAL_MODE = "WAL"
+DB_SYNCHRONOUS = "NORMAL"     # OFF / NORMAL / FULL
+DB_CACHE_SIZE = -20000        # negative = KiB, i.e. ~20 MB page cache
+DB_MMAP_SIZE = 268435456      # 256 MB memory-mapped I/O
+DB_BUSY_TIMEOUT = 5000        # milliseconds to wait on a locked database
+
+# Log EXPLAIN QUERY PLAN for each distinct statement (debugging aid)
+DB_EXPLAIN_QUERIES = False
+
+# Write-behind mode: coalesce per-user updates and group-commit them
+DB_WRITE_BEHIND = False
+DB_WRITE_BEHIND_INTERVAL_MS = 50    # commit at least this often
+DB_WRITE_BEHIND_BATCH = 500         # ...or as soon as this many writes are queued
+
+# In-memory LRU of user records (0 disables caching)
+SESSION_CACHE_SIZE = 10000
+
+# Change journal compaction (rebuilds JSON_BACKUP_FILE from the database)
+JOURNAL_COMPACT_INTERVAL = 3600            # seconds between snapshots
+JOURNAL_COMPACT_MAX_BYTES = 64 * 1024 * 1024  # compact early once the journal is this big
+
+# Outbound sends (Telegram allows ~30 messages/s overall, ~1/s per chat)
+OUTBOX_GLOBAL_RATE = 30           # sends per second across all chats
+OUTBOX_PER_CHAT_INTERVAL = 1.0    # minimum seconds between sends to one chat
+OUTBOX_WORKERS = 8                # concurrent HTTP requests
+OUTBOX_MAX_RETRIES = 5            # for network/5xx errors; 429s always wait retry_after
+
+# Update handling: each user is pinned to one of LANE_WORKERS serial lanes,
+# so a user's updates run one at a time and in order
+LANE_WORKERS = 32
+LANE_QUEUE_SIZE = 100         # updates queued per lane before the feeder blocks
+LANE_ENQUEUE_TIMEOUT = 60.0   # seconds to wait for room on a full lane before dropping the update
+CALLBACK_ACK_WORKERS = 32     # threads answering button taps ahead of the lanes
+
+# Opt-in asyncio runtime (AsyncTeleBot); also `python async_bot.py`
+ASYNC_MODE = os.getenv("BOT_ASYNC", "0") == "1"
+ASYNC_HANDLER_WORKERS = 16    # threads for job wake-ups and other blocking work off the loop
+ASYNC_HTTP_POOL_SIZE = 50     # keep-alive connections in the shared aiohttp session
+
+# Webhook mode (`python webhook.py`; BOT_WEBHOOK=1 for run.py)
+WEBHOOK_ENABLED = os.getenv("BOT_WEBHOOK", "0") == "1"
+WEBHOOK_URL = os.getenv("WEBHOOK_URL", "")          # public base URL; empty = don't call set_webhook
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET", "")    # checked against X-Telegram-Bot-Api-Secret-Token
+WEBHOOK_HOST = "0.0.0.0"
+WEBHOOK_PORT = 8443
+WEBHOOK_PATH = "/webhook"
+WEBHOOK_WORKERS = 8               # threads running handlers
+WEBHOOK_QUEUE_SIZE = 1000         # updates acknowledged but not yet handed to the lanes
+WEBHOOK_ENQUEUE_TIMEOUT = 2.0     # seconds to wait for queue space before answering 503
+WEBHOOK_MAX_BODY = 1024 * 1024
 
 # Timing Settings (in seconds)
 FIRST_REMINDER_DELAY = 3600   # 1 hour
 SECOND_REMINDER_DELAY = 3600  # 1 hour
 FINAL_PHOTO_DELAY = 21600     # 6 hours
 
+# Scheduled jobs (reminders, final photo) stored in the database
+JOB_POLL_INTERVAL = 30        # seconds between checks for jobs added by other processes
+JOB_LEASE_SECONDS = 120       # a claimed job is retried by anyone once its lease expires
+JOB_CLAIM_BATCH = 50          # jobs claimed per round trip
+JOB_WORKERS = 4
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 60          # seconds, doubled per attempt
+# Jobs that fell due while the bot was down are spread out at startup
+JOB_CATCHUP_RATE = 10         # overdue jobs per second...
+JOB_CATCHUP_INTERVAL = 1800   # ...but the whole backlog within this many seconds
+JOB_CATCHUP_WINDOW = 5000     # overdue jobs reconciled per transaction
+
+# Pre-generated single-use invite links for MINI_COURSE_CHANNEL_ID
+INVITE_POOL_LOW = 50              # refill when this few unissued links are left
+INVITE_POOL_HIGH = 200            # refill up to this many
+INVITE_POOL_BATCH = 20            # links minted per refill step
+INVITE_POOL_CHECK_INTERVAL = 300  # seconds between depth checks when full
+INVITE_POOL_RETRY_DELAY = 60      # seconds after a failed mint (429s use retry_after)
+
+# Admin broadcasts (copy_message on the outbox BULK lane, so OUTBOX_GLOBAL_RATE applies)
+BROADCAST_WINDOW = 100                # sends queued on the outbox per broadcast
+BROADCAST_CHECKPOINT_INTERVAL = 1.0   # seconds between recipient status commits
+BROADCAST_PROGRESS_INTERVAL = 5.0     # seconds between progress message edits
+
+# Hot-lead delta feed (`python leads.py CONSUMER`, admin panel)
+LEAD_FEED_SETTLE_SECONDS = 5      # leads this recent wait for the next pull
+LEAD_FEED_CHUNK_SIZE = 1000       # rows per range-scan page
+
+# Recipient file uploads are parsed as a stream and staged in SQLite
+INGEST_CHUNK_SIZE = 50000     # ids per staging transaction
+
 # Create export directory
 os.makedirs(EXCEL_EXPORT_DIR, exist_ok=True)
 
@@ -65,5 +169,6 @@ class AdminState:
     MAIN_MENU = "admin_main"
     BULK_QUIZ = "bulk_quiz"
     BULK_FILE = "bulk_file"
+    BULK_LOADING = "bulk_loading"
     BULK_MESSAGE = "bulk_message"
     BULK_CONFIRM = "bulk_confirm"
\ No newline at end of file
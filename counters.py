@@ -0,0 +1,75 @@
+# counters.py - Trigger-maintained user counters for O(1) statistics
+
+# dimension -> (users column, SQL expression giving the bucket for a row)
+DIMENSIONS = {
+    'expert': ('selected_expert', "COALESCE({row}.selected_expert, '')"),
+    'state': ('state', "COALESCE({row}.state, '')"),
+    'vip': ('is_vip', "(COALESCE({row}.is_vip, 0) <> 0)"),
+    'hot_lead': ('is_hot_lead', "(COALESCE({row}.is_hot_lead, 0) <> 0)"),
+    'completed': ('is_completed', "(COALESCE({row}.is_completed, 0) <> 0)"),
+}
+
+# 'total' has a single bucket
+ALL_DIMENSIONS = ('total',) + tuple(DIMENSIONS)
+
+def _bump(values, delta):
+    rows = ', '.join(f"('{dimension}', {expression}, {delta})" for dimension, expression in values)
+    return f"""
+        INSERT INTO user_counters (dimension, value, count) VALUES {rows}
+        ON CONFLICT (dimension, value) DO UPDATE SET count = count + ({delta});
+    """
+
+def trigger_statements():
+    """CREATE statements for the counter table and its triggers."""
+    statements = ["""
+        CREATE TABLE IF NOT EXISTS user_counters (
+            dimension TEXT NOT NULL,
+            value TEXT NOT NULL,
+            count INTEGER NOT NULL DEFAULT 0,
+            PRIMARY KEY (dimension, value)
+        ) WITHOUT ROWID
+    """]
+
+    def row_values(row):
+        values = [('total', "''")]
+        values += [(dimension, expression.format(row=row)) for dimension, (_, expression) in DIMENSIONS.items()]
+        return values
+
+    statements.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_user_counters_insert AFTER INSERT ON users
+        BEGIN {_bump(row_values('NEW'), 1)} END
+    """)
+    statements.append(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_user_counters_delete AFTER DELETE ON users
+        BEGIN {_bump(row_values('OLD'), -1)} END
+    """)
+
+    # One update trigger per dimension so unrelated writes do no counter work
+    for dimension, (column, expression) in DIMENSIONS.items():
+        old, new = expression.format(row='OLD'), expression.format(row='NEW')
+        statements.append(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_user_counters_{dimension} AFTER UPDATE OF {column} ON users
+            WHEN {old} IS NOT {new}
+            BEGIN
+                {_bump([(dimension, old)], -1)}
+                {_bump([(dimension, new)], 1)}
+            END
+        """)
+    return statements
+
+def recompute(cursor):
+    """Count every bucket from the users table itself: {(dimension, value): count}."""
+    actual = {('total', ''): cursor.execute("SELECT COUNT(*) FROM users").fetchone()[0]}
+    for dimension, (_, expression) in DIMENSIONS.items():
+        bucket = expression.format(row='users')
+        for value, count in cursor.execute(f"SELECT {bucket}, COUNT(*) FROM users GROUP BY 1"):
+            actual[(dimension, str(value))] = count
+    return actual
+
+def rebuild(cursor):
+    """Replace the stored counters with freshly computed ones."""
+    cursor.execute("DELETE FROM user_counters")
+    cursor.executemany(
+        "INSERT INTO user_counters (dimension, value, count) VALUES (?, ?, ?)",
+        [(dimension, value, count) for (dimension, value), count in recompute(cursor).items()]
+    )
@@ -2,590 +2,1321 @@
 
 import sqlite3
 import json
+import time
 import logging
-from datetime import datetime
-from config import DB_FILE, JSON_BACKUP_FILE
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from journal import ChangeJournal
+from write_behind import WriteBehindQueue
+from session_cache import SessionCache
+from models import UserRowFactory, SESSION_COLUMNS
+import counters
+from migrations import apply_migrations, schema_version
+from config import (
+    DB_FILE, DB_JOURNAL_MODE, DB_SYNCHRONOUS,
+    DB_CACHE_SIZE, DB_MMAP_SIZE, DB_BUSY_TIMEOUT,
+    DB_WRITE_BEHIND, DB_WRITE_BEHIND_INTERVAL_MS, DB_WRITE_BEHIND_BATCH,
+    SESSION_CACHE_SIZE, DB_EXPLAIN_QUERIES
+)
+
+# Upper bound for keyset cursors over user_id
+MAX_USER_ID = 2 ** 63 - 1
+
+def sqlite_timestamp(seconds_ago=0):
+    """Current UTC time (minus `seconds_ago`) in SQLite's CURRENT_TIMESTAMP format."""
+    return (datetime.now(timezone.utc) - timedelta(seconds=seconds_ago)).strftime('%Y-%m-%d %H:%M:%S')
 
 class DatabaseManager:
-    def __init__(self):
-        self.db_file = DB_FILE
-        self.json_file = JSON_BACKUP_FILE
+    def __init__(self, db_file=None, journal=True, write_behind=None, cache_size=None):
+        self.db_file = db_file or DB_FILE
+        self.sessions = SessionCache(SESSION_CACHE_SIZE if cache_size is None else cache_size)
+
+        # One long-lived writer shared by all threads (serialized by a lock),
+        # plus one reader connection per thread.
+        self._write_lock = threading.RLock()
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._closed = False
+
+        # Log EXPLAIN QUERY PLAN the first time each statement runs
+        self.explain_queries = DB_EXPLAIN_QUERIES
+        self._explained = set()
+
+        self._writer = self._connect()
+        self.settings = self._read_settings(self._writer)
+        logging.info(
+            "SQLite settings: journal_mode=%(journal_mode)s synchronous=%(synchronous)s "
+            "cache_size=%(cache_size)s mmap_size=%(mmap_size)s busy_timeout=%(busy_timeout)s",
+            self.settings
+        )
+
         self.init_database()
-    
-    def init_database(self):
-        """Initialize database tables."""
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS users (
-                    user_id INTEGER PRIMARY KEY,
-                    username TEXT,
-                    first_name TEXT,
-                    last_name TEXT,
-                    name TEXT,
-                    phone TEXT,
-                    state TEXT DEFAULT 'start',
-                    question_1 TEXT,
-                    question_2 TEXT,
-                    question_3 TEXT,
-                    question_4 TEXT,
-                    contact_time TEXT,
-                    channel_link TEXT,
-                    selected_expert TEXT,
-                    registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                    phone_date TIMESTAMP,
-                    is_completed BOOLEAN DEFAULT 0,
-                    is_vip BOOLEAN DEFAULT 0,
-                    is_hot_lead BOOLEAN DEFAULT 0
-                )
-            """)
-            
-            # Table for tracking messages to delete/edit
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_messages (
-                    user_id INTEGER,
-                    message_id INTEGER,
-                    message_type TEXT,
-                    PRIMARY KEY (user_id, message_type)
-                )
-            """)
-            
-            # Reminder timers
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS user_timers (
-                    user_id INTEGER PRIMARY KEY,
-                    first_reminder TIMESTAMP,
-                    second_reminder TIMESTAMP,
-                    timer_active BOOLEAN DEFAULT 1
-                )
-            """)
-            
-            # Final photo timer
-            cursor.execute("""
-                CREATE TABLE IF NOT EXISTS final_photo_timers (
-                    user_id INTEGER PRIMARY KEY,
-                    send_time TIMESTAMP,
-                    is_sent BOOLEAN DEFAULT 0
-                )
-            """)
-            
-            # Add columns if missing (migration)
+
+        # Rows from the users table come back as compact `User` records
+        self.user_columns = [row[1] for row in self._fetchall("PRAGMA table_info(users)")]
+        self.user_rows = UserRowFactory(self.user_columns, self._load_columns)
+
+        # Incremental change journal; tools that rewrite the database
+        # themselves (e.g. journal.rebuild) run without one.
+        self.journal = None
+        if journal:
+            self.journal = ChangeJournal()
+            self.journal.start_compactor(self._iter_snapshot_rows)
+
+        # Optional group commit of per-user updates
+        if write_behind is None:
+            write_behind = DB_WRITE_BEHIND
+        self.write_behind = None
+        if write_behind:
+            self.write_behind = WriteBehindQueue(self, DB_WRITE_BEHIND_INTERVAL_MS, DB_WRITE_BEHIND_BATCH)
+
+    def _connect(self):
+        """Open a connection with the configured PRAGMAs applied."""
+        conn = sqlite3.connect(
+            self.db_file,
+            timeout=DB_BUSY_TIMEOUT / 1000,
+            check_same_thread=False,
+            isolation_level=None
+        )
+        conn.execute(f"PRAGMA busy_timeout = {int(DB_BUSY_TIMEOUT)}")
+        conn.execute(f"PRAGMA journal_mode = {DB_JOURNAL_MODE}")
+        conn.execute(f"PRAGMA synchronous = {DB_SYNCHRONOUS}")
+        conn.execute(f"PRAGMA cache_size = {int(DB_CACHE_SIZE)}")
+        conn.execute(f"PRAGMA mmap_size = {int(DB_MMAP_SIZE)}")
+        return conn
+
+    def _read_settings(self, conn):
+        """Read back the PRAGMA values SQLite actually applied."""
+        synchronous_names = {0: "OFF", 1: "NORMAL", 2: "FULL", 3: "EXTRA"}
+        settings = {}
+        for pragma in ("journal_mode", "synchronous", "cache_size", "mmap_size", "busy_timeout"):
+            row = conn.execute(f"PRAGMA {pragma}").fetchone()
+            settings[pragma] = row[0] if row else None
+        settings["synchronous"] = synchronous_names.get(settings["synchronous"], settings["synchronous"])
+        return settings
+
+    def _reader(self):
+        """Return this thread's reader connection, opening it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            if self._closed:
+                raise sqlite3.ProgrammingError("DatabaseManager is closed")
+            conn = self._connect()
+            self._local.conn = conn
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    @contextmanager
+    def _write(self):
+        """Run a write transaction on the shared writer connection.
+
+        Nested calls from the same thread join the outer transaction.
+        """
+        with self._write_lock:
+            cursor = self._writer.cursor()
+            if self._writer.in_transaction:
+                try:
+                    yield cursor
+                finally:
+                    cursor.close()
+                return
+
+            cursor.execute("BEGIN IMMEDIATE")
             try:
-                cursor.execute("ALTER TABLE users ADD COLUMN selected_expert TEXT")
-            except sqlite3.OperationalError:
-                pass 
-            
+                yield cursor
+            except BaseException:
+                self._writer.rollback()
+                raise
+            else:
+                self._writer.commit()
+            finally:
+                cursor.close()
+
+    def _explain(self, sql, params=()):
+        """Log the query plan of a statement once, warning on full table scans."""
+        if sql in self._explained:
+            return
+        self._explained.add(sql)
+        try:
+            plan = self._reader().execute(f"EXPLAIN QUERY PLAN {sql}", params).fetchall()
+        except sqlite3.Error:
+            return  # PRAGMAs and DDL have no plan
+        details = [row[-1] for row in plan]
+        statement = ' '.join(sql.split())
+        full_scans = [d for d in details if d.startswith('SCAN ') and ' USING ' not in d]
+        if full_scans:
+            logging.warning(f"Query plan has a table scan ({'; '.join(full_scans)}): {statement}")
+        else:
+            logging.info(f"Query plan: {'; '.join(details)} :: {statement}")
+
+    def _execute(self, sql, params=()):
+        if self.explain_queries:
+            self._explain(sql, params)
+        with self._write() as cursor:
+            cursor.execute(sql, params)
+            return cursor.rowcount
+
+    def _query(self, sql, params=(), row_factory=None):
+        """Run a read on this thread's reader connection and return the cursor."""
+        if self.explain_queries:
+            self._explain(sql, params)
+        cursor = self._reader().cursor()
+        cursor.row_factory = row_factory
+        return cursor.execute(sql, params)
+
+    def _fetchone(self, sql, params=()):
+        return self._query(sql, params).fetchone()
+
+    def _fetchall(self, sql, params=()):
+        return self._query(sql, params).fetchall()
+
+    def close(self):
+        """Flush pending writes, then close the writer and every reader connection."""
+        if self.write_behind:
+            self.write_behind.close()
+        if self.journal:
+            self.journal.close()
+
+        with self._write_lock:
+            if self._closed:
+                return
+            self._closed = True
+
+            with self._readers_lock:
+                readers, self._readers = self._readers, []
+            for conn in readers:
+                try:
+                    conn.close()
+                except Exception as e:
+                    logging.error(f"Error closing reader connection: {e}")
+
             try:
-                cursor.execute("ALTER TABLE users ADD COLUMN is_hot_lead BOOLEAN DEFAULT 0")
-            except sqlite3.OperationalError:
-                pass 
-            
-            conn.commit()
-            conn.close()
-            logging.info("Database initialized successfully")
+                # Fold the WAL back into the main file so a clean shutdown
+                # leaves a self-contained database.
+                self._writer.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+            except sqlite3.Error as e:
+                logging.error(f"Error checkpointing WAL: {e}")
+            self._writer.close()
+            logging.info("Database connections closed")
+
+    def _update_user(self, user_id, columns, journal=True):
+        """Write column values for one user, directly or via the write-behind queue.
+
+        The session cache is updated in the same step (write-through), and
+        the row is mirrored to the change journal so a rebuild restores
+        every column, funnel state included.
+        """
+        if self.write_behind:
+            self.write_behind.update_user(user_id, columns, journal)
+            self.sessions.update(user_id, columns)
+            return
+
+        assignments = ', '.join(f"{column} = ?" for column in columns)
+        self._execute(f"UPDATE users SET {assignments} WHERE user_id = ?", (*columns.values(), user_id))
+        self.sessions.update(user_id, columns)
+        if journal:
+            self._journal_user(user_id)
+
+    def _pending(self, user_id):
+        """Uncommitted write-behind values for a user."""
+        if self.write_behind:
+            return self.write_behind.pending_user(user_id)
+        return {}
+
+    def flush(self):
+        """Commit any queued write-behind updates now."""
+        if self.write_behind:
+            self.write_behind.flush()
+
+    def init_database(self):
+        """Create or upgrade the schema through versioned migrations."""
+        try:
+            applied = apply_migrations(self)
+            logging.info(f"Database initialized successfully (schema version {schema_version(self)}, "
+                         f"{len(applied)} migration(s) applied)")
         except Exception as e:
             logging.error(f"Database initialization error: {e}")
-    
+
     def add_user(self, user_id, username=None, first_name=None, last_name=None):
         """Register a new user."""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT OR IGNORE INTO users 
-                (user_id, username, first_name, last_name) 
+            self._execute("""
+                INSERT OR IGNORE INTO users
+                (user_id, username, first_name, last_name)
                 VALUES (?, ?, ?, ?)
             """, (user_id, username, first_name, last_name))
-            
-            conn.commit()
-            conn.close()
-            self.backup_to_json()
+
+            self.sessions.invalidate(user_id)
+            self._journal_user(user_id)
             return True
         except Exception as e:
             logging.error(f"Error adding user {user_id}: {e}")
             return False
-    
+
     def user_exists(self, user_id):
         """Check if user exists in DB."""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT user_id FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            
-            conn.close()
-            return result is not None
+            return self.get_session(user_id) is not None
         except Exception as e:
             logging.error(f"Error checking user existence {user_id}: {e}")
             return False
-    
+
     def update_user_state(self, user_id, state):
         """Update user flow state."""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("UPDATE users SET state = ? WHERE user_id = ?", (state, user_id))
-            
-            conn.commit()
-            conn.close()
+            self._update_user(user_id, {'state': state})
             return True
         except Exception as e:
             logging.error(f"Error updating user state {user_id}: {e}")
             return False
-    
+
     def update_user_name(self, user_id, name):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("UPDATE users SET name = ? WHERE user_id = ?", (name, user_id))
-            
-            conn.commit()
-            conn.close()
-            self.backup_to_json()
+            self._update_user(user_id, {'name': name}, journal=True)
             return True
         except Exception as e:
             logging.error(f"Error updating user name {user_id}: {e}")
             return False
-    
+
     def save_selected_expert(self, user_id, expert):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("UPDATE users SET selected_expert = ? WHERE user_id = ?", (expert, user_id))
-            
-            conn.commit()
-            conn.close()
+            self._update_user(user_id, {'selected_expert': expert})
             return True
         except Exception as e:
             logging.error(f"Error saving selected expert for user {user_id}: {e}")
             return False
-    
+
     def get_selected_expert(self, user_id):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT selected_expert FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            
-            conn.close()
-            return result[0] if result and result[0] else "forough"
+            user = self.get_session(user_id)
+            return user['selected_expert'] if user and user['selected_expert'] else "forough"
         except Exception as e:
             logging.error(f"Error getting selected expert for user {user_id}: {e}")
             return "forough"
-    
+
     def update_question_answer(self, user_id, question_num, answer):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
             column = f"question_{question_num}"
-            cursor.execute(f"UPDATE users SET {column} = ? WHERE user_id = ?", (answer, user_id))
-            
-            conn.commit()
-            conn.close()
-            self.backup_to_json()
+            self._update_user(user_id, {column: answer}, journal=True)
             return True
         except Exception as e:
             logging.error(f"Error updating question {question_num} for user {user_id}: {e}")
             return False
-    
+
     def update_channel_link(self, user_id, channel_link):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("UPDATE users SET channel_link = ? WHERE user_id = ?", (channel_link, user_id))
-            
-            conn.commit()
-            conn.close()
+            self._update_user(user_id, {'channel_link': channel_link})
             return True
         except Exception as e:
             logging.error(f"Error updating channel link for user {user_id}: {e}")
             return False
-    
-    def update_user_phone(self, user_id, phone):
-        """Save phone and mark as VIP."""
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE users 
-                SET phone = ?, phone_date = CURRENT_TIMESTAMP, is_vip = 1 
-                WHERE user_id = ?
-            """, (phone, user_id))
-            
-            conn.commit()
-            conn.close()
-            self.backup_to_json()
+
+    def update_user_phone(self, user_id, phone, **columns):
+        """Save phone and mark as VIP (plus any other columns, in the same write)."""
+        try:
+            self._update_user(user_id, {
+                'phone': phone,
+                'phone_date': sqlite_timestamp(),
+                'is_vip': 1,
+                **columns
+            }, journal=True)
             return True
         except Exception as e:
             logging.error(f"Error updating phone for user {user_id}: {e}")
             return False
-    
+
     def set_hot_lead(self, user_id, is_hot_lead=True):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("UPDATE users SET is_hot_lead = ? WHERE user_id = ?", (is_hot_lead, user_id))
-            
-            conn.commit()
-            conn.close()
-            self.backup_to_json()
+            self._update_user(user_id, {'is_hot_lead': int(bool(is_hot_lead))}, journal=True)
             return True
         except Exception as e:
             logging.error(f"Error setting hot lead for user {user_id}: {e}")
             return False
-    
+
     def update_contact_time(self, user_id, contact_time):
         """Save preferred contact time and mark complete."""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE users 
-                SET contact_time = ?, is_completed = 1 
-                WHERE user_id = ?
-            """, (contact_time, user_id))
-            
-            conn.commit()
-            conn.close()
-            self.backup_to_json()
+            self._update_user(user_id, {'contact_time': contact_time, 'is_completed': 1}, journal=True)
             return True
         except Exception as e:
             logging.error(f"Error updating contact time for user {user_id}: {e}")
             return False
-    
-    def get_user_data(self, user_id):
+
+    def update_user_columns(self, user_id, columns, journal=True):
+        """Write several user columns (e.g. an answer plus the next state) in one UPDATE."""
+        try:
+            unknown = set(columns).difference(self.user_columns)
+            if unknown:
+                raise ValueError(f"unknown columns {sorted(unknown)}")
+            self._update_user(user_id, columns, journal=journal)
+            return True
+        except Exception as e:
+            logging.error(f"Error updating columns for user {user_id}: {e}")
+            return False
+
+    def get_session(self, user_id):
+        """Return the user's record from the session cache, loading it on a miss.
+
+        The record is a read-only `models.User` (usable like a dict), or
+        None if the user is not registered.
+        """
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM users WHERE user_id = ?", (user_id,))
-            columns = [description[0] for description in cursor.description]
-            row = cursor.fetchone()
-            
-            conn.close()
-            
-            if row:
-                return dict(zip(columns, row))
+            user = self.sessions.get(user_id)
+            if user is None:
+                token = self.sessions.load_token()
+                user = self._load_user(user_id, SESSION_COLUMNS)
+                if user is None:
+                    return None
+                self.sessions.put(user_id, user, token)
+            return user
+        except Exception as e:
+            logging.error(f"Error getting session for user {user_id}: {e}")
             return None
+
+    def _load_user(self, user_id, columns=None):
+        """Read one user (all columns, or just `columns`) including pending writes."""
+        select = ', '.join(columns) if columns else '*'
+        user = self._query(
+            f"SELECT {select} FROM users WHERE user_id = ?", (user_id,), self.user_rows
+        ).fetchone()
+
+        if user is not None:
+            pending = self._pending(user_id)
+            if pending:
+                user = user.replace(pending)
+        return user
+
+    def _load_columns(self, user_id, columns):
+        """Lazy loader for `User` records: the given columns as a dict."""
+        user = self._load_user(user_id, columns)
+        return dict(zip(columns, (user[column] for column in columns))) if user else None
+
+    def get_user_data(self, user_id):
+        try:
+            return self.get_session(user_id)
         except Exception as e:
             logging.error(f"Error getting user data {user_id}: {e}")
             return None
-    
+
+    def get_user_uncached(self, user_id, columns):
+        """`columns` of one user read from the users table, bypassing the session cache.
+
+        The cache is per process, so decisions another bot process may have
+        changed the answer to (a shared job firing, the phone being shared)
+        must not trust it. None if the user is unknown or the read failed.
+        """
+        try:
+            return self._load_user(user_id, columns)
+        except Exception as e:
+            logging.error(f"Error reading user {user_id}: {e}")
+            return None
+
     def get_user_state(self, user_id):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT state FROM users WHERE user_id = ?", (user_id,))
-            result = cursor.fetchone()
-            
-            conn.close()
-            return result[0] if result else "start"
+            user = self.get_session(user_id)
+            return user['state'] if user else "start"
         except Exception as e:
             logging.error(f"Error getting user state {user_id}: {e}")
             return "start"
-    
+
     def save_message_id(self, user_id, message_id, message_type):
         """Store message ID for later editing/deletion."""
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT OR REPLACE INTO user_messages 
-                (user_id, message_id, message_type) 
+            if self.write_behind:
+                self.write_behind.save_message_id(user_id, message_id, message_type)
+                return True
+
+            self._execute("""
+                INSERT OR REPLACE INTO user_messages
+                (user_id, message_id, message_type)
                 VALUES (?, ?, ?)
             """, (user_id, message_id, message_type))
-            
-            conn.commit()
-            conn.close()
             return True
         except Exception as e:
             logging.error(f"Error saving message ID: {e}")
             return False
-    
+
     def get_message_id(self, user_id, message_type):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT message_id FROM user_messages 
+            if self.write_behind:
+                message_id = self.write_behind.pending_message_id(user_id, message_type)
+                if message_id is not None:
+                    return message_id
+
+            result = self._fetchone("""
+                SELECT message_id FROM user_messages
                 WHERE user_id = ? AND message_type = ?
             """, (user_id, message_type))
-            
-            result = cursor.fetchone()
-            conn.close()
-            
+
             return result[0] if result else None
         except Exception as e:
             logging.error(f"Error getting message ID: {e}")
             return None
-    
-    def add_timer(self, user_id, first_reminder, second_reminder):
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT OR REPLACE INTO user_timers 
-                (user_id, first_reminder, second_reminder) 
-                VALUES (?, ?, ?)
-            """, (user_id, first_reminder, second_reminder))
-            
-            conn.commit()
-            conn.close()
-            return True
+
+    def add_job(self, job_type, user_id, due_at, payload=None, replace=True):
+        """Persist a scheduled job; returns its job_id.
+
+        `due_at` is a datetime or epoch seconds. With replace=True any
+        still-pending job of the same type for this user is cancelled.
+        """
+        try:
+            due = due_at.timestamp() if isinstance(due_at, datetime) else float(due_at)
+            with self._write() as cursor:
+                if replace:
+                    self._execute("""
+                        UPDATE scheduled_jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP
+                        WHERE user_id = ? AND job_type = ? AND status = 'pending'
+                    """, (user_id, job_type))
+                cursor.execute("""
+                    INSERT INTO scheduled_jobs (job_type, user_id, due_at, payload)
+                    VALUES (?, ?, ?, ?)
+                """, (job_type, user_id, due, json.dumps(payload, ensure_ascii=False) if payload is not None else None))
+                return cursor.lastrowid
         except Exception as e:
-            logging.error(f"Error adding timer: {e}")
+            logging.error(f"Error adding {job_type} job for user {user_id}: {e}")
+            return None
+
+    def cancel_jobs(self, user_id, job_types=None):
+        """Cancel a user's pending jobs (optionally only some types)."""
+        try:
+            sql = """
+                UPDATE scheduled_jobs SET status = 'cancelled', finished_at = CURRENT_TIMESTAMP
+                WHERE user_id = ? AND status = 'pending'
+            """
+            params = [user_id]
+            if job_types:
+                sql += f" AND job_type IN ({', '.join('?' * len(job_types))})"
+                params += list(job_types)
+            return self._execute(sql, params)
+        except Exception as e:
+            logging.error(f"Error cancelling jobs for user {user_id}: {e}")
+            return 0
+
+    def claim_due_jobs(self, owner, limit=50, lease_seconds=60, now=None, since=0.0):
+        """Atomically lease due jobs to `owner`.
+
+        Picks pending jobs whose due_at has passed (and is not before
+        `since`) plus leased jobs whose lease expired (their worker died),
+        so several processes can drain the same table without two of them
+        holding one job.
+        """
+        try:
+            now = time.time() if now is None else now
+            sql = """
+                UPDATE scheduled_jobs
+                SET status = 'leased', lease_owner = ?, lease_expires = ?, attempts = attempts + 1
+                WHERE job_id IN (
+                    SELECT job_id FROM (
+                        SELECT job_id FROM scheduled_jobs WHERE status = 'pending' AND due_at BETWEEN ? AND ?
+                        UNION ALL
+                        SELECT job_id FROM scheduled_jobs WHERE status = 'leased' AND lease_expires <= ?
+                    )
+                    LIMIT ?
+                )
+                RETURNING job_id, job_type, user_id, due_at, payload, attempts
+            """
+            params = (owner, now + lease_seconds, since, now, now, limit)
+            if self.explain_queries:
+                self._explain(sql, params)
+            with self._write() as cursor:
+                rows = cursor.execute(sql, params).fetchall()
+
+            return [{
+                'job_id': job_id,
+                'job_type': job_type,
+                'user_id': user_id,
+                'due_at': due,
+                'payload': json.loads(payload) if payload else {},
+                'attempts': attempts
+            } for job_id, job_type, user_id, due, payload, attempts in rows]
+        except Exception as e:
+            logging.error(f"Error claiming due jobs: {e}")
+            return []
+
+    def complete_job(self, job_id, owner, status='done'):
+        """Mark a leased job done (or 'skipped'); False if the lease was lost meanwhile."""
+        try:
+            return self._execute("""
+                UPDATE scheduled_jobs SET status = ?, finished_at = CURRENT_TIMESTAMP
+                WHERE job_id = ? AND lease_owner = ? AND status = 'leased'
+            """, (status, job_id, owner)) == 1
+        except Exception as e:
+            logging.error(f"Error completing job {job_id}: {e}")
             return False
-    
-    def add_final_photo_timer(self, user_id, send_time):
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                INSERT OR REPLACE INTO final_photo_timers 
-                (user_id, send_time, is_sent) 
-                VALUES (?, ?, 0)
-            """, (user_id, send_time))
-            
-            conn.commit()
-            conn.close()
-            return True
+
+    def fail_job(self, job_id, owner, retry_at=None):
+        """Give a leased job back for a retry at `retry_at`, or mark it failed."""
+        try:
+            if retry_at is None:
+                return self._execute("""
+                    UPDATE scheduled_jobs SET status = 'failed', finished_at = CURRENT_TIMESTAMP
+                    WHERE job_id = ? AND lease_owner = ? AND status = 'leased'
+                """, (job_id, owner)) == 1
+            return self._execute("""
+                UPDATE scheduled_jobs
+                SET status = 'pending', due_at = ?, lease_owner = NULL, lease_expires = NULL
+                WHERE job_id = ? AND lease_owner = ? AND status = 'leased'
+            """, (retry_at, job_id, owner)) == 1
         except Exception as e:
-            logging.error(f"Error adding final photo timer: {e}")
+            logging.error(f"Error failing job {job_id}: {e}")
             return False
-    
-    def mark_final_photo_sent(self, user_id):
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("UPDATE final_photo_timers SET is_sent = 1 WHERE user_id = ?", (user_id,))
-            
-            conn.commit()
-            conn.close()
-            return True
+
+    def count_overdue_jobs(self, now):
+        """Number of pending jobs due before `now`."""
+        try:
+            return self._fetchone(
+                "SELECT COUNT(*) FROM scheduled_jobs WHERE status = 'pending' AND due_at < ?", (now,)
+            )[0]
+        except Exception as e:
+            logging.error(f"Error counting overdue jobs: {e}")
+            return 0
+
+    def reconcile_overdue_jobs(self, now, first_due, step, relevant_states, limit=1000):
+        """Spread or skip the `limit` most overdue pending jobs.
+
+        Jobs whose type has an entry in `relevant_states` ({job_type:
+        states}) and whose user is no longer in one of those states are
+        marked 'skipped'. The rest get due_at = first_due, first_due +
+        step, ... in their original order. Every handled job leaves the
+        overdue range, so calling this until it returns (0, 0) walks the
+        backlog one window at a time. Returns (rescheduled, skipped).
+        """
+        try:
+            sql = """
+                SELECT j.job_id, j.job_type, u.state
+                FROM scheduled_jobs j LEFT JOIN users u ON u.user_id = j.user_id
+                WHERE j.status = 'pending' AND j.due_at < ?
+                ORDER BY j.due_at, j.job_id
+                LIMIT ?
+            """
+            if self.explain_queries:
+                self._explain(sql, (now, limit))
+            with self._write() as cursor:
+                rows = cursor.execute(sql, (now, limit)).fetchall()
+                skipped, rescheduled = [], []
+                for job_id, job_type, state in rows:
+                    states = relevant_states.get(job_type)
+                    if states is not None and state not in states:
+                        skipped.append((job_id,))
+                    else:
+                        rescheduled.append((first_due + step * len(rescheduled), job_id))
+                cursor.executemany("""
+                    UPDATE scheduled_jobs SET status = 'skipped', finished_at = CURRENT_TIMESTAMP
+                    WHERE job_id = ? AND status = 'pending'
+                """, skipped)
+                cursor.executemany("""
+                    UPDATE scheduled_jobs SET due_at = ? WHERE job_id = ? AND status = 'pending'
+                """, rescheduled)
+            return len(rescheduled), len(skipped)
+        except Exception as e:
+            logging.error(f"Error reconciling overdue jobs: {e}")
+            return 0, 0
+
+    def next_job_due(self, since=0.0):
+        """Earliest due_at (not before `since`) among pending jobs, or None."""
+        try:
+            row = self._fetchone("SELECT MIN(due_at) FROM scheduled_jobs WHERE status = 'pending' AND due_at >= ?", (since,))
+            return row[0] if row else None
+        except Exception as e:
+            logging.error(f"Error reading next job due time: {e}")
+            return None
+
+    def add_invite_links(self, chat_id, links):
+        """Add freshly minted links to the pool; returns how many were new."""
+        try:
+            with self._write() as cursor:
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO invite_links (chat_id, invite_link) VALUES (?, ?)",
+                    [(chat_id, link) for link in links]
+                )
+                return cursor.rowcount
         except Exception as e:
-            logging.error(f"Error marking final photo as sent: {e}")
+            logging.error(f"Error adding invite links: {e}")
+            return 0
+
+    def take_invite_link(self, chat_id, user_id):
+        """Hand the oldest unissued link to a user, or None if the pool is empty.
+
+        A user who already got a link for this chat gets the same one back,
+        so a retried registration step does not burn a second link.
+        """
+        try:
+            with self._write() as cursor:
+                row = cursor.execute("""
+                    SELECT invite_link FROM invite_links WHERE chat_id = ? AND user_id = ?
+                """, (chat_id, user_id)).fetchone()
+                if row:
+                    return row[0]
+                sql = """
+                    UPDATE invite_links SET user_id = ?, issued_at = CURRENT_TIMESTAMP
+                    WHERE link_id = (
+                        SELECT link_id FROM invite_links WHERE chat_id = ? AND user_id IS NULL
+                        ORDER BY link_id LIMIT 1
+                    )
+                    RETURNING invite_link
+                """
+                if self.explain_queries:
+                    self._explain(sql, (user_id, chat_id))
+                row = cursor.execute(sql, (user_id, chat_id)).fetchone()
+                return row[0] if row else None
+        except Exception as e:
+            logging.error(f"Error taking invite link for user {user_id}: {e}")
+            return None
+
+    def record_invite_link(self, chat_id, invite_link, user_id):
+        """Store a link minted on demand as already issued to `user_id`."""
+        try:
+            self._execute("""
+                INSERT OR IGNORE INTO invite_links (chat_id, invite_link, user_id, issued_at)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP)
+            """, (chat_id, invite_link, user_id))
+        except Exception as e:
+            logging.error(f"Error recording invite link for user {user_id}: {e}")
+
+    def count_invite_links(self, chat_id):
+        """Number of unissued links in the pool."""
+        try:
+            return self._fetchone(
+                "SELECT COUNT(*) FROM invite_links WHERE chat_id = ? AND user_id IS NULL", (chat_id,)
+            )[0]
+        except Exception as e:
+            logging.error(f"Error counting invite links: {e}")
+            return 0
+
+    def get_media_assets(self):
+        """Persisted media asset rows keyed by name."""
+        try:
+            rows = self._fetchall("SELECT name, kind, file_id, config_file_id, status, error, checked_at FROM media_assets")
+            return {row[0]: {
+                'name': row[0],
+                'kind': row[1],
+                'file_id': row[2],
+                'config_file_id': row[3],
+                'status': row[4],
+                'error': row[5],
+                'checked_at': row[6]
+            } for row in rows}
+        except Exception as e:
+            logging.error(f"Error loading media assets: {e}")
+            return {}
+
+    def save_media_asset(self, name, kind, file_id, config_file_id, status, error=None):
+        try:
+            self._execute("""
+                INSERT INTO media_assets (name, kind, file_id, config_file_id, status, error, checked_at)
+                VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(name) DO UPDATE SET
+                    kind = excluded.kind, file_id = excluded.file_id, config_file_id = excluded.config_file_id,
+                    status = excluded.status, error = excluded.error, checked_at = excluded.checked_at
+            """, (name, kind, file_id, config_file_id, status, error))
+        except Exception as e:
+            logging.error(f"Error saving media asset {name}: {e}")
+
+    def create_broadcast(self, admin_id):
+        """Start a draft broadcast; returns its id."""
+        try:
+            with self._write() as cursor:
+                cursor.execute("INSERT INTO broadcasts (admin_id) VALUES (?)", (admin_id,))
+                return cursor.lastrowid
+        except Exception as e:
+            logging.error(f"Error creating broadcast: {e}")
+            return None
+
+    def add_broadcast_recipients(self, broadcast_id, user_ids, batch_size=1000):
+        """Add recipients from any iterable, one transaction per batch; duplicates are ignored."""
+        try:
+            added = 0
+            batch = []
+            for user_id in user_ids:
+                batch.append((broadcast_id, user_id))
+                if len(batch) >= batch_size:
+                    added += self._insert_broadcast_recipients(broadcast_id, batch)
+                    batch = []
+            if batch:
+                added += self._insert_broadcast_recipients(broadcast_id, batch)
+            return added
+        except Exception as e:
+            logging.error(f"Error adding recipients to broadcast {broadcast_id}: {e}")
+            return 0
+
+    def _insert_broadcast_recipients(self, broadcast_id, rows):
+        with self._write() as cursor:
+            cursor.executemany(
+                "INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id) VALUES (?, ?)", rows
+            )
+            added = cursor.rowcount
+            cursor.execute("UPDATE broadcasts SET total = total + ? WHERE broadcast_id = ?", (added, broadcast_id))
+            return added
+
+    def update_broadcast(self, broadcast_id, **columns):
+        """Set broadcast columns (message, progress message, status...)."""
+        try:
+            assignments = ', '.join(f"{column} = ?" for column in columns)
+            return self._execute(
+                f"UPDATE broadcasts SET {assignments} WHERE broadcast_id = ?",
+                (*columns.values(), broadcast_id)
+            ) == 1
+        except Exception as e:
+            logging.error(f"Error updating broadcast {broadcast_id}: {e}")
+            return False
+
+    def set_broadcast_status(self, broadcast_id, status, from_statuses):
+        """Move a broadcast to `status` if it is in one of `from_statuses`; False otherwise."""
+        try:
+            placeholders = ', '.join('?' * len(from_statuses))
+            with self._write():
+                changed = self._execute(f"""
+                    UPDATE broadcasts SET status = ?,
+                        started_at = CASE WHEN ? = 'running' THEN COALESCE(started_at, CURRENT_TIMESTAMP) ELSE started_at END,
+                        finished_at = CASE WHEN ? IN ('done', 'cancelled') THEN CURRENT_TIMESTAMP ELSE finished_at END
+                    WHERE broadcast_id = ? AND status IN ({placeholders})
+                """, (status, status, status, broadcast_id, *from_statuses)) == 1
+                if changed and status == 'cancelled':
+                    self._execute("""
+                        UPDATE broadcast_recipients SET status = 'cancelled', updated_at = CURRENT_TIMESTAMP
+                        WHERE broadcast_id = ? AND status IN ('pending', 'queued')
+                    """, (broadcast_id,))
+                return changed
+        except Exception as e:
+            logging.error(f"Error setting broadcast {broadcast_id} to {status}: {e}")
             return False
-    
-    def get_pending_final_photos(self):
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT user_id, send_time FROM final_photo_timers 
-                WHERE is_sent = 0 AND send_time <= CURRENT_TIMESTAMP
-            """)
-            
-            results = cursor.fetchall()
-            conn.close()
-            
-            return results
-        except Exception as e:
-            logging.error(f"Error getting pending final photos: {e}")
+
+    def get_broadcast(self, broadcast_id):
+        try:
+            row = self._query(
+                "SELECT * FROM broadcasts WHERE broadcast_id = ?", (broadcast_id,), sqlite3.Row
+            ).fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logging.error(f"Error loading broadcast {broadcast_id}: {e}")
+            return None
+
+    def get_broadcasts(self, statuses):
+        """Broadcasts in any of `statuses`, oldest first."""
+        try:
+            placeholders = ', '.join('?' * len(statuses))
+            return [dict(row) for row in self._query(
+                f"SELECT * FROM broadcasts WHERE status IN ({placeholders}) ORDER BY broadcast_id",
+                tuple(statuses), sqlite3.Row
+            ).fetchall()]
+        except Exception as e:
+            logging.error(f"Error loading broadcasts: {e}")
             return []
-    
-    def get_stats(self):
-        """Retrieve bot usage statistics."""
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT COUNT(*) FROM users")
-            total_users = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_vip = 1")
-            vip_users = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM users WHERE is_hot_lead = 1")
-            hot_leads = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM users WHERE selected_expert = 'forough'")
-            forough_users = cursor.fetchone()[0]
-            
-            cursor.execute("SELECT COUNT(*) FROM users WHERE selected_expert = 'sadegh'")
-            sadegh_users = cursor.fetchone()[0]
-            
-            conn.close()
-            
+
+    def claim_broadcast_recipients(self, broadcast_id, limit):
+        """Mark up to `limit` pending recipients 'queued' and return their ids.
+
+        Queued rows are only on the outbox; each becomes 'sending' when its
+        call is dispatched (`mark_broadcast_recipient_sending`). Recipients
+        already known to have blocked the bot are marked 'blocked' here
+        instead of being returned.
+        """
+        try:
+            sql = """
+                UPDATE broadcast_recipients SET status = 'queued', updated_at = CURRENT_TIMESTAMP
+                WHERE broadcast_id = ? AND user_id IN (
+                    SELECT user_id FROM broadcast_recipients
+                    WHERE broadcast_id = ? AND status = 'pending'
+                    LIMIT ?
+                )
+                RETURNING user_id
+            """
+            if self.explain_queries:
+                self._explain(sql, (broadcast_id, broadcast_id, limit))
+            with self._write() as cursor:
+                while True:
+                    user_ids = [row[0] for row in cursor.execute(sql, (broadcast_id, broadcast_id, limit)).fetchall()]
+                    if not user_ids:
+                        return []
+                    blocked = {row[0] for row in cursor.execute(
+                        f"SELECT user_id FROM users WHERE is_blocked = 1 AND user_id IN ({', '.join('?' * len(user_ids))})",
+                        user_ids
+                    )}
+                    if blocked:
+                        cursor.executemany("""
+                            UPDATE broadcast_recipients SET status = 'blocked', error = 'blocked earlier'
+                            WHERE broadcast_id = ? AND user_id = ?
+                        """, [(broadcast_id, user_id) for user_id in blocked])
+                    # An empty answer means "nothing left", so claim past a
+                    # window made up entirely of blocked users
+                    sendable = [user_id for user_id in user_ids if user_id not in blocked]
+                    if sendable:
+                        return sendable
+        except Exception as e:
+            logging.error(f"Error claiming recipients of broadcast {broadcast_id}: {e}")
+            return []
+
+    def mark_broadcast_recipient_sending(self, broadcast_id, user_id):
+        """Checkpoint a queued recipient as 'sending' right before its API call.
+
+        Committed before the call, so after a crash the row shows a send
+        that may or may not have happened. False if the row is no longer
+        queued (the broadcast was cancelled) and nothing should be sent.
+        """
+        try:
+            return self._execute("""
+                UPDATE broadcast_recipients SET status = 'sending', updated_at = CURRENT_TIMESTAMP
+                WHERE broadcast_id = ? AND user_id = ? AND status = 'queued'
+            """, (broadcast_id, user_id)) == 1
+        except Exception as e:
+            logging.error(f"Error checkpointing recipient {user_id} of broadcast {broadcast_id}: {e}")
+            return False
+
+    def finish_broadcast_recipients(self, broadcast_id, results):
+        """Record send outcomes: [(user_id, status, error)]."""
+        try:
+            with self._write() as cursor:
+                cursor.executemany("""
+                    UPDATE broadcast_recipients SET status = ?, error = ?, updated_at = CURRENT_TIMESTAMP
+                    WHERE broadcast_id = ? AND user_id = ? AND status IN ('queued', 'sending')
+                """, [(status, error, broadcast_id, user_id) for user_id, status, error in results])
+        except Exception as e:
+            logging.error(f"Error recording results of broadcast {broadcast_id}: {e}")
+
+    def recover_broadcast(self, broadcast_id):
+        """After a crash: 'sending' rows become 'unknown', 'queued' ones pending again.
+
+        Returns (unknown, requeued).
+        """
+        try:
+            with self._write():
+                unknown = self._execute("""
+                    UPDATE broadcast_recipients SET status = 'unknown', updated_at = CURRENT_TIMESTAMP
+                    WHERE broadcast_id = ? AND status = 'sending'
+                """, (broadcast_id,))
+                requeued = self._execute("""
+                    UPDATE broadcast_recipients SET status = 'pending', updated_at = CURRENT_TIMESTAMP
+                    WHERE broadcast_id = ? AND status = 'queued'
+                """, (broadcast_id,))
+                return unknown, requeued
+        except Exception as e:
+            logging.error(f"Error recovering broadcast {broadcast_id}: {e}")
+            return 0, 0
+
+    def get_broadcast_progress(self, broadcast_id):
+        """Recipient counts by status, e.g. {'pending': 10, 'sent': 90}."""
+        try:
+            return dict(self._fetchall("""
+                SELECT status, COUNT(*) FROM broadcast_recipients
+                WHERE broadcast_id = ? GROUP BY status
+            """, (broadcast_id,)))
+        except Exception as e:
+            logging.error(f"Error reading progress of broadcast {broadcast_id}: {e}")
+            return {}
+
+    def stage_import_ids(self, import_id, user_ids):
+        """Add a chunk of uploaded ids to the staging table; returns how many were new."""
+        try:
+            with self._write() as cursor:
+                cursor.executemany(
+                    "INSERT OR IGNORE INTO recipient_imports (import_id, user_id) VALUES (?, ?)",
+                    [(import_id, user_id) for user_id in user_ids]
+                )
+                return cursor.rowcount
+        except Exception as e:
+            logging.error(f"Error staging ids for import {import_id}: {e}")
+            return 0
+
+    def summarize_import(self, import_id, sample_size=10):
+        """Staged ids checked against users: unique, unknown and blocked counts plus samples."""
+        try:
+            unique, unknown, blocked = self._fetchone("""
+                SELECT COUNT(*), COUNT(*) - COUNT(u.user_id), COALESCE(SUM(u.is_blocked), 0)
+                FROM recipient_imports r LEFT JOIN users u ON u.user_id = r.user_id
+                WHERE r.import_id = ?
+            """, (import_id,))
+            unknown_sample = [row[0] for row in self._fetchall("""
+                SELECT r.user_id FROM recipient_imports r
+                WHERE r.import_id = ? AND NOT EXISTS (SELECT 1 FROM users u WHERE u.user_id = r.user_id)
+                LIMIT ?
+            """, (import_id, sample_size))]
+            blocked_sample = [row[0] for row in self._fetchall("""
+                SELECT r.user_id FROM recipient_imports r JOIN users u ON u.user_id = r.user_id
+                WHERE r.import_id = ? AND u.is_blocked = 1
+                LIMIT ?
+            """, (import_id, sample_size))]
             return {
-                'total_users': total_users,
-                'vip_users': vip_users,
-                'hot_leads': hot_leads,
-                'forough_users': forough_users,
-                'sadegh_users': sadegh_users
+                'unique': unique,
+                'unknown': unknown,
+                'blocked': blocked,
+                'sendable': unique - unknown - blocked,
+                'unknown_sample': unknown_sample,
+                'blocked_sample': blocked_sample
             }
+        except Exception as e:
+            logging.error(f"Error summarizing import {import_id}: {e}")
+            return {'unique': 0, 'unknown': 0, 'blocked': 0, 'sendable': 0, 'unknown_sample': [], 'blocked_sample': []}
+
+    def add_import_to_broadcast(self, broadcast_id, import_id, batch_size=10000):
+        """Copy staged ids of known, unblocked users into a broadcast, in keyset batches."""
+        try:
+            added, after = 0, None
+            while True:
+                with self._write() as cursor:
+                    row = cursor.execute("""
+                        SELECT MAX(user_id), COUNT(*) FROM (
+                            SELECT user_id FROM recipient_imports
+                            WHERE import_id = ? AND user_id > COALESCE(?, -1)
+                            ORDER BY user_id LIMIT ?
+                        )
+                    """, (import_id, after, batch_size)).fetchone()
+                    if not row[1]:
+                        return added
+                    cursor.execute("""
+                        INSERT OR IGNORE INTO broadcast_recipients (broadcast_id, user_id)
+                        SELECT ?, r.user_id FROM recipient_imports r JOIN users u ON u.user_id = r.user_id
+                        WHERE r.import_id = ? AND r.user_id > COALESCE(?, -1) AND r.user_id <= ?
+                            AND COALESCE(u.is_blocked, 0) = 0
+                    """, (broadcast_id, import_id, after, row[0]))
+                    inserted = cursor.rowcount
+                    cursor.execute("UPDATE broadcasts SET total = total + ? WHERE broadcast_id = ?",
+                                   (inserted, broadcast_id))
+                    added += inserted
+                    after = row[0]
+        except Exception as e:
+            logging.error(f"Error adding import {import_id} to broadcast {broadcast_id}: {e}")
+            return 0
+
+    def discard_import(self, import_id=None):
+        """Drop one upload's staged ids, or every staged upload when import_id is None."""
+        try:
+            if import_id is None:
+                self._execute("DELETE FROM recipient_imports")
+            else:
+                self._execute("DELETE FROM recipient_imports WHERE import_id = ?", (import_id,))
+        except Exception as e:
+            logging.error(f"Error discarding import {import_id}: {e}")
+
+    def set_user_blocked(self, user_id, blocked=True):
+        """Flag a user the bot can no longer message (403 on send), or clear the flag."""
+        return self.update_user_columns(user_id, {'is_blocked': 1 if blocked else 0})
+
+    def get_stats(self):
+        """Retrieve bot usage statistics from the trigger-maintained counters."""
+        try:
+            placeholders = ', '.join('?' * len(counters.ALL_DIMENSIONS))
+            rows = self._fetchall(f"""
+                SELECT dimension, value, count FROM user_counters
+                WHERE dimension IN ({placeholders})
+            """, counters.ALL_DIMENSIONS)
+
+            buckets = {dimension: {} for dimension in counters.ALL_DIMENSIONS}
+            for dimension, value, count in rows:
+                if count:
+                    buckets[dimension][value] = count
+
+            experts = {name: count for name, count in buckets['expert'].items() if name}
+            stats = {
+                'total_users': buckets['total'].get('', 0),
+                'vip_users': buckets['vip'].get('1', 0),
+                'hot_leads': buckets['hot_lead'].get('1', 0),
+                'completed_users': buckets['completed'].get('1', 0),
+                'experts': experts,
+                'states': buckets['state']
+            }
+            for name, count in experts.items():
+                stats[f'{name}_users'] = count
+            return stats
         except Exception as e:
             logging.error(f"Error getting stats: {e}")
             return {
                 'total_users': 0,
                 'vip_users': 0,
                 'hot_leads': 0,
-                'forough_users': 0,
-                'sadegh_users': 0
+                'completed_users': 0,
+                'experts': {},
+                'states': {}
             }
-    
+
+    def check_counters(self, repair=False):
+        """Recompute the stats counters from `users` and report drift.
+
+        Returns {(dimension, value): (stored, actual)} for every bucket that
+        differs; with repair=True the stored counters are rebuilt as well.
+        """
+        try:
+            with self._write() as cursor:
+                actual = counters.recompute(cursor)
+                stored = {
+                    (dimension, value): count
+                    for dimension, value, count in cursor.execute(
+                        "SELECT dimension, value, count FROM user_counters"
+                    )
+                }
+                drift = {
+                    key: (stored.get(key, 0), actual.get(key, 0))
+                    for key in stored.keys() | actual.keys()
+                    if stored.get(key, 0) != actual.get(key, 0)
+                }
+                if drift and repair:
+                    counters.rebuild(cursor)
+
+            if drift:
+                logging.warning(f"User counters drifted in {len(drift)} bucket(s){' (repaired)' if repair else ''}: {drift}")
+            return drift
+        except Exception as e:
+            logging.error(f"Error checking counters: {e}")
+            return None
+
+    def get_users_page(self, after_date=None, after_user_id=None, limit=100, expert=None, hot_leads=False):
+        """Return one keyset page of users, newest first, and the cursor for the next one.
+
+        Users are ordered by registration_date (phone_date for hot leads)
+        descending, then user_id descending; rows without a date come last.
+        Pass the returned (after_date, after_user_id) back in to continue;
+        it is None once the last page has been read.
+        """
+        date_column = 'phone_date' if hot_leads else 'registration_date'
+        filters, params = [], []
+        if hot_leads:
+            filters.append("is_hot_lead = 1")
+        if expert is not None:
+            filters.append("selected_expert = ?")
+            params.append(expert)
+
+        undated = after_date is None and after_user_id is not None
+        if undated:
+            conditions = filters + [f"{date_column} IS NULL", "user_id < ?"]
+            page_params = params + [after_user_id]
+            order = "user_id DESC"
+        elif after_date is None:
+            conditions = filters + [f"{date_column} IS NOT NULL"]
+            page_params = list(params)
+            order = f"{date_column} DESC, user_id DESC"
+        else:
+            conditions = filters + [f"({date_column}, user_id) < (?, ?)"]
+            page_params = params + [after_date, after_user_id]
+            order = f"{date_column} DESC, user_id DESC"
+
+        rows = self._query(f"""
+            SELECT * FROM users
+            WHERE {' AND '.join(conditions)}
+            ORDER BY {order}
+            LIMIT ?
+        """, (*page_params, limit), self.user_rows).fetchall()
+
+        if len(rows) == limit:
+            last = rows[-1]
+            return rows, (None if undated else last[date_column], last['user_id'])
+        if not undated:
+            # Dated rows are exhausted; continue with undated ones if there are any
+            has_undated = self._fetchone(
+                f"SELECT 1 FROM users WHERE {' AND '.join(filters + [f'{date_column} IS NULL'])} LIMIT 1",
+                params
+            )
+            if has_undated:
+                return rows, (None, MAX_USER_ID)
+        return rows, None
+
+    def iter_users(self, expert=None, hot_leads=False, chunk_size=1000):
+        """Stream users page by page in constant memory (same order as get_users_page)."""
+        after_date, after_user_id = None, None
+        while True:
+            rows, next_page = self.get_users_page(after_date, after_user_id, chunk_size, expert, hot_leads)
+            yield from rows
+            if next_page is None:
+                return
+            after_date, after_user_id = next_page
+
+    def data_version(self, name='users'):
+        """Change counter of a table, bumped by triggers on every write."""
+        try:
+            row = self._fetchone("SELECT version FROM data_versions WHERE name = ?", (name,))
+            return row[0] if row else None
+        except Exception as e:
+            logging.error(f"Error reading data version of {name}: {e}")
+            return None
+
+    @contextmanager
+    def users_snapshot(self, chunk_size=5000):
+        """(version, rows) of the users table read in one transaction.
+
+        `rows` yields plain tuples in `user_columns` order from a single
+        cursor, fetched `chunk_size` at a time, and matches `version`
+        exactly. Write-behind updates are flushed first. The read
+        transaction stays open until the block exits.
+        """
+        self.flush()
+        conn = self._reader()
+        conn.execute("BEGIN")
+        try:
+            version = conn.execute("SELECT version FROM data_versions WHERE name = 'users'").fetchone()[0]
+            cursor = conn.execute(f"SELECT {', '.join(self.user_columns)} FROM users ORDER BY user_id")
+
+            def rows():
+                while True:
+                    chunk = cursor.fetchmany(chunk_size)
+                    if not chunk:
+                        return
+                    yield from chunk
+            yield version, rows()
+        finally:
+            conn.execute("COMMIT")
+
+    def get_hot_leads_since(self, after_date, after_user_id, until, columns, limit=1000):
+        """Hot leads after the (phone_date, user_id) cursor and up to `until`, oldest first.
+
+        A range scan of idx_users_hot_lead_phone_date (user_id is the
+        index's implicit last key, so the order needs no sort). Rows are
+        tuples in `columns` order; empty on error, so no cursor moves past
+        rows that were not read.
+        """
+        try:
+            return self._fetchall(f"""
+                SELECT {', '.join(columns)} FROM users
+                WHERE is_hot_lead = 1 AND (phone_date, user_id) > (?, ?) AND phone_date <= ?
+                ORDER BY phone_date, user_id
+                LIMIT ?
+            """, (after_date, after_user_id, until, limit))
+        except Exception as e:
+            logging.error(f"Error reading hot leads after {after_date} #{after_user_id}: {e}")
+            return []
+
+    def get_lead_cursor(self, consumer):
+        """The consumer's feed cursor as a dict, or None if it never pulled."""
+        try:
+            row = self._query(
+                "SELECT * FROM lead_feed_cursors WHERE consumer = ?", (consumer,), sqlite3.Row
+            ).fetchone()
+            return dict(row) if row else None
+        except Exception as e:
+            logging.error(f"Error reading lead feed cursor of {consumer}: {e}")
+            return None
+
+    def get_lead_cursors(self):
+        try:
+            return [dict(row) for row in self._query(
+                "SELECT * FROM lead_feed_cursors ORDER BY consumer", (), sqlite3.Row
+            ).fetchall()]
+        except Exception as e:
+            logging.error(f"Error reading lead feed cursors: {e}")
+            return []
+
+    def set_lead_cursor(self, consumer, phone_date, user_id, rows):
+        """Advance a consumer's cursor after a delivered pull of `rows` leads."""
+        try:
+            self._execute("""
+                INSERT INTO lead_feed_cursors (consumer, phone_date, user_id, pulls, rows_total, pulled_at)
+                VALUES (?, ?, ?, 1, ?, CURRENT_TIMESTAMP)
+                ON CONFLICT(consumer) DO UPDATE SET
+                    phone_date = excluded.phone_date, user_id = excluded.user_id,
+                    pulls = pulls + 1, rows_total = rows_total + excluded.rows_total,
+                    pulled_at = excluded.pulled_at
+            """, (consumer, phone_date, user_id, rows))
+            return True
+        except Exception as e:
+            logging.error(f"Error saving lead feed cursor of {consumer}: {e}")
+            return False
+
+    def reset_lead_cursor(self, consumer):
+        """Forget a consumer's cursor; its next pull starts from the first lead."""
+        try:
+            self._execute("DELETE FROM lead_feed_cursors WHERE consumer = ?", (consumer,))
+        except Exception as e:
+            logging.error(f"Error resetting lead feed cursor of {consumer}: {e}")
+
     def get_all_users(self):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT * FROM users ORDER BY registration_date DESC")
-            columns = [description[0] for description in cursor.description]
-            rows = cursor.fetchall()
-            
-            conn.close()
-            
-            return [dict(zip(columns, row)) for row in rows]
+            return list(self.iter_users())
         except Exception as e:
             logging.error(f"Error getting all users: {e}")
             return []
-    
+
     def get_hot_leads(self):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT * FROM users 
-                WHERE is_hot_lead = 1 
-                ORDER BY phone_date DESC
-            """)
-            columns = [description[0] for description in cursor.description]
-            rows = cursor.fetchall()
-            
-            conn.close()
-            
-            return [dict(zip(columns, row)) for row in rows]
+            return list(self.iter_users(hot_leads=True))
         except Exception as e:
             logging.error(f"Error getting hot leads: {e}")
             return []
-    
+
     def get_users_by_expert(self, expert_name):
         try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT * FROM users 
-                WHERE selected_expert = ? 
-                ORDER BY registration_date DESC
-            """, (expert_name,))
-            columns = [description[0] for description in cursor.description]
-            rows = cursor.fetchall()
-            
-            conn.close()
-            
-            return [dict(zip(columns, row)) for row in rows]
+            return list(self.iter_users(expert=expert_name))
         except Exception as e:
             logging.error(f"Error getting users by expert: {e}")
             return []
-    
-    def get_pending_timers(self):
-        """Retrieve active reminder timers."""
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT user_id, first_reminder, second_reminder FROM user_timers 
-            """)
-            
-            results = cursor.fetchall()
-            conn.close()
-            
-            pending_timers = {}
-            for row in results:
-                user_id, first_reminder, second_reminder = row
-                first_reminder_dt = datetime.fromisoformat(first_reminder) if first_reminder else None
-                second_reminder_dt = datetime.fromisoformat(second_reminder) if second_reminder else None
-                pending_timers[user_id] = {
-                    'first_reminder': first_reminder_dt,
-                    'second_reminder': second_reminder_dt,
-                    'chat_id': user_id,
-                    'first_sent': False,
-                    'second_sent': False
-                }
-            
-            return pending_timers
-        except Exception as e:
-            logging.error(f"Error getting pending timers: {e}")
-            return {}
 
-    def get_pending_final_photo_timers(self):
-        """Retrieve pending final photo tasks."""
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                SELECT user_id, send_time FROM final_photo_timers 
-                WHERE is_sent = 0
-            """)
-            
-            results = cursor.fetchall()
-            conn.close()
-            
-            pending_photos = {}
-            for row in results:
-                user_id, send_time = row
-                send_time_dt = datetime.fromisoformat(send_time)
-                pending_photos[user_id] = {
-                    'send_time': send_time_dt,
-                    'chat_id': user_id,
-                    'sent': False 
-                }
-            
-            return pending_photos
+    def _journal_user(self, user_id):
+        """Append the committed row of one user to the change journal."""
+        if not self.journal:
+            return
+        try:
+            user = self._load_user(user_id)
+            if user:
+                self.journal.append(user)
         except Exception as e:
-            logging.error(f"Error getting pending final photos: {e}")
-            return {}
+            logging.error(f"Error journaling user {user_id}: {e}")
+
+    def _iter_snapshot_rows(self):
+        """Stream every user row for a journal snapshot."""
+        return self.iter_users(chunk_size=5000)
 
     def backup_to_json(self):
-        """Backup current state to JSON."""
+        """Write a full JSON snapshot now and truncate the change journal."""
         try:
-            users = self.get_all_users()
-            with open(self.json_file, 'w', encoding='utf-8') as f:
-                json.dump(users, f, ensure_ascii=False, indent=2, default=str)
+            if self.journal:
+                self.journal.compact(self._iter_snapshot_rows())
         except Exception as e:
             logging.error(f"Error backing up to JSON: {e}")
-    
+
+    def restore_users(self, users, batch_size=1000):
+        """Upsert full user rows (e.g. from a snapshot/journal replay).
+
+        An existing row is updated in place rather than replaced: REPLACE
+        deletes without firing the delete trigger, which would count the
+        user twice in user_counters.
+        """
+        columns = self.user_columns
+        count = 0
+        batch = []
+
+        def flush():
+            with self._write() as cursor:
+                for user in batch:
+                    known = [column for column in columns if column in user]
+                    updates = [f"{column} = excluded.{column}" for column in known if column != 'user_id']
+                    cursor.execute(
+                        f"INSERT INTO users ({', '.join(known)}) "
+                        f"VALUES ({', '.join('?' * len(known))}) "
+                        f"ON CONFLICT (user_id) DO "
+                        + (f"UPDATE SET {', '.join(updates)}" if updates else "NOTHING"),
+                        [user[column] for column in known]
+                    )
+            batch.clear()
+
+        for user in users:
+            batch.append(user)
+            count += 1
+            if len(batch) >= batch_size:
+                flush()
+        if batch:
+            flush()
+        self.sessions.invalidate()
+        return count
+
     def cleanup_old_timers(self, days=7):
-        """Remove old timer records."""
-        try:
-            conn = sqlite3.connect(self.db_file)
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                DELETE FROM user_timers 
-                WHERE second_reminder < datetime('now', '-{} days')
-            """.format(days))
-            
-            cursor.execute("""
-                DELETE FROM final_photo_timers 
-                WHERE is_sent = 1 AND send_time < datetime('now', '-{} days')
-            """.format(days))
-            
-            conn.commit()
-            conn.close()
+        """Remove finished jobs and old legacy timer records."""
+        try:
+            cutoff = f'-{int(days)} days'
+            with self._write():
+                self._execute("""
+                    DELETE FROM scheduled_jobs
+                    WHERE status IN ('done', 'skipped', 'cancelled', 'failed') AND finished_at < datetime('now', ?)
+                """, (cutoff,))
+
+                self._execute("""
+                    DELETE FROM user_timers
+                    WHERE second_reminder < datetime('now', ?)
+                """, (cutoff,))
+
+                self._execute("""
+                    DELETE FROM final_photo_timers
+                    WHERE is_sent = 1 AND send_time < datetime('now', ?)
+                """, (cutoff,))
+
             logging.info(f"Cleaned up old timers older than {days} days")
         except Exception as e:
-            logging.error(f"Error cleaning up old timers: {e}")
\ No newline at end of file
+            logging.error(f"Error cleaning up old timers: {e}")
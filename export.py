@@ -0,0 +1,216 @@
+# export.py - Streaming users export to Excel or CSV, cached per data version
+
+import os
+import csv
+import json
+import time
+import logging
+import argparse
+import threading
+from config import EXCEL_EXPORT_DIR, EXPORT_ROWS_PER_FILE, EXPORT_PROGRESS_INTERVAL
+
+FORMATS = ('xlsx', 'csv')
+
+class _XlsxFile:
+    def __init__(self, path, columns):
+        import xlsxwriter
+        # constant_memory flushes each row to disk once the next one starts;
+        # cell text is written as-is (no formulas, urls or numbers guessed)
+        self.workbook = xlsxwriter.Workbook(path, {
+            'constant_memory': True,
+            'strings_to_formulas': False,
+            'strings_to_urls': False,
+            'strings_to_numbers': False,
+        })
+        self.sheet = self.workbook.add_worksheet('users')
+        self.sheet.write_row(0, 0, columns)
+        self.row = 0
+
+    def write(self, values):
+        self.row += 1
+        self.sheet.write_row(self.row, 0, values)
+
+    def close(self):
+        self.workbook.close()
+
+class _CsvFile:
+    def __init__(self, path, columns):
+        # utf-8-sig so Excel shows the Persian text correctly
+        self.file = open(path, 'w', encoding='utf-8-sig', newline='')
+        self.writer = csv.writer(self.file)
+        self.writer.writerow(columns)
+        self.write = self.writer.writerow
+
+    def close(self):
+        self.file.close()
+
+WRITERS = {'xlsx': _XlsxFile, 'csv': _CsvFile}
+
+class UserExport:
+    """Exports the users table without holding it in memory.
+
+    Rows stream from one read transaction (`DatabaseManager.users_snapshot`)
+    straight into xlsxwriter's constant_memory mode or a CSV writer. Past
+    `rows_per_file` rows (Excel's sheet limit by default) the export
+    continues in another file. A finished export is recorded in a small
+    manifest next to its files, keyed by the users data version; while the
+    version is unchanged the same files are handed out again, and older
+    versions are deleted.
+
+    `request(fmt, on_progress, on_done)` runs the export on a background
+    thread; requests for a format already being exported wait for that run.
+    """
+
+    def __init__(self, db, export_dir=None, rows_per_file=None, progress_interval=None):
+        self.db = db
+        self.export_dir = export_dir or EXCEL_EXPORT_DIR
+        self.rows_per_file = rows_per_file or EXPORT_ROWS_PER_FILE
+        self.progress_interval = EXPORT_PROGRESS_INTERVAL if progress_interval is None else progress_interval
+        os.makedirs(self.export_dir, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._waiters = {}       # format -> [(on_progress, on_done)] of the running export
+
+    def request(self, fmt, on_progress=None, on_done=None):
+        """Export in the background.
+
+        on_progress(rows_written, total_rows) is called every few seconds;
+        on_done(paths, cached) once at the end, with paths None on failure.
+        Returns False if an export of this format was already running (the
+        callbacks are attached to it).
+        """
+        with self._lock:
+            waiters = self._waiters.get(fmt)
+            if waiters is not None:
+                waiters.append((on_progress, on_done))
+                return False
+            self._waiters[fmt] = [(on_progress, on_done)]
+        threading.Thread(target=self._run, args=(fmt,), name=f"export-{fmt}", daemon=True).start()
+        return True
+
+    def _run(self, fmt):
+        def progress(done, total):
+            with self._lock:
+                waiters = list(self._waiters[fmt])
+            for on_progress, _ in waiters:
+                if on_progress:
+                    try:
+                        on_progress(done, total)
+                    except Exception as e:
+                        logging.error(f"Error reporting {fmt} export progress: {e}")
+
+        try:
+            paths, cached = self.export(fmt, progress)
+        except Exception as e:
+            logging.error(f"Error exporting users to {fmt}: {e}")
+            paths, cached = None, False
+        with self._lock:
+            waiters = self._waiters.pop(fmt)
+        for _, on_done in waiters:
+            if on_done:
+                try:
+                    on_done(paths, cached)
+                except Exception as e:
+                    logging.error(f"Error delivering {fmt} export: {e}")
+
+    def export(self, fmt, progress=None):
+        """Write (or reuse) the export; returns (paths, cached)."""
+        paths = self._cached(fmt, self.db.data_version())
+        if paths:
+            return paths, True
+
+        started = time.monotonic()
+        total = self.db.get_stats()['total_users']
+        with self.db.users_snapshot() as (version, rows):
+            paths = self._cached(fmt, version)
+            if paths:
+                return paths, True
+            paths, written = self._write(fmt, version, rows, progress, total)
+
+        with open(self._manifest(fmt, version), 'w') as f:
+            json.dump({'version': version, 'rows': written, 'files': [os.path.basename(path) for path in paths]}, f)
+        self._prune(fmt, version)
+        seconds = time.monotonic() - started
+        logging.info(f"Exported {written} users to {len(paths)} {fmt} file(s) in {seconds:.1f}s "
+                     f"({written / seconds if seconds else 0:.0f} rows/s)")
+        return paths, False
+
+    def _write(self, fmt, version, rows, progress, total):
+        columns = self.db.user_columns
+        paths, current, in_file, written = [], None, 0, 0
+        reported = time.monotonic()
+        try:
+            for row in rows:
+                if current is None or in_file == self.rows_per_file:
+                    if current is not None:
+                        current.close()
+                    paths.append(self._path(fmt, version, len(paths) + 1))
+                    current, in_file = WRITERS[fmt](paths[-1], columns), 0
+                current.write(row)
+                in_file += 1
+                written += 1
+                if progress and not written % 1000 and time.monotonic() - reported >= self.progress_interval:
+                    progress(written, total)
+                    reported = time.monotonic()
+            if current is None:
+                # No users yet: a file with just the header
+                paths.append(self._path(fmt, version, 1))
+                current = WRITERS[fmt](paths[-1], columns)
+        finally:
+            if current is not None:
+                current.close()
+        return paths, written
+
+    def _path(self, fmt, version, part):
+        suffix = f"_part{part}" if part > 1 else ""
+        return os.path.join(self.export_dir, f"users_v{version}{suffix}.{fmt}")
+
+    def _manifest(self, fmt, version):
+        return os.path.join(self.export_dir, f"users_v{version}.{fmt}.json")
+
+    def _cached(self, fmt, version):
+        """Paths of a finished export of this version, or None."""
+        try:
+            with open(self._manifest(fmt, version)) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        paths = [os.path.join(self.export_dir, name) for name in manifest['files']]
+        return paths if all(os.path.exists(path) for path in paths) else None
+
+    def _prune(self, fmt, version):
+        """Delete exports of this format made at other versions."""
+        keep = f"users_v{version}"
+        for name in os.listdir(self.export_dir):
+            if not name.startswith("users_v") or not (name.endswith(f".{fmt}") or name.endswith(f".{fmt}.json")):
+                continue
+            if name.split('.')[0].split('_part')[0] != keep:
+                try:
+                    os.remove(os.path.join(self.export_dir, name))
+                except OSError as e:
+                    logging.warning(f"Could not remove old export {name}: {e}")
+
+def main():
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Export the users table to Excel or CSV")
+    parser.add_argument('--format', choices=FORMATS, default='xlsx')
+    parser.add_argument('--db', help="database file (defaults to config.DB_FILE)")
+    parser.add_argument('--out', help="export directory (defaults to config.EXCEL_EXPORT_DIR)")
+    parser.add_argument('--rows-per-file', type=int, help="split into several files past this many rows")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = DatabaseManager(args.db, journal=False)
+    try:
+        exporter = UserExport(db, args.out, args.rows_per_file)
+        paths, cached = exporter.export(args.format, lambda done, total: logging.info(f"Exported {done}/{total}"))
+    finally:
+        db.close()
+    for path in paths:
+        print(path)
+    if cached:
+        print("(unchanged since the last export, reused)")
+
+if __name__ == "__main__":
+    main()
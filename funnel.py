@@ -0,0 +1,151 @@
+# funnel.py - Declarative questionnaire funnel and O(1) update routing
+
+import logging
+import functools
+from collections import namedtuple
+from config import UserState
+from messages import (
+    question_1, question_2, question_3, question_4,
+    question_1_options, question_2_options, question_3_options, question_4_options,
+    contact_time_question, contact_time_options, final_message
+)
+
+# One inline-keyboard step of the funnel.
+#   prefix      callback prefix; buttons carry "<prefix>_<option index>"
+#   state       user state while the question is open
+#   text        prompt (may contain {name})
+#   options     button labels; the chosen label is stored in `column`
+#   next_state  state written together with the answer (None keeps the state)
+#   reply       text the question message is edited to when no question follows
+#   action      name of a Funnel action run after the answer is saved
+#   columns     extra column values written with the answer
+#   journal     mirror the row to the change journal after the write
+Question = namedtuple('Question', (
+    'prefix', 'state', 'text', 'options', 'column', 'next_state',
+    'reply', 'action', 'columns', 'journal'
+), defaults=(None, None, None, True))
+
+# Answering a question edits its message into the question for
+# `next_state`; after the last one the message is replaced by `reply`
+# or deleted. Editing this table is all it takes to change the funnel.
+QUESTIONS = (
+    Question('q1', UserState.QUESTION_1, question_1, question_1_options, 'question_1', UserState.QUESTION_2),
+    Question('q2', UserState.QUESTION_2, question_2, question_2_options, 'question_2', UserState.QUESTION_3),
+    Question('q3', UserState.QUESTION_3, question_3, question_3_options, 'question_3', UserState.QUESTION_4),
+    Question('q4', UserState.QUESTION_4, question_4, question_4_options, 'question_4', None,
+             action='complete_registration'),
+    Question('contact', UserState.WAITING_CONTACT_TIME, contact_time_question, contact_time_options,
+             'contact_time', UserState.COMPLETED, reply=final_message, columns={'is_completed': 1}),
+)
+
+def parse_callback(data):
+    """Split "<prefix>_<index>" callback data; other data is its own key."""
+    prefix, sep, arg = data.rpartition('_')
+    if sep and arg.isdigit():
+        return prefix, int(arg)
+    return data, None
+
+class Funnel:
+    """Runs the QUESTIONS table and routes updates through dict lookups.
+
+    Callback data, text-message states and resume states each map to one
+    handler, so routing costs one dict lookup instead of a walk down an
+    if/elif chain. Questions from the table are handled by `answer`:
+    the answer, the next state and any extra columns are written in a
+    single UPDATE, then the message is edited into the next step.
+
+    Handlers for everything that is not a plain question are registered
+    with `on_callback(key, handler(call, index))`, `on_text(state,
+    handler(message))` and `on_resume(state, handler(message, user_data))`.
+    """
+
+    def __init__(self, db, outbox, keyboards, questions=QUESTIONS, actions=None):
+        self.db = db
+        self.outbox = outbox
+        self.keyboards = keyboards
+        self.questions = {question.prefix: question for question in questions}
+        self.by_state = {question.state: question for question in questions}
+        self.actions = actions or {}
+
+        self.callbacks = {prefix: functools.partial(self.answer, question)
+                          for prefix, question in self.questions.items()}
+        self.text_handlers = {}
+        self.resume_handlers = {}
+        # callback data -> (handler, index); the set of button payloads is
+        # small, so after warm-up routing is a single dict hit
+        self._routes = {}
+
+    def on_callback(self, key, handler):
+        self.callbacks[key] = handler
+        self._routes.clear()
+
+    def on_text(self, state, handler):
+        self.text_handlers[state] = handler
+
+    def on_resume(self, state, handler):
+        self.resume_handlers[state] = handler
+
+    def handle_callback(self, call):
+        """Route a callback query; False if nothing handles its data."""
+        route = self._routes.get(call.data)
+        if route is None:
+            key, index = parse_callback(call.data)
+            handler = self.callbacks.get(key)
+            if handler is None:
+                return False
+            route = (handler, index)
+            if len(self._routes) < 4096:
+                self._routes[call.data] = route
+        route[0](call, route[1])
+        return True
+
+    def handle_text(self, message, state):
+        handler = self.text_handlers.get(state)
+        if handler is None:
+            return False
+        handler(message)
+        return True
+
+    def resume(self, message, state, user_data):
+        handler = self.resume_handlers.get(state)
+        if handler is None:
+            return False
+        handler(message, user_data)
+        return True
+
+    def keyboard(self, question):
+        return self.keyboards.get(question.prefix)
+
+    def ask(self, chat_id, prefix, **fields):
+        """Send a question from the table; returns the outbox Future."""
+        question = self.questions[prefix]
+        text = question.text.format(**fields) if fields else question.text
+        return self.outbox.send_message(chat_id, text, reply_markup=self.keyboard(question))
+
+    def answer(self, question, call, index):
+        """Save an answer and move the question message on to the next step."""
+        try:
+            user_id = call.from_user.id
+            chat_id = call.message.chat.id
+            message_id = call.message.message_id
+
+            columns = {question.column: question.options[index]}
+            if question.next_state:
+                columns['state'] = question.next_state
+            columns.update(question.columns or {})
+            self.db.update_user_columns(user_id, columns, journal=question.journal)
+
+            following = self.by_state.get(question.next_state)
+            if following:
+                self.outbox.edit_message_text(following.text, chat_id, message_id,
+                                              reply_markup=self.keyboard(following))
+            elif question.reply:
+                self.outbox.edit_message_text(question.reply, chat_id, message_id)
+            else:
+                self.outbox.delete_message(chat_id, message_id)
+
+            if question.action:
+                self.actions[question.action](chat_id, user_id)
+
+        except Exception as e:
+            logging.error(f"Error handling {question.prefix} answer: {e}")
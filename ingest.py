@@ -0,0 +1,159 @@
+# ingest.py - Streaming ingestion of recipient files (CSV / XLSX of user ids)
+
+import io
+import csv
+import sys
+import time
+import uuid
+import logging
+import argparse
+from config import INGEST_CHUNK_SIZE
+
+USER_ID_COLUMNS = ('userid', 'user_id', 'user id', 'id')
+SUPPORTED_EXTENSIONS = ('.csv', '.xlsx')
+
+def parse_user_id(value):
+    """A positive integer id from a cell ("123", 123, 123.0, "1.23E+08"), else None."""
+    if isinstance(value, str):
+        try:
+            number = int(value)
+        except ValueError:
+            try:
+                number = float(value)
+            except ValueError:
+                return None
+    elif isinstance(value, (int, float)) and not isinstance(value, bool):
+        number = value
+    else:
+        return None
+    if isinstance(number, float):
+        if not number.is_integer():
+            return None
+        number = int(number)
+    return number if number > 0 else None
+
+def _csv_rows(f):
+    text = io.TextIOWrapper(f, encoding='utf-8-sig', newline='')
+    sample = text.read(4096)
+    text.seek(0)
+    try:
+        dialect = csv.Sniffer().sniff(sample, delimiters=',;\t')
+    except csv.Error:
+        dialect = csv.excel   # a single column has no delimiter to find
+    yield from csv.reader(text, dialect)
+
+def _xlsx_rows(f):
+    import openpyxl
+    # read_only streams the sheet XML row by row instead of building it in memory
+    workbook = openpyxl.load_workbook(f, read_only=True, data_only=True)
+    try:
+        yield from workbook.active.iter_rows(values_only=True)
+    finally:
+        workbook.close()
+
+def iter_rows(f, filename):
+    """Rows of a CSV or XLSX file object as sequences of cell values."""
+    if filename.lower().endswith('.xlsx'):
+        return _xlsx_rows(f)
+    return _csv_rows(f)
+
+class RecipientImport:
+    """One uploaded recipient file, staged in `recipient_imports`.
+
+    `load` streams the file row by row and parses the id column (a
+    "userid"/"user_id"/"id" header, else the first column). Ids are
+    deduplicated per chunk in a set and across chunks by the staging
+    table's primary key, so memory stays at one chunk whatever the file
+    size. The report then joins the staged ids against `users` to count
+    unknown ids (never started the bot) and blocked ones.
+    `add_to_broadcast` copies the sendable ids into a broadcast; call
+    `discard` when done.
+    """
+
+    def __init__(self, db, chunk_size=None):
+        self.db = db
+        self.chunk_size = chunk_size or INGEST_CHUNK_SIZE
+        self.import_id = uuid.uuid4().int >> 65    # fits a signed 64-bit INTEGER
+
+    def load(self, f, filename):
+        """Stage every id in the file; returns row counts, the users join and rows/s."""
+        started = time.perf_counter()
+        counts = {'rows': 0, 'invalid': 0, 'duplicates': 0}
+        column, chunk = None, []
+        for row in iter_rows(f, filename):
+            if column is None:
+                column = self._id_column(row)
+                if column is not None:
+                    continue   # header row
+                column = 0
+                if not row or parse_user_id(row[0]) is None:
+                    continue   # some other header
+            user_id = parse_user_id(row[column]) if column < len(row) else None
+            if user_id is None:
+                if any(row):
+                    counts['rows'] += 1
+                    counts['invalid'] += 1
+                continue   # blank lines are not rows
+            counts['rows'] += 1
+            chunk.append(user_id)
+            if len(chunk) >= self.chunk_size:
+                self._stage(chunk, counts)
+                chunk = []
+        if chunk:
+            self._stage(chunk, counts)
+
+        seconds = time.perf_counter() - started
+        report = dict(counts, **self.db.summarize_import(self.import_id))
+        report.update(seconds=seconds, rows_per_s=counts['rows'] / seconds if seconds else 0.0)
+        logging.info(f"Ingested {filename}: {counts['rows']} rows in {seconds:.2f}s "
+                     f"({report['rows_per_s']:.0f} rows/s), {report['unique']} unique, "
+                     f"{report['unknown']} unknown, {report['blocked']} blocked, {counts['invalid']} invalid")
+        return report
+
+    @staticmethod
+    def _id_column(row):
+        for i, cell in enumerate(row or ()):
+            if cell is not None and str(cell).strip().lower() in USER_ID_COLUMNS:
+                return i
+        return None
+
+    def _stage(self, chunk, counts):
+        # Sorted, the inserts walk the primary key B-tree in order
+        unique = sorted(set(chunk))
+        added = self.db.stage_import_ids(self.import_id, unique)
+        counts['duplicates'] += len(chunk) - added
+
+    def add_to_broadcast(self, broadcast_id):
+        """Known, unblocked ids become the broadcast's recipients; returns how many."""
+        return self.db.add_import_to_broadcast(broadcast_id, self.import_id)
+
+    def discard(self):
+        self.db.discard_import(self.import_id)
+
+def main():
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Check a recipient file against the users table")
+    parser.add_argument('file', help="CSV or XLSX of user ids")
+    parser.add_argument('--db', help="database file (defaults to config.DB_FILE)")
+    parser.add_argument('--chunk-size', type=int, help="ids staged per transaction")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    db = DatabaseManager(args.db, journal=False)
+    upload = RecipientImport(db, args.chunk_size)
+    try:
+        with open(args.file, 'rb') as f:
+            report = upload.load(f, args.file)
+    finally:
+        upload.discard()
+        db.close()
+    for key in ('rows', 'invalid', 'duplicates', 'unique', 'unknown', 'blocked', 'sendable'):
+        print(f"{key:<12} {report[key]}")
+    print(f"{'rows/s':<12} {report['rows_per_s']:.0f}")
+    if report['unknown_sample']:
+        print(f"unknown ids, e.g. {', '.join(map(str, report['unknown_sample']))}")
+    sys.exit(0 if report['sendable'] else 1)
+
+if __name__ == "__main__":
+    main()
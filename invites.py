@@ -0,0 +1,129 @@
+# invites.py - Pool of pre-generated single-use channel invite links
+
+import time
+import logging
+import threading
+from config import (
+    INVITE_POOL_LOW, INVITE_POOL_HIGH, INVITE_POOL_BATCH,
+    INVITE_POOL_CHECK_INTERVAL, INVITE_POOL_RETRY_DELAY
+)
+
+class InvitePool:
+    """Single-use invite links minted ahead of registration.
+
+    Links live in the `invite_links` table. `take(user_id)` hands out the
+    oldest unissued one in a single write and records who got it and
+    when, so registration never waits on `create_chat_invite_link`. A
+    refill runs on the scheduler whenever the depth drops to `low` (and
+    every INVITE_POOL_CHECK_INTERVAL seconds, to notice links taken by
+    other processes) and mints up to `high`, INVITE_POOL_BATCH links per
+    wake-up so a refill never holds a scheduler thread for long.
+
+    `mint()` is ``create_chat_invite_link(member_limit=1)`` returning the
+    link string. If the pool is empty a link is minted on the spot.
+    """
+
+    REFILL_KEY = ('invites', 'refill')
+
+    def __init__(self, db, scheduler, mint, chat_id, low=None, high=None, batch=None):
+        self.db = db
+        self.scheduler = scheduler
+        self.mint = mint
+        self.chat_id = chat_id
+        self.low = INVITE_POOL_LOW if low is None else low
+        self.high = INVITE_POOL_HIGH if high is None else high
+        self.batch = batch or INVITE_POOL_BATCH
+
+        self._lock = threading.Lock()
+        self._wake_lock = threading.Lock()
+        self._refill_lock = threading.Lock()
+        self._stopped = False
+        self.counters = {'issued': 0, 'minted': 0, 'mint_failed': 0, 'minted_on_demand': 0, 'empty': 0}
+
+    def start(self):
+        self._schedule(time.time())
+
+    def take(self, user_id):
+        """Invite link for a user, or None if none could be had."""
+        link = self.db.take_invite_link(self.chat_id, user_id)
+        if link is None:
+            self._count('empty')
+            logging.warning("Invite link pool is empty, minting on demand")
+            try:
+                link = self._mint()
+            except Exception as e:
+                logging.error(f"Error generating invite link: {e}")
+                return None
+            self.db.record_invite_link(self.chat_id, link, user_id)
+            self._count('minted_on_demand')
+        self._count('issued')
+
+        if self.db.count_invite_links(self.chat_id) <= self.low:
+            self._schedule(time.time())
+        return link
+
+    def _count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def _schedule(self, when):
+        with self._wake_lock:
+            if self._stopped:
+                return
+            current = self.scheduler.due_at(self.REFILL_KEY)
+            if current is None or when < current:
+                self.scheduler.schedule(when, self.refill, key=self.REFILL_KEY)
+
+    def _mint(self):
+        try:
+            link = self.mint()
+        except Exception:
+            self._count('mint_failed')
+            raise
+        self._count('minted')
+        return link
+
+    def refill(self):
+        """Mint one batch towards `high`; reschedules itself while short."""
+        if not self._refill_lock.acquire(blocking=False):
+            return
+        try:
+            depth = self.db.count_invite_links(self.chat_id)
+            wanted = min(self.high - depth, self.batch)
+            links = []
+            error = None
+            while len(links) < wanted and not self._stopped:
+                try:
+                    links.append(self._mint())
+                except Exception as e:
+                    logging.error(f"Error generating invite link: {e}")
+                    error = e
+                    break
+            if links:
+                self.db.add_invite_links(self.chat_id, links)
+                logging.info(f"Invite link pool refilled: {depth} -> {depth + len(links)}")
+
+            if error is not None:
+                # A 429 says how long to wait; anything else gets a fixed delay
+                retry_after = ((getattr(error, 'result_json', None) or {}).get('parameters') or {}).get('retry_after')
+                self._schedule(time.time() + (retry_after or INVITE_POOL_RETRY_DELAY))
+            elif depth + len(links) < self.high:
+                self._schedule(time.time())
+            else:
+                self._schedule(time.time() + INVITE_POOL_CHECK_INTERVAL)
+        finally:
+            self._refill_lock.release()
+
+    def depth(self):
+        return self.db.count_invite_links(self.chat_id)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+        stats.update(depth=self.depth(), low=self.low, high=self.high)
+        return stats
+
+    def stop(self):
+        with self._wake_lock:
+            self._stopped = True
+        self.scheduler.cancel(self.REFILL_KEY)
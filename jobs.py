@@ -0,0 +1,195 @@
+# jobs.py - Durable scheduled jobs drained from the database
+
+import os
+import time
+import uuid
+import socket
+import logging
+import threading
+from concurrent import futures
+from config import (
+    JOB_POLL_INTERVAL, JOB_LEASE_SECONDS, JOB_CLAIM_BATCH,
+    JOB_WORKERS, JOB_MAX_ATTEMPTS, JOB_RETRY_DELAY,
+    JOB_CATCHUP_INTERVAL, JOB_CATCHUP_RATE, JOB_CATCHUP_WINDOW
+)
+
+class JobRunner:
+    """Runs jobs stored in the `scheduled_jobs` table when they fall due.
+
+    Jobs are claimed with a lease (`DatabaseManager.claim_due_jobs`), so any
+    number of bot processes can drain the same database: each job is held by
+    one owner at a time, and a job whose owner died is picked up again once
+    its lease expires. The in-process `Scheduler` only holds a single wake-up
+    timer for the next due job (or the poll interval, to notice jobs added by
+    other processes).
+
+    Handlers are called as ``handler(job)`` with the job dict returned by
+    `claim_due_jobs`. A handler that raises is retried with backoff up to
+    JOB_MAX_ATTEMPTS times. Delivery is at-least-once: a process that dies
+    after sending but before `complete_job` will have the job run again.
+    A job type registered with `states` only runs while its user is in one
+    of them; otherwise the job is marked 'skipped'.
+
+    On start, jobs that fell due while no process was running are caught
+    up by `catch_up` in the background (drains leave them alone until it
+    is done): stale ones are skipped and the rest are spread out instead
+    of all firing at once.
+    """
+
+    WAKE_KEY = ('jobs', 'drain')
+
+    def __init__(self, db, scheduler, owner=None, poll_interval=None,
+                 lease_seconds=None, batch=None, workers=None):
+        self.db = db
+        self.scheduler = scheduler
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.poll_interval = JOB_POLL_INTERVAL if poll_interval is None else poll_interval
+        self.lease_seconds = JOB_LEASE_SECONDS if lease_seconds is None else lease_seconds
+        self.batch = batch or JOB_CLAIM_BATCH
+
+        self.handlers = {}
+        self.states = {}          # job_type -> user states in which it still applies
+        self._executor = futures.ThreadPoolExecutor(max_workers=workers or JOB_WORKERS, thread_name_prefix="jobs")
+        self._wake_lock = threading.Lock()
+        self._drain_lock = threading.Lock()
+        self._stopped = False
+        # While catch_up runs, drains leave jobs due before this alone
+        self._due_floor = 0.0
+
+    def register(self, job_type, handler, states=None):
+        self.handlers[job_type] = handler
+        if states is not None:
+            self.states[job_type] = tuple(states)
+
+    def add(self, job_type, user_id, when, payload=None):
+        """Persist a job (replacing the user's pending one of this type)."""
+        job_id = self.db.add_job(job_type, user_id, when, payload)
+        if job_id is not None:
+            self._wake(when.timestamp() if hasattr(when, 'timestamp') else float(when))
+        return job_id
+
+    def cancel(self, user_id, job_types=None):
+        return self.db.cancel_jobs(user_id, job_types)
+
+    def start(self):
+        logging.info(f"Job runner {self.owner} started")
+        # Catch-up runs on its own thread so neither startup nor jobs that
+        # fall due from now on wait for it
+        self._due_floor = time.time()
+        threading.Thread(target=self._catch_up, name="jobs-catch-up", daemon=True).start()
+        self._wake(self._due_floor)
+
+    def _catch_up(self):
+        try:
+            self.catch_up(self._due_floor)
+        except Exception as e:
+            logging.error(f"Error catching up overdue jobs: {e}")
+        finally:
+            self._due_floor = 0.0
+
+    def catch_up(self, now=None, interval=None, rate=None, window=None):
+        """Reconcile the backlog of jobs that fell due before `now`.
+
+        Jobs whose user has moved past them are skipped; the rest are
+        spread over total/rate seconds (at most `interval`) in their
+        original order. The backlog is walked `window` jobs at a
+        time, so memory use does not grow with its size. Returns
+        (rescheduled, skipped).
+        """
+        now = time.time() if now is None else now
+        interval = JOB_CATCHUP_INTERVAL if interval is None else interval
+        rate = rate or JOB_CATCHUP_RATE
+        window = window or JOB_CATCHUP_WINDOW
+
+        total = self.db.count_overdue_jobs(now)
+        if not total:
+            return 0, 0
+        step = min(interval, total / rate) / total
+        started = time.perf_counter()
+        rescheduled = skipped = 0
+        while not self._stopped:
+            # Slots count from the current time so a long catch-up does not
+            # leave its first windows overdue again
+            moved, dropped = self.db.reconcile_overdue_jobs(
+                now, time.time() + step * rescheduled, step, self.states, window
+            )
+            if not moved and not dropped:
+                break
+            rescheduled += moved
+            skipped += dropped
+        logging.info(
+            f"Caught up {total} overdue jobs in {time.perf_counter() - started:.2f}s: "
+            f"{skipped} skipped, {rescheduled} spread over the next {step * rescheduled:.0f}s"
+        )
+        return rescheduled, skipped
+
+    def _wake(self, when):
+        """Make sure a drain is scheduled no later than `when`."""
+        with self._wake_lock:
+            if self._stopped:
+                return
+            current = self.scheduler.due_at(self.WAKE_KEY)
+            if current is None or when < current:
+                self.scheduler.schedule(when, self._drain, key=self.WAKE_KEY)
+
+    def _drain(self):
+        # Overlapping wake-ups are harmless (claims are atomic) but wasteful
+        if not self._drain_lock.acquire(blocking=False):
+            return
+        try:
+            while not self._stopped:
+                jobs = self.db.claim_due_jobs(self.owner, self.batch, self.lease_seconds, since=self._due_floor)
+                if not jobs:
+                    break
+                # Finish one batch before claiming more so leases never
+                # expire while jobs sit in a local queue.
+                futures.wait([self._executor.submit(self._run_job, job) for job in jobs])
+                if len(jobs) < self.batch:
+                    break
+        except Exception as e:
+            logging.error(f"Error draining scheduled jobs: {e}")
+        finally:
+            self._drain_lock.release()
+
+        next_due = self.db.next_job_due(self._due_floor)
+        wake = time.time() + self.poll_interval
+        if next_due is not None:
+            wake = min(wake, next_due)
+        self._wake(wake)
+
+    def _run_job(self, job):
+        handler = self.handlers.get(job['job_type'])
+        if handler is None:
+            logging.error(f"No handler for job type {job['job_type']} (job {job['job_id']})")
+            self.db.fail_job(job['job_id'], self.owner)
+            return
+
+        states = self.states.get(job['job_type'])
+        if states is not None:
+            # Uncached: another process may have moved the user on since
+            user = self.db.get_user_uncached(job['user_id'], ('state',))
+            if (user['state'] if user else "start") not in states:
+                self.db.complete_job(job['job_id'], self.owner, status='skipped')
+                return
+
+        try:
+            handler(job)
+        except Exception as e:
+            if job['attempts'] >= JOB_MAX_ATTEMPTS:
+                logging.error(f"Job {job['job_id']} ({job['job_type']}) failed permanently: {e}")
+                self.db.fail_job(job['job_id'], self.owner)
+            else:
+                retry_at = time.time() + JOB_RETRY_DELAY * 2 ** (job['attempts'] - 1)
+                logging.warning(f"Job {job['job_id']} ({job['job_type']}) failed, retrying: {e}")
+                self.db.fail_job(job['job_id'], self.owner, retry_at)
+                self._wake(retry_at)
+            return
+
+        if not self.db.complete_job(job['job_id'], self.owner):
+            logging.warning(f"Job {job['job_id']} finished after its lease was taken over")
+
+    def stop(self, wait=True):
+        with self._wake_lock:
+            self._stopped = True
+            self.scheduler.cancel(self.WAKE_KEY)
+        self._executor.shutdown(wait=wait)
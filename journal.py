@@ -0,0 +1,210 @@
+# journal.py - Incremental change journal and JSON snapshot compaction
+
+import os
+import sys
+import glob
+import json
+import time
+import logging
+import argparse
+import itertools
+import threading
+from datetime import datetime
+from config import (
+    DB_FILE, JSON_BACKUP_FILE, JOURNAL_FILE, JOURNAL_COMPACT_INTERVAL,
+    JOURNAL_COMPACT_MAX_BYTES
+)
+
+class ChangeJournal:
+    """Append-only JSON-Lines log of changed user rows.
+
+    Every entry holds the full row after the change, so replaying entries
+    in order on top of a snapshot is idempotent. Compaction rotates the
+    journal, streams a fresh snapshot from the database and then drops
+    the rotated files the snapshot now covers.
+    """
+
+    def __init__(self, journal_file=JOURNAL_FILE, snapshot_file=JSON_BACKUP_FILE,
+                 compact_interval=JOURNAL_COMPACT_INTERVAL, max_bytes=JOURNAL_COMPACT_MAX_BYTES):
+        self.journal_file = journal_file
+        self.snapshot_file = snapshot_file
+        self.compact_interval = compact_interval
+        self.max_bytes = max_bytes
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._thread = None
+        self._file = open(self.journal_file, 'a', encoding='utf-8')
+
+    def append(self, user):
+        """Record the current state of one user row."""
+        line = json.dumps(
+            {'ts': datetime.now().isoformat(), 'op': 'upsert', 'user': dict(user)},
+            ensure_ascii=False, default=str
+        )
+        with self._lock:
+            self._file.write(line + '\n')
+            self._file.flush()
+            size = self._file.tell()
+
+        if self.max_bytes and size >= self.max_bytes:
+            self._wakeup.set()
+
+    def _rotate(self):
+        """Move the live journal aside and start a new one.
+
+        Rotated files are named after the rotation time in nanoseconds.
+        """
+        with self._lock:
+            self._file.close()
+            rotated_at = time.time_ns()
+            if os.path.getsize(self.journal_file) > 0:
+                os.replace(self.journal_file, f"{self.journal_file}.{rotated_at}")
+            self._file = open(self.journal_file, 'a', encoding='utf-8')
+        return rotated_at, [path for path, _ in self._rotated_files()]
+
+    def _rotated_files(self):
+        """Return (path, rotation time) pairs, oldest first."""
+        files = []
+        for path in glob.glob(glob.escape(self.journal_file) + '.*'):
+            suffix = path.rsplit('.', 1)[1]
+            if suffix.isdigit():
+                files.append((path, int(suffix)))
+        return sorted(files, key=lambda item: item[1])
+
+    def compact(self, rows):
+        """Write a full snapshot from `rows` and drop the journal it replaces.
+
+        `rows` must be read from the database after this call starts, so it
+        is passed as an iterable that is consumed lazily.
+        """
+        with self._compact_lock:
+            started = time.time()
+            rotated_at, covered = self._rotate()
+
+            tmp_file = self.snapshot_file + '.tmp'
+            count = 0
+            with open(tmp_file, 'w', encoding='utf-8') as f:
+                f.write('[\n')
+                for row in rows:
+                    if count:
+                        f.write(',\n')
+                    f.write(json.dumps(dict(row), ensure_ascii=False, default=str))
+                    count += 1
+                f.write('\n]\n')
+                f.flush()
+                os.fsync(f.fileno())
+            # The snapshot's mtime marks the rotation it supersedes; replay
+            # uses it to skip rotated files a crash left behind.
+            os.utime(tmp_file, ns=(rotated_at, rotated_at))
+            os.replace(tmp_file, self.snapshot_file)
+
+            for path in covered:
+                os.remove(path)
+
+            logging.info(f"Journal compacted: {count} users in snapshot ({time.time() - started:.2f}s)")
+            return count
+
+    def start_compactor(self, rows_factory):
+        """Compact in the background on a schedule or once the journal grows too big."""
+        def run():
+            if not os.path.exists(self.snapshot_file):
+                self._wakeup.set()
+            while not self._stopped.is_set():
+                self._wakeup.wait(self.compact_interval)
+                if self._stopped.is_set():
+                    break
+                self._wakeup.clear()
+                try:
+                    self.compact(rows_factory())
+                except Exception as e:
+                    logging.error(f"Error compacting journal: {e}")
+
+        self._thread = threading.Thread(target=run, name="journal-compactor", daemon=True)
+        self._thread.start()
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+        if self._thread and self._thread is not threading.current_thread():
+            self._thread.join(timeout=30)
+        with self._lock:
+            self._file.close()
+
+    def replay(self):
+        """Yield user rows from the snapshot followed by every pending journal entry."""
+        snapshot_rotation = 0
+        if os.path.exists(self.snapshot_file):
+            snapshot_rotation = os.stat(self.snapshot_file).st_mtime_ns
+            yield from read_snapshot(self.snapshot_file)
+
+        # Files rotated before the snapshot was taken are already folded
+        # into it (compaction stopped before deleting them).
+        journals = [path for path, rotated_at in self._rotated_files() if rotated_at > snapshot_rotation]
+        journals.append(self.journal_file)
+
+        for path in journals:
+            if not os.path.exists(path):
+                continue
+            with open(path, encoding='utf-8') as f:
+                for line_no, line in enumerate(f, 1):
+                    line = line.strip()
+                    if not line:
+                        continue
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        # A torn final line from a crash mid-write
+                        logging.warning(f"Skipping unreadable journal line {path}:{line_no}")
+                        continue
+                    if entry.get('op') == 'upsert':
+                        yield entry['user']
+
+def read_snapshot(path):
+    """Stream rows from a snapshot written by `ChangeJournal.compact`.
+
+    Falls back to loading the whole file for older pretty-printed backups.
+    """
+    with open(path, encoding='utf-8') as f:
+        first = f.readline().strip()
+        second = f.readline().strip()
+        one_row_per_line = second == ']' or (second.startswith('{') and second.rstrip(',').endswith('}'))
+        if first != '[' or not one_row_per_line:
+            f.seek(0)
+            yield from json.load(f)
+            return
+
+        for line in itertools.chain([second], f):
+            line = line.strip().rstrip(',')
+            if line and line != ']':
+                yield json.loads(line)
+
+def rebuild(db_file):
+    """Rebuild `db_file` from the snapshot plus journal."""
+    from database import DatabaseManager
+
+    journal = ChangeJournal()
+    db = DatabaseManager(db_file, journal=False)
+    try:
+        count = db.restore_users(journal.replay())
+        logging.info(f"Restored {count} journal/snapshot rows into {db_file}")
+        return count
+    finally:
+        journal.close()
+        db.close()
+
+def main():
+    parser = argparse.ArgumentParser(description="Rebuild the users database from snapshot + journal")
+    parser.add_argument('db_file', help="SQLite file to rebuild into (created if missing)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    if os.path.abspath(args.db_file) == os.path.abspath(DB_FILE) and os.path.exists(args.db_file):
+        print("❌ Refusing to rebuild into the live database; choose a new file")
+        sys.exit(1)
+    rebuild(args.db_file)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,78 @@
+# keyboards.py - Keyboards built once and reused as serialized JSON
+
+import json
+from telebot import types
+from messages import follow_up_1_options, follow_up_2_options, instagram_link
+
+COURSE_BUTTON_TEXT = "🎥 مشاهده مینی دوره"
+PHONE_BUTTON_TEXT = "ارسال شماره"
+
+class KeyboardRegistry:
+    """Named reply markups, serialized to JSON a single time.
+
+    The Bot API takes `reply_markup` as a JSON string, and telebot passes
+    strings through untouched, so `get(name)` can be handed straight to
+    send_message/edit_message_text without rebuilding or re-serializing
+    the keyboard.
+
+    Keyboards with per-user values are registered as templates: fields are
+    written as ``__field__`` when the markup is built, and `render` swaps
+    in JSON-escaped values.
+    """
+
+    def __init__(self):
+        self._keyboards = {}
+        self._templates = {}
+
+    def register(self, name, markup):
+        self._keyboards[name] = markup.to_json()
+
+    def register_template(self, name, markup, fields):
+        self._templates[name] = (markup.to_json(), tuple(fields))
+
+    def get(self, name):
+        return self._keyboards[name]
+
+    def render(self, name, **values):
+        payload, fields = self._templates[name]
+        for field in fields:
+            payload = payload.replace(f"__{field}__", json.dumps(str(values[field]), ensure_ascii=False)[1:-1])
+        return payload
+
+    def __contains__(self, name):
+        return name in self._keyboards
+
+def options_keyboard(options, prefix):
+    """Inline keyboard with one button per option; callback data "<prefix>_<index>"."""
+    markup = types.InlineKeyboardMarkup()
+    for i, option in enumerate(options):
+        markup.add(types.InlineKeyboardButton(option, callback_data=f"{prefix}_{i}"))
+    return markup
+
+def phone_request_keyboard():
+    markup = types.ReplyKeyboardMarkup(resize_keyboard=True, one_time_keyboard=True)
+    markup.add(types.KeyboardButton(PHONE_BUTTON_TEXT, request_contact=True))
+    return markup
+
+def build_registry(questions):
+    """Build every static keyboard of the bot; `questions` is funnel.QUESTIONS."""
+    registry = KeyboardRegistry()
+
+    for question in questions:
+        registry.register(question.prefix, options_keyboard(question.options, question.prefix))
+    registry.register('follow1', options_keyboard(follow_up_1_options, 'follow1'))
+    registry.register('follow2', options_keyboard(follow_up_2_options, 'follow2'))
+
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton("📱 دنبال کردن اینستاگرام", url=f"https://{instagram_link}"))
+    registry.register('instagram', markup)
+
+    registry.register('phone_request', phone_request_keyboard())
+    registry.register('remove', types.ReplyKeyboardRemove())
+    registry.register('empty', types.InlineKeyboardMarkup())
+
+    markup = types.InlineKeyboardMarkup()
+    markup.add(types.InlineKeyboardButton(COURSE_BUTTON_TEXT, url="__channel_link__"))
+    registry.register_template('course_link', markup, ['channel_link'])
+
+    return registry
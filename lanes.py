@@ -0,0 +1,144 @@
+# lanes.py - Per-user serial lanes for update handling
+
+import time
+import queue
+import logging
+import threading
+from collections import deque
+from config import LANE_WORKERS, LANE_QUEUE_SIZE, LANE_ENQUEUE_TIMEOUT
+
+class _Lane:
+    __slots__ = ('tasks', 'cond', 'busy', 'busy_since', 'busy_time', 'done', 'max_depth', 'wait', 'max_wait',
+                 'rejected')
+
+    def __init__(self):
+        self.tasks = deque()     # (queued_at, func, args)
+        self.cond = threading.Condition()
+        self.busy = False
+        self.busy_since = 0.0
+        self.busy_time = 0.0     # seconds spent running tasks
+        self.done = 0
+        self.max_depth = 0
+        self.wait = 0.0          # total seconds tasks spent queued
+        self.max_wait = 0.0
+        self.rejected = 0        # submits that timed out waiting for room
+
+class LaneDispatcher:
+    """Runs tasks in order per key and in parallel across keys.
+
+    Each key (a user id) is hashed to one of `workers` lanes, and every
+    lane is a FIFO drained by its own thread. Two updates from the same
+    user therefore never run at the same time and always run in arrival
+    order, while different users spread over all lanes. A slow handler
+    only holds up the users that share its lane.
+
+    A lane holds at most `capacity` queued tasks. `submit` on a full lane
+    blocks until there is room, so a burst stalls whoever feeds the lanes
+    (the polling loop, the webhook workers) instead of growing memory, and
+    raises queue.Full if the lane does not drain within `timeout` seconds.
+    """
+
+    def __init__(self, workers=None, name="lane", capacity=None, timeout=None):
+        self._lanes = [_Lane() for _ in range(workers or LANE_WORKERS)]
+        self.capacity = capacity or LANE_QUEUE_SIZE
+        self.timeout = LANE_ENQUEUE_TIMEOUT if timeout is None else timeout
+        self._started = time.monotonic()
+        self._stopped = False
+        self._threads = [threading.Thread(target=self._run, args=(lane,), name=f"{name}-{i}", daemon=True)
+                         for i, lane in enumerate(self._lanes)]
+        for thread in self._threads:
+            thread.start()
+
+    def lane_of(self, key):
+        return hash(key) % len(self._lanes)
+
+    def submit(self, key, func, *args):
+        """Queue ``func(*args)`` behind earlier tasks for the same key.
+
+        Waits while the lane is full; raises queue.Full after `timeout`.
+        """
+        lane = self._lanes[self.lane_of(key)]
+        with lane.cond:
+            if not lane.cond.wait_for(lambda: self._stopped or len(lane.tasks) < self.capacity, self.timeout):
+                lane.rejected += 1
+                raise queue.Full(f"lane {self.lane_of(key)} still full after {self.timeout}s")
+            if self._stopped:
+                raise RuntimeError("lane dispatcher is stopped")
+            lane.tasks.append((time.monotonic(), func, args))
+            lane.max_depth = max(lane.max_depth, len(lane.tasks))
+            # Producers waiting for room share the condition with the lane thread
+            lane.cond.notify_all()
+
+    def _run(self, lane):
+        while True:
+            with lane.cond:
+                while not lane.tasks:
+                    if self._stopped:
+                        return
+                    lane.cond.wait()
+                queued_at, func, args = lane.tasks.popleft()
+                lane.cond.notify_all()
+                now = time.monotonic()
+                waited = now - queued_at
+                lane.wait += waited
+                lane.max_wait = max(lane.max_wait, waited)
+                lane.busy = True
+                lane.busy_since = now
+
+            try:
+                func(*args)
+            except Exception as e:
+                logging.error(f"Error in lane task {getattr(func, '__name__', func)}: {e}")
+
+            with lane.cond:
+                lane.busy = False
+                lane.busy_time += time.monotonic() - lane.busy_since
+                lane.done += 1
+
+    def stats(self):
+        """Lane occupancy and queueing time.
+
+        ``occupancy`` is the share of time each lane spent running tasks
+        since start; a few lanes near 1.0 while the rest idle means hot
+        users (or a slow handler) are sharing those lanes.
+        """
+        now = time.monotonic()
+        uptime = max(now - self._started, 1e-9)
+        occupancy, depths = [], []
+        done = wait = max_wait = max_depth = busy = rejected = 0
+        for lane in self._lanes:
+            with lane.cond:
+                busy_time = lane.busy_time + (now - lane.busy_since if lane.busy else 0.0)
+                occupancy.append(round(busy_time / uptime, 3))
+                depths.append(len(lane.tasks))
+                busy += lane.busy
+                done += lane.done
+                rejected += lane.rejected
+                wait += lane.wait
+                max_wait = max(max_wait, lane.max_wait)
+                max_depth = max(max_depth, lane.max_depth)
+        return {
+            'lanes': len(self._lanes),
+            'busy': busy,
+            'queued': sum(depths),
+            'done': done,
+            'max_depth': max_depth,
+            'capacity': self.capacity,
+            'rejected': rejected,
+            'avg_wait_ms': wait / done * 1000 if done else 0.0,
+            'max_wait_ms': max_wait * 1000,
+            'occupancy_avg': round(sum(occupancy) / len(occupancy), 3),
+            'occupancy_max': max(occupancy),
+            'occupancy': occupancy,
+            'depths': depths,
+        }
+
+    def stop(self, wait=True):
+        """Refuse new tasks; lanes finish what is already queued."""
+        for lane in self._lanes:
+            with lane.cond:
+                self._stopped = True
+                lane.cond.notify_all()
+        if wait:
+            for thread in self._threads:
+                thread.join()
@@ -0,0 +1,136 @@
+# leads.py - Incremental hot-lead feed: only the leads new since a consumer's last pull
+
+import os
+import csv
+import sys
+import json
+import logging
+import argparse
+from datetime import datetime
+from config import EXCEL_EXPORT_DIR, LEAD_FEED_SETTLE_SECONDS, LEAD_FEED_CHUNK_SIZE
+from database import sqlite_timestamp
+
+FORMATS = ('csv', 'jsonl')
+
+# What sales gets for each lead; phone_date and user_id form the cursor
+LEAD_COLUMNS = (
+    'user_id', 'phone_date', 'phone', 'name', 'username', 'first_name', 'last_name',
+    'contact_time', 'selected_expert', 'question_1', 'question_2', 'question_3', 'question_4'
+)
+
+def _write_csv(f, rows):
+    writer = csv.writer(f)
+    writer.writerow(LEAD_COLUMNS)
+    writer.writerows(rows)
+
+def _write_jsonl(f, rows):
+    for row in rows:
+        f.write(json.dumps(dict(zip(LEAD_COLUMNS, row)), ensure_ascii=False))
+        f.write("\n")
+
+WRITERS = {'csv': _write_csv, 'jsonl': _write_jsonl}
+
+class LeadFeed:
+    """Per-consumer delta feed over hot leads.
+
+    Each consumer (a sales tool, an admin) has a cursor in
+    `lead_feed_cursors`: the (phone_date, user_id) of the last lead it
+    was given. A pull streams the hot leads after that cursor through
+    idx_users_hot_lead_phone_date, oldest first, and the cursor moves only
+    once the caller confirms delivery (`advance`), so a failed delivery is
+    simply pulled again. Leads from the last LEAD_FEED_SETTLE_SECONDS are
+    left for the next pull, so a phone saved just before a pull but
+    committed just after it cannot fall behind the cursor.
+    A user who sends their number again moves to the end of the feed and
+    is delivered again.
+    """
+
+    def __init__(self, db, settle_seconds=None, chunk_size=None):
+        self.db = db
+        self.settle_seconds = LEAD_FEED_SETTLE_SECONDS if settle_seconds is None else settle_seconds
+        self.chunk_size = chunk_size or LEAD_FEED_CHUNK_SIZE
+
+    def cursor(self, consumer):
+        row = self.db.get_lead_cursor(consumer)
+        return (row['phone_date'], row['user_id']) if row else ('', 0)
+
+    def iter_new(self, consumer, progress):
+        """Rows after the consumer's cursor; `progress` (a dict) ends up with 'rows' and 'cursor'."""
+        after = self.cursor(consumer)
+        until = sqlite_timestamp(self.settle_seconds)
+        progress.update(rows=0, cursor=None)
+        date_index, id_index = LEAD_COLUMNS.index('phone_date'), LEAD_COLUMNS.index('user_id')
+        while True:
+            rows = self.db.get_hot_leads_since(after[0], after[1], until, LEAD_COLUMNS, self.chunk_size)
+            if not rows:
+                return
+            yield from rows
+            after = (rows[-1][date_index], rows[-1][id_index])
+            progress.update(rows=progress['rows'] + len(rows), cursor=after)
+            if len(rows) < self.chunk_size:
+                return
+
+    def write(self, consumer, fmt, f):
+        """Write the consumer's new leads to an open text file; returns (rows, cursor)."""
+        progress = {}
+        WRITERS[fmt](f, self.iter_new(consumer, progress))
+        return progress['rows'], progress['cursor']
+
+    def export(self, consumer, fmt, export_dir=None):
+        """Write new leads to a file; returns (path, rows, cursor), path None when there are none."""
+        export_dir = export_dir or EXCEL_EXPORT_DIR
+        safe = ''.join(c if c.isalnum() or c in '-_' else '_' for c in consumer)
+        path = os.path.join(export_dir, f"leads_{safe}_{datetime.now().strftime('%Y%m%d_%H%M%S')}.{fmt}")
+        # utf-8-sig so Excel shows the Persian text of a CSV correctly
+        with open(path, 'w', encoding='utf-8-sig' if fmt == 'csv' else 'utf-8', newline='') as f:
+            rows, cursor = self.write(consumer, fmt, f)
+        if not rows:
+            os.remove(path)
+            return None, 0, None
+        logging.info(f"Lead feed {consumer}: {rows} new lead(s) written to {path}")
+        return path, rows, cursor
+
+    def advance(self, consumer, cursor, rows):
+        """Record a delivered pull: the next one starts after `cursor`."""
+        if cursor is not None:
+            self.db.set_lead_cursor(consumer, cursor[0], cursor[1], rows)
+
+def main():
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Hot leads new since this consumer's last pull")
+    parser.add_argument('consumer', nargs='?', help="name of the feed consumer, e.g. sales")
+    parser.add_argument('--format', choices=FORMATS, default='csv')
+    parser.add_argument('--out', default='-', help="output file (default: stdout)")
+    parser.add_argument('--peek', action='store_true', help="do not move the cursor")
+    parser.add_argument('--reset', action='store_true', help="start the consumer over from the first lead")
+    parser.add_argument('--list', action='store_true', help="show every consumer's cursor")
+    parser.add_argument('--db', help="database file (defaults to config.DB_FILE)")
+    args = parser.parse_args()
+    if not args.list and not args.consumer:
+        parser.error("a consumer is required")
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s', stream=sys.stderr)
+    db = DatabaseManager(args.db, journal=False)
+    try:
+        feed = LeadFeed(db)
+        if args.list:
+            for row in db.get_lead_cursors():
+                print(f"{row['consumer']:<20} {row['phone_date']} #{row['user_id']}  "
+                      f"{row['pulls']} pulls, {row['rows_total']} leads, last {row['pulled_at']}")
+            return
+        if args.reset:
+            db.reset_lead_cursor(args.consumer)
+        if args.out == '-':
+            rows, cursor = feed.write(args.consumer, args.format, sys.stdout)
+        else:
+            with open(args.out, 'w', encoding='utf-8-sig' if args.format == 'csv' else 'utf-8', newline='') as f:
+                rows, cursor = feed.write(args.consumer, args.format, f)
+        if not args.peek:
+            feed.advance(args.consumer, cursor, rows)
+        logging.info(f"{rows} new lead(s) for {args.consumer}" + (" (cursor not moved)" if args.peek else ""))
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,210 @@
+# media.py - Media asset registry with startup validation and re-upload
+
+import os
+import sys
+import logging
+import argparse
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from telebot import types
+from config import MEDIA_ASSETS, MEDIA_DIR, MEDIA_STORAGE_CHAT_ID, MEDIA_CHECK_WORKERS
+from outbox import INTERACTIVE
+
+PLACEHOLDER_FILE_ID = "ENTER_FILE_ID"
+KIND_METHODS = {'photo': 'send_photo', 'voice': 'send_voice', 'video': 'send_video'}
+# Kinds Telegram accepts together in one sendMediaGroup (voice notes are not)
+GROUP_MEDIA = {'photo': types.InputMediaPhoto, 'video': types.InputMediaVideo}
+MAX_GROUP = 10
+
+def _configured(file_id):
+    return file_id if file_id and file_id != PLACEHOLDER_FILE_ID else None
+
+class MediaRegistry:
+    """Resolves media assets (config.MEDIA_ASSETS) to file_ids that work.
+
+    `check_all` probes every asset concurrently with getFile. An asset
+    whose file_id is missing or rejected is uploaded from MEDIA_DIR to
+    MEDIA_STORAGE_CHAT_ID, and the file_id Telegram returns is stored in
+    `media_assets` and used from then on (until config.py changes the
+    configured value). Network errors leave an asset 'unchecked' rather
+    than triggering an upload.
+
+    Until the check finishes, `get` answers with the last stored file_id
+    or the configured one, so startup does not wait on Telegram.
+    """
+
+    def __init__(self, db, call_api, outbox, assets=None, media_dir=None, storage_chat_id=None, workers=None):
+        self.db = db
+        self.call_api = call_api
+        self.outbox = outbox
+        self.assets = MEDIA_ASSETS if assets is None else assets
+        self.media_dir = media_dir or MEDIA_DIR
+        self.storage_chat_id = storage_chat_id or MEDIA_STORAGE_CHAT_ID
+        self.workers = workers or MEDIA_CHECK_WORKERS
+
+        self._persisted = db.get_media_assets()
+        self._file_ids = {}
+        self._health = {}
+        for name, (kind, file_id, filename) in self.assets.items():
+            row = self._persisted.get(name)
+            candidates = self._candidates(name)
+            if row and not row['file_id'] and row['config_file_id'] == _configured(file_id):
+                # The last check found nothing usable for this config value
+                candidates = []
+            self._file_ids[name] = candidates[0] if candidates else None
+            self._health[name] = {'name': name, 'kind': kind, 'status': 'unchecked', 'source': None, 'error': None}
+
+    def _candidates(self, name):
+        """file_ids to try, best first."""
+        configured = _configured(self.assets[name][1])
+        row = self._persisted.get(name)
+        stored = row['file_id'] if row else None
+        if stored and row['config_file_id'] == configured:
+            # Already resolved from this very config value
+            candidates = [stored, configured]
+        else:
+            candidates = [configured, stored]
+        return [file_id for i, file_id in enumerate(candidates) if file_id and file_id not in candidates[:i]]
+
+    def start(self):
+        """Check every asset on a background thread."""
+        threading.Thread(target=self.check_all, name="media-check", daemon=True).start()
+
+    def get(self, name):
+        return self._file_ids.get(name)
+
+    def check_all(self):
+        with ThreadPoolExecutor(max_workers=self.workers, thread_name_prefix="media") as pool:
+            list(pool.map(self.check, self.assets))
+        report = self.report()
+        bad = [entry['name'] for entry in report if entry['status'] not in ('ok', 'uploaded')]
+        if bad:
+            logging.warning(f"Media assets not usable: {', '.join(bad)}")
+        logging.info(f"Media assets checked: {len(report) - len(bad)}/{len(report)} usable")
+        return report
+
+    def check(self, name):
+        kind, configured, filename = self.assets[name]
+        configured = _configured(configured)
+        status, source, file_id, errors = None, None, None, []
+
+        for candidate in self._candidates(name):
+            error, rejected = self._probe(candidate)
+            if error is None:
+                status, file_id = 'ok', candidate
+                source = 'config' if candidate == configured else 'stored'
+                break
+            errors.append(error)
+            if not rejected:
+                # Telegram did not answer; keep the id and look again next start
+                status, file_id, source = 'unchecked', candidate, 'config' if candidate == configured else 'stored'
+                break
+
+        if status is None:
+            path = os.path.join(self.media_dir, filename) if filename else None
+            if path and os.path.exists(path):
+                try:
+                    file_id = self.upload(kind, path)
+                    status, source = 'uploaded', 'upload'
+                    logging.info(f"Uploaded media asset {name} from {path}")
+                except Exception as e:
+                    status = 'upload_failed'
+                    errors.append(str(e))
+            else:
+                status = 'invalid' if errors else 'missing'
+
+        if status != 'unchecked':
+            self.db.save_media_asset(name, kind, file_id, configured, status, '; '.join(errors) or None)
+        self._file_ids[name] = file_id
+        self._health[name] = {'name': name, 'kind': kind, 'status': status, 'source': source,
+                              'error': '; '.join(errors) or None}
+        return self._health[name]
+
+    def _probe(self, file_id):
+        """(error, rejected): error is None if Telegram knows the file_id."""
+        try:
+            self.call_api('get_file', file_id)
+            return None, False
+        except Exception as e:
+            message = str(e)
+            # getFile refuses files over 20MB, which still proves the id is valid
+            if 'too big' in message:
+                return None, False
+            return message, getattr(e, 'error_code', None) == 400
+
+    def upload(self, kind, path):
+        with open(path, 'rb') as f:
+            message = self.call_api(KIND_METHODS[kind], self.storage_chat_id, f)
+        media = getattr(message, kind)
+        # Photos come back in several sizes, largest last
+        return (media[-1] if kind == 'photo' else media).file_id
+
+    def report(self):
+        return [dict(self._health[name]) for name in self.assets]
+
+    def format_report(self):
+        lines = []
+        for entry in self.report():
+            line = f"{entry['name']:<24} {entry['kind']:<6} {entry['status']:<14} {entry['source'] or '-'}"
+            if entry['error']:
+                line += f"  ({entry['error']})"
+            lines.append(line)
+        return "\n".join(lines)
+
+    def send(self, chat_id, name, lane=INTERACTIVE, **kwargs):
+        """Queue one asset; returns the outbox Future, or None if it has no file_id."""
+        file_id = self.get(name)
+        if not file_id:
+            return None
+        method = KIND_METHODS[self.assets[name][0]]
+        return self.outbox.submit(method, chat_id, file_id, lane=lane, **kwargs)
+
+    def send_many(self, chat_id, names, lane=INTERACTIVE):
+        """Queue several assets in order without waiting between them.
+
+        Runs of photos and videos go out as one media group. Voice notes
+        cannot be grouped, so they are pipelined: every send is queued at
+        once and the outbox keeps them in order for the chat.
+        """
+        future, run = None, []
+        for name in [name for name in names if self.get(name)] + [None]:
+            if name and self.assets[name][0] in GROUP_MEDIA and len(run) < MAX_GROUP:
+                run.append(name)
+                continue
+            if len(run) > 1:
+                media = [GROUP_MEDIA[self.assets[grouped][0]](self.get(grouped)) for grouped in run]
+                future = self.outbox.submit('send_media_group', chat_id, media, lane=lane)
+            elif run:
+                future = self.send(chat_id, run[0], lane)
+            run = []
+            if name is None:
+                break
+            if self.assets[name][0] in GROUP_MEDIA:
+                run = [name]
+            else:
+                future = self.send(chat_id, name, lane)
+        return future
+
+def main():
+    import telebot
+    from config import BOT_TOKEN
+    from database import DatabaseManager
+
+    parser = argparse.ArgumentParser(description="Check media assets, uploading any that are missing")
+    parser.add_argument('--db', help="database file (defaults to config.DB_FILE)")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    bot = telebot.TeleBot(BOT_TOKEN)
+    db = DatabaseManager(args.db, journal=False)
+    try:
+        registry = MediaRegistry(db, lambda method, *a, **kw: getattr(bot, method)(*a, **kw), outbox=None)
+        registry.check_all()
+        print(registry.format_report())
+        healthy = all(entry['status'] in ('ok', 'uploaded') for entry in registry.report())
+    finally:
+        db.close()
+    sys.exit(0 if healthy else 1)
+
+if __name__ == "__main__":
+    main()
@@ -142,6 +142,8 @@ bulk_quiz = """لطفاً نتیجه این محاسبه را بنویسید:
 
 bulk_file_request = """لطفاً فایل CSV یا Excel شامل userid های مورد نظر را ارسال کنید."""
 
+bulk_file_loading = """⏳ فایل در حال پردازش است، لطفاً صبر کنید..."""
+
 bulk_message_request = """حالا پیامی که می‌خواهید برای کاربران ارسال شود را بفرستید.
 (می‌تواند متن، عکس، ویدیو یا هر نوع محتوای دیگری باشد)"""
 
@@ -151,6 +153,58 @@ bulk_result = """✅ ارسال انبوه تکمیل شد:
 ✅ موفق: {success} کاربر  
 ❌ ناموفق: {failed} کاربر"""
 
+bulk_result_details = """🚫 ربات را مسدود کرده‌اند: {blocked}
+❔ نامشخص (قطع ربات حین ارسال): {unknown}
+⛔️ لغو شده: {cancelled}"""
+
+bulk_progress = """📤 ارسال انبوه #{broadcast_id} ({status})
+✅ ارسال شده: {sent}
+❌ ناموفق: {failed}
+🚫 مسدود کرده‌اند: {blocked}
+⏳ باقی‌مانده: {pending} از {total}"""
+
+bulk_status_labels = {
+    'draft': 'پیش‌نویس',
+    'running': 'در حال ارسال',
+    'paused': 'متوقف شده',
+    'done': 'پایان یافته',
+    'cancelled': 'لغو شده',
+}
+
+bulk_file_report = """📄 {rows} ردیف خوانده شد ({rows_per_s:.0f} ردیف در ثانیه)
+👥 شناسه یکتا: {unique}
+🔁 تکراری: {duplicates}
+⚠️ نامعتبر: {invalid}
+❓ ناشناخته (ربات را استارت نکرده‌اند): {unknown}
+🚫 ربات را مسدود کرده‌اند: {blocked}
+📬 قابل ارسال: {sendable}"""
+
+bulk_empty_file = """❌ هیچ userid معتبری در فایل پیدا نشد."""
+bulk_aborted = """❌ ارسال انبوه لغو شد."""
+bulk_not_allowed = """این عملیات در وضعیت فعلی ارسال ممکن نیست."""
+
+export_started = """⏳ در حال آماده‌سازی خروجی..."""
+export_progress = """⏳ در حال آماده‌سازی خروجی: {done} از {total} کاربر"""
+export_ready = """✅ خروجی آماده شد ({files} فایل)."""
+export_ready_cached = """✅ از آخرین خروجی تغییری نکرده؛ همان فایل ارسال شد."""
+
+leads_none = """🔥 از آخرین دریافت، لید جدیدی ثبت نشده است."""
+leads_ready = """🔥 {rows} لید جدید از آخرین دریافت"""
+
+# Admin buttons
+admin_button_stats = "📊 آمار"
+admin_button_export = "📥 خروجی اکسل"
+admin_button_export_csv = "📄 خروجی CSV"
+admin_button_leads_csv = "🔥 لیدهای جدید (CSV)"
+admin_button_leads_jsonl = "🔥 لیدهای جدید (JSONL)"
+admin_button_bulk = "📢 ارسال انبوه"
+bulk_button_send = "✅ ارسال"
+bulk_button_abort = "❌ انصراف"
+bulk_button_pause = "⏸ توقف"
+bulk_button_resume = "▶️ ادامه"
+bulk_button_cancel = "⛔️ لغو"
+bulk_button_refresh = "🔄 بروزرسانی"
+
 # Error messages
 error_invalid_file = """❌ فایل نامعتبر است. لطفاً فایل CSV یا Excel ارسال کنید."""
 error_quiz_wrong = """❌ پاسخ اشتباه است. عملیات لغو شد."""
@@ -0,0 +1,326 @@
+# migrations.py - Versioned schema migrations
+
+import logging
+import argparse
+import counters
+
+def _columns(cursor, table):
+    return {row[1] for row in cursor.execute(f"PRAGMA table_info({table})")}
+
+def _add_column(cursor, table, column, declaration):
+    if column not in _columns(cursor, table):
+        cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {declaration}")
+
+def _initial_schema(cursor):
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            user_id INTEGER PRIMARY KEY,
+            username TEXT,
+            first_name TEXT,
+            last_name TEXT,
+            name TEXT,
+            phone TEXT,
+            state TEXT DEFAULT 'start',
+            question_1 TEXT,
+            question_2 TEXT,
+            question_3 TEXT,
+            question_4 TEXT,
+            contact_time TEXT,
+            channel_link TEXT,
+            selected_expert TEXT,
+            registration_date TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            phone_date TIMESTAMP,
+            is_completed BOOLEAN DEFAULT 0,
+            is_vip BOOLEAN DEFAULT 0,
+            is_hot_lead BOOLEAN DEFAULT 0
+        )
+    """)
+
+    # Table for tracking messages to delete/edit
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_messages (
+            user_id INTEGER,
+            message_id INTEGER,
+            message_type TEXT,
+            PRIMARY KEY (user_id, message_type)
+        )
+    """)
+
+    # Reminder timers
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS user_timers (
+            user_id INTEGER PRIMARY KEY,
+            first_reminder TIMESTAMP,
+            second_reminder TIMESTAMP,
+            timer_active BOOLEAN DEFAULT 1
+        )
+    """)
+
+    # Final photo timer
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS final_photo_timers (
+            user_id INTEGER PRIMARY KEY,
+            send_time TIMESTAMP,
+            is_sent BOOLEAN DEFAULT 0
+        )
+    """)
+
+    # Databases created before these columns existed
+    _add_column(cursor, "users", "selected_expert", "TEXT")
+    _add_column(cursor, "users", "is_hot_lead", "BOOLEAN DEFAULT 0")
+
+def _access_path_indexes(cursor):
+    # get_all_users: ORDER BY registration_date
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_registration_date ON users (registration_date)")
+    # get_users_by_expert: WHERE selected_expert = ? ORDER BY registration_date
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_users_expert_registration
+        ON users (selected_expert, registration_date)
+    """)
+    # get_hot_leads: WHERE is_hot_lead = 1 ORDER BY phone_date
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_users_hot_lead_phone_date ON users (is_hot_lead, phone_date)")
+    # get_pending_final_photos / cleanup_old_timers: is_sent, send_time
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_final_photo_timers_pending ON final_photo_timers (is_sent, send_time)")
+    # cleanup_old_timers: second_reminder < ?
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_user_timers_second_reminder ON user_timers (second_reminder)")
+
+def _user_counters(cursor):
+    for statement in counters.trigger_statements():
+        cursor.execute(statement)
+    counters.rebuild(cursor)
+
+def _scheduled_jobs(cursor):
+    # One durable queue for every delayed send. due_at/lease_expires are
+    # epoch seconds; a job is 'leased' while a worker runs it and goes back
+    # to being claimable once its lease expires.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS scheduled_jobs (
+            job_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            job_type TEXT NOT NULL,
+            user_id INTEGER NOT NULL,
+            due_at REAL NOT NULL,
+            payload TEXT,
+            status TEXT NOT NULL DEFAULT 'pending',
+            lease_owner TEXT,
+            lease_expires REAL,
+            attempts INTEGER NOT NULL DEFAULT 0,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    # claim_due_jobs: pending jobs by due_at, expired leases by lease_expires
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_due ON scheduled_jobs (status, due_at)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_lease ON scheduled_jobs (status, lease_expires)")
+    # add_job / cancel_jobs: a user's pending jobs
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_scheduled_jobs_user ON scheduled_jobs (user_id, job_type, status)")
+
+    # Carry over every pending timer, overdue ones included: the startup
+    # reconciler (JobRunner.catch_up) spreads the overdue backlog out and
+    # the job states skip reminders the user has already moved past. The
+    # legacy tables stored local naive datetimes; the 'utc' modifier
+    # converts them to UTC epochs.
+    for column in ('first_reminder', 'second_reminder'):
+        cursor.execute(f"""
+            INSERT INTO scheduled_jobs (job_type, user_id, due_at, payload)
+            SELECT '{column}', user_id, CAST(strftime('%s', {column}, 'utc') AS REAL),
+                   json_object('chat_id', user_id)
+            FROM user_timers
+            WHERE timer_active = 1 AND {column} IS NOT NULL
+        """)
+    cursor.execute("""
+        INSERT INTO scheduled_jobs (job_type, user_id, due_at, payload)
+        SELECT 'final_photo', user_id, CAST(strftime('%s', send_time, 'utc') AS REAL),
+               json_object('chat_id', user_id)
+        FROM final_photo_timers
+        WHERE is_sent = 0
+    """)
+
+def _invite_links(cursor):
+    # Single-use channel invite links minted ahead of time. user_id and
+    # issued_at stay NULL until registration hands the link to a user.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS invite_links (
+            link_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            chat_id INTEGER NOT NULL,
+            invite_link TEXT NOT NULL UNIQUE,
+            user_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            issued_at TIMESTAMP
+        )
+    """)
+    # take_invite_link: oldest unissued link, or the link a user already has;
+    # count_invite_links: pool depth
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_invite_links_chat_user ON invite_links (chat_id, user_id)")
+
+def _media_assets(cursor):
+    # Resolved file_id per media asset, plus the configured value it was
+    # resolved from so a changed config.py value is tried again.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS media_assets (
+            name TEXT PRIMARY KEY,
+            kind TEXT NOT NULL,
+            file_id TEXT,
+            config_file_id TEXT,
+            status TEXT NOT NULL,
+            error TEXT,
+            checked_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+def _broadcasts(cursor):
+    # A broadcast copies one admin message to a list of recipients. Each
+    # recipient row is checkpointed: 'pending' -> 'queued' (on the outbox)
+    # -> 'sending' (committed before the API call) -> 'sent' / 'failed' /
+    # 'blocked'. After a crash queued rows go back to pending; rows still
+    # 'sending' become 'unknown' and are never sent again.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcasts (
+            broadcast_id INTEGER PRIMARY KEY AUTOINCREMENT,
+            admin_id INTEGER NOT NULL,
+            from_chat_id INTEGER,
+            message_id INTEGER,
+            status TEXT NOT NULL DEFAULT 'draft',
+            total INTEGER NOT NULL DEFAULT 0,
+            progress_chat_id INTEGER,
+            progress_message_id INTEGER,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+            started_at TIMESTAMP,
+            finished_at TIMESTAMP
+        )
+    """)
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS broadcast_recipients (
+            broadcast_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            error TEXT,
+            updated_at TIMESTAMP,
+            PRIMARY KEY (broadcast_id, user_id)
+        ) WITHOUT ROWID
+    """)
+    # claim_broadcast_recipients / get_broadcast_progress
+    cursor.execute("""
+        CREATE INDEX IF NOT EXISTS idx_broadcast_recipients_status
+        ON broadcast_recipients (broadcast_id, status)
+    """)
+    # Set when a send is refused with 403 (bot blocked, account deleted)
+    _add_column(cursor, "users", "is_blocked", "BOOLEAN DEFAULT 0")
+
+def _recipient_imports(cursor):
+    # Staging for uploaded recipient files: ids are deduplicated by the
+    # primary key as they stream in, then joined against users. Rows live
+    # only for the duration of one upload.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS recipient_imports (
+            import_id INTEGER NOT NULL,
+            user_id INTEGER NOT NULL,
+            PRIMARY KEY (import_id, user_id)
+        ) WITHOUT ROWID
+    """)
+
+def _data_versions(cursor):
+    # Bumped by triggers on every change to users, so an export made at
+    # version N can be reused for as long as the version is still N.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS data_versions (
+            name TEXT PRIMARY KEY,
+            version INTEGER NOT NULL DEFAULT 0
+        ) WITHOUT ROWID
+    """)
+    cursor.execute("INSERT OR IGNORE INTO data_versions (name, version) VALUES ('users', 0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_users_version_{event.lower()} AFTER {event} ON users
+            BEGIN
+                UPDATE data_versions SET version = version + 1 WHERE name = 'users';
+            END
+        """)
+
+def _lead_feed_cursors(cursor):
+    # Per-consumer watermark of the hot-lead delta feed: the last
+    # (phone_date, user_id) handed out; the next pull starts after it.
+    cursor.execute("""
+        CREATE TABLE IF NOT EXISTS lead_feed_cursors (
+            consumer TEXT PRIMARY KEY,
+            phone_date TIMESTAMP,
+            user_id INTEGER,
+            pulls INTEGER NOT NULL DEFAULT 0,
+            rows_total INTEGER NOT NULL DEFAULT 0,
+            pulled_at TIMESTAMP
+        ) WITHOUT ROWID
+    """)
+
+# Ordered (version, description, apply) entries. Never edit an applied
+# migration; append a new one instead.
+MIGRATIONS = [
+    (1, "initial schema", _initial_schema),
+    (2, "indexes for admin and timer queries", _access_path_indexes),
+    (3, "trigger-maintained user counters", _user_counters),
+    (4, "durable scheduled jobs with leases", _scheduled_jobs),
+    (5, "pool of pre-generated invite links", _invite_links),
+    (6, "media asset registry", _media_assets),
+    (7, "resumable admin broadcasts", _broadcasts),
+    (8, "staging table for recipient file uploads", _recipient_imports),
+    (9, "users data version for export caching", _data_versions),
+    (10, "hot-lead delta feed cursors", _lead_feed_cursors),
+]
+
+def schema_version(db):
+    return db._fetchone("PRAGMA user_version")[0]
+
+def apply_migrations(db):
+    """Bring the database up to the latest version, one transaction per migration.
+
+    The version is re-read inside each write transaction, so several
+    processes starting at once apply every migration exactly once.
+    """
+    applied = []
+    for version, description, apply in MIGRATIONS:
+        with db._write() as cursor:
+            current = cursor.execute("PRAGMA user_version").fetchone()[0]
+            if version <= current:
+                continue
+            apply(cursor)
+            cursor.execute(f"PRAGMA user_version = {int(version)}")
+        logging.info(f"Applied migration {version}: {description}")
+        applied.append(version)
+    return applied
+
+def explain_all(db):
+    """Run every DatabaseManager read path once with query-plan logging on."""
+    db.explain_queries = True
+    db.sessions.invalidate()
+    db._load_user(0)
+    db.get_message_id(0, "question")
+    db.get_stats()
+    db.get_all_users()
+    db.get_hot_leads()
+    db.get_users_by_expert("forough")
+    db.next_job_due()
+    db.claim_due_jobs("explain", now=0)
+    db.count_invite_links(0)
+    db.take_invite_link(0, 0)
+    db.get_broadcast_progress(0)
+    db.claim_broadcast_recipients(0, 1)
+    db.summarize_import(0)
+    db.get_hot_leads_since('', 0, '9999', ('user_id', 'phone_date'))
+
+def main():
+    parser = argparse.ArgumentParser(description="Apply schema migrations and inspect query plans")
+    parser.add_argument('--db', help="database file (defaults to config.DB_FILE)")
+    parser.add_argument('--explain', action='store_true', help="log EXPLAIN QUERY PLAN for every query")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+
+    from database import DatabaseManager
+    db = DatabaseManager(args.db, journal=False, write_behind=False)
+    try:
+        logging.info(f"Schema version: {schema_version(db)}")
+        if args.explain:
+            explain_all(db)
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,133 @@
+# models.py - Compact user record built straight from SQLite rows
+
+import sys
+from collections.abc import Mapping
+
+# Columns holding a small, fixed set of values (states, experts, option
+# texts). Identical strings from different rows share one object.
+INTERNED_COLUMNS = frozenset({
+    'state', 'selected_expert', 'contact_time',
+    'question_1', 'question_2', 'question_3', 'question_4'
+})
+
+# What the session cache keeps per user; everything else is loaded on
+# first access.
+SESSION_COLUMNS = (
+    'user_id', 'name', 'phone', 'state', 'selected_expert', 'channel_link',
+    'is_completed', 'is_vip', 'is_hot_lead'
+)
+
+class _Layout:
+    """Column positions for one SELECT shape, shared by all its records."""
+    __slots__ = ('columns', 'index', 'interned', 'all_columns', 'loader')
+
+    def __init__(self, columns, all_columns, loader):
+        self.columns = columns
+        self.index = {column: i for i, column in enumerate(columns)}
+        self.interned = [i for i, column in enumerate(columns) if column in INTERNED_COLUMNS]
+        self.all_columns = tuple(columns) + tuple(c for c in all_columns if c not in self.index)
+        self.loader = loader
+
+class User(Mapping):
+    """Read-only user row backed by a tuple.
+
+    Behaves like the dicts the DB layer used to return (`user['name']`,
+    `user.get('phone')`, `dict(user)`) and also allows `user.name`.
+    Columns the query did not select are fetched through the layout's
+    loader the first time they are read.
+    """
+    __slots__ = ('_layout', '_row', '_extra')
+
+    def __init__(self, layout, row, extra=None):
+        self._layout = layout
+        self._row = row
+        self._extra = extra
+
+    def __getitem__(self, column):
+        i = self._layout.index.get(column)
+        if i is not None:
+            return self._row[i]
+        extra = self._extra
+        if extra is not None and column in extra:
+            return extra[column]
+        if column not in self._layout.all_columns:
+            raise KeyError(column)
+        return self._load_missing()[column]
+
+    def __getattr__(self, column):
+        try:
+            return self[column]
+        except KeyError:
+            raise AttributeError(column) from None
+
+    def __iter__(self):
+        return iter(self._layout.all_columns)
+
+    def __len__(self):
+        return len(self._layout.all_columns)
+
+    def __repr__(self):
+        return f"User({dict(self)!r})"
+
+    def _load_missing(self):
+        """Fetch every not-yet-loaded column in one query."""
+        extra = dict(self._extra or ())
+        missing = [c for c in self._layout.all_columns if c not in self._layout.index and c not in extra]
+        if missing:
+            loaded = self._layout.loader(self._row[self._layout.index['user_id']], missing) or {}
+            extra.update((column, loaded.get(column)) for column in missing)
+        self._extra = extra
+        return extra
+
+    def replace(self, columns):
+        """Return a copy with some column values changed."""
+        row = list(self._row)
+        extra = dict(self._extra or ())
+        for column, value in columns.items():
+            i = self._layout.index.get(column)
+            if i is None:
+                extra[column] = value
+            else:
+                row[i] = _intern(column, value)
+        return User(self._layout, tuple(row), extra or None)
+
+def _intern(column, value):
+    if column in INTERNED_COLUMNS and isinstance(value, str):
+        return sys.intern(value)
+    return value
+
+class UserRowFactory:
+    """sqlite3 `row_factory` producing `User` records.
+
+    Set it on a cursor (`cursor.row_factory = factory`) for queries over
+    the users table; layouts are cached per column list.
+    """
+
+    def __init__(self, all_columns, loader):
+        self.all_columns = tuple(all_columns)
+        self.loader = loader
+        self._layouts = {}
+        # (cursor.description, layout) of the last query; a cursor keeps the
+        # same description object for all rows of one statement.
+        self._last = (None, None)
+
+    def layout(self, columns):
+        columns = tuple(columns)
+        layout = self._layouts.get(columns)
+        if layout is None:
+            layout = self._layouts[columns] = _Layout(columns, self.all_columns, self.loader)
+        return layout
+
+    def __call__(self, cursor, row):
+        description = cursor.description
+        last = self._last
+        if last[0] is not description:
+            last = self._last = (description, self.layout(d[0] for d in description))
+        layout = last[1]
+        if layout.interned:
+            row = list(row)
+            for i in layout.interned:
+                if isinstance(row[i], str):
+                    row[i] = sys.intern(row[i])
+            row = tuple(row)
+        return User(layout, row)
@@ -0,0 +1,324 @@
+# outbox.py - Rate-limited outbound dispatcher for all Telegram sends
+
+import time
+import heapq
+import asyncio
+import logging
+import itertools
+import threading
+import functools
+from concurrent.futures import Future, ThreadPoolExecutor
+from config import (
+    OUTBOX_GLOBAL_RATE, OUTBOX_PER_CHAT_INTERVAL,
+    OUTBOX_WORKERS, OUTBOX_MAX_RETRIES
+)
+
+# Priority lanes, lower is served first
+INTERACTIVE = 0
+REMINDER = 1
+BULK = 2
+LANE_NAMES = ('interactive', 'reminder', 'bulk')
+
+# Bot API methods routed through the outbox -> position of chat_id in *args
+SEND_METHODS = {
+    'send_message': 0,
+    'send_photo': 0,
+    'send_video': 0,
+    'send_voice': 0,
+    'send_document': 0,
+    'send_media_group': 0,
+    'copy_message': 0,
+    'delete_message': 0,
+    'edit_message_text': 1,
+}
+
+class _Send:
+    __slots__ = ('lane', 'seq', 'method', 'args', 'kwargs', 'future', 'queued_at', 'attempts', 'on_dispatch')
+
+    def __init__(self, lane, seq, method, args, kwargs, on_dispatch=None):
+        self.lane = lane
+        self.seq = seq
+        self.method = method
+        self.args = args
+        self.kwargs = kwargs
+        self.future = Future()
+        self.queued_at = time.monotonic()
+        self.attempts = 0
+        self.on_dispatch = on_dispatch
+
+    def __lt__(self, other):
+        return (self.lane, self.seq) < (other.lane, other.seq)
+
+class _Chat:
+    __slots__ = ('sends', 'next_at', 'busy', 'version')
+
+    def __init__(self):
+        self.sends = []      # heap of _Send
+        self.next_at = 0.0   # monotonic time the next send may start
+        self.busy = False    # a send for this chat is in flight
+        self.version = 0     # invalidates stale ready/sleeping heap entries
+
+class Outbox:
+    """Single gate for outgoing Bot API calls.
+
+    Calls are queued per chat and dispatched by one thread that enforces a
+    global token bucket (OUTBOX_GLOBAL_RATE sends/s) and a minimum gap per
+    chat (OUTBOX_PER_CHAT_INTERVAL). Among chats that may send, the one
+    whose next call sits in the best lane goes first: interactive replies,
+    then reminders, then bulk. A chat has at most one call in flight, so
+    its messages arrive in the order they were queued (within a lane).
+
+    `self.outbox.send_message(chat_id, text, ...)` takes the same arguments
+    as `bot.send_message` plus ``lane=`` and returns a Future: ignore it to
+    fire and forget, or call `.result()` to wait for the sent Message.
+    A 429 is retried after the server's retry_after; other server or
+    network errors are retried with backoff up to OUTBOX_MAX_RETRIES.
+    The returned Future is a `concurrent.futures.Future`; coroutines can
+    await it through `asyncio.wrap_future`. ``on_dispatch=`` is called
+    once, right before the first attempt; if it returns False the call is
+    withdrawn and its Future fails without anything being sent.
+    """
+
+    def __init__(self, bot, rate=None, per_chat_interval=None, workers=None, max_retries=None, loop=None):
+        self.bot = bot
+        # With an event loop the bot is an AsyncTeleBot: calls run as
+        # coroutines on that loop instead of on the worker threads.
+        self.loop = loop
+        self.rate = rate or OUTBOX_GLOBAL_RATE
+        self.per_chat_interval = OUTBOX_PER_CHAT_INTERVAL if per_chat_interval is None else per_chat_interval
+        self.max_retries = OUTBOX_MAX_RETRIES if max_retries is None else max_retries
+
+        self._cond = threading.Condition()
+        self._seq = itertools.count()
+        self._chats = {}         # chat_id -> _Chat with queued or in-flight sends
+        self._ready = []         # (lane, seq, version, chat_id) of chats allowed to send now
+        self._sleeping = []      # (next_at, version, chat_id) of chats waiting out their pacing
+        self._tokens = 1.0
+        self._refilled = time.monotonic()
+        self._closing = False
+
+        self._depth = [0] * len(LANE_NAMES)
+        self._counters = [{'queued': 0, 'sent': 0, 'failed': 0, 'retried': 0, 'max_depth': 0, 'wait': 0.0}
+                          for _ in LANE_NAMES]
+
+        self._executor = None if loop else ThreadPoolExecutor(max_workers=workers or OUTBOX_WORKERS,
+                                                              thread_name_prefix="outbox")
+        self._thread = threading.Thread(target=self._run, name="outbox", daemon=True)
+        self._thread.start()
+
+    def __getattr__(self, name):
+        if name in SEND_METHODS:
+            return functools.partial(self.submit, name)
+        raise AttributeError(name)
+
+    def submit(self, method, *args, lane=INTERACTIVE, on_dispatch=None, **kwargs):
+        """Queue ``bot.<method>(*args, **kwargs)``; returns a Future."""
+        chat_id = kwargs.get('chat_id', args[SEND_METHODS[method]] if len(args) > SEND_METHODS[method] else None)
+        with self._cond:
+            if self._closing:
+                raise RuntimeError("outbox is closed")
+            send = _Send(lane, next(self._seq), method, args, kwargs, on_dispatch)
+            chat = self._chats.get(chat_id)
+            if chat is None:
+                chat = self._chats[chat_id] = _Chat()
+            heapq.heappush(chat.sends, send)
+
+            counters = self._counters[lane]
+            counters['queued'] += 1
+            self._depth[lane] += 1
+            counters['max_depth'] = max(counters['max_depth'], self._depth[lane])
+
+            if not chat.busy and chat.sends[0] is send:
+                self._schedule_chat(chat_id, chat)
+                self._cond.notify()
+        return send.future
+
+    def _schedule_chat(self, chat_id, chat):
+        # Caller holds the lock; the chat is idle and has queued sends
+        chat.version += 1
+        if chat.next_at <= time.monotonic():
+            head = chat.sends[0]
+            heapq.heappush(self._ready, (head.lane, head.seq, chat.version, chat_id))
+        else:
+            heapq.heappush(self._sleeping, (chat.next_at, chat.version, chat_id))
+
+    def _take_token(self):
+        # Seconds until a token is available (0 means one was taken). The
+        # bucket holds a single token, so sends are spaced evenly instead of
+        # bursting up to twice the rate after an idle second.
+        now = time.monotonic()
+        self._tokens = min(1.0, self._tokens + (now - self._refilled) * self.rate)
+        self._refilled = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0
+        return (1 - self._tokens) / self.rate
+
+    def _next_send(self):
+        """Pop the best sendable call, or return how long to wait."""
+        now = time.monotonic()
+        while self._sleeping and self._sleeping[0][0] <= now:
+            _, version, chat_id = heapq.heappop(self._sleeping)
+            chat = self._chats.get(chat_id)
+            if chat is not None and chat.version == version:
+                head = chat.sends[0]
+                heapq.heappush(self._ready, (head.lane, head.seq, version, chat_id))
+
+        while self._ready:
+            _, _, version, chat_id = self._ready[0]
+            chat = self._chats.get(chat_id)
+            if chat is None or chat.version != version:
+                heapq.heappop(self._ready)
+                continue
+            if chat.sends[0].seq != self._ready[0][1]:
+                # A better-lane call arrived after this entry was pushed
+                heapq.heapreplace(self._ready, (chat.sends[0].lane, chat.sends[0].seq, version, chat_id))
+                continue
+            delay = self._take_token()
+            if delay:
+                return None, delay
+            heapq.heappop(self._ready)
+            send = heapq.heappop(chat.sends)
+            chat.busy = True
+            chat.version += 1
+            chat.next_at = now + self.per_chat_interval
+            return (chat_id, chat, send), 0
+
+        return None, (self._sleeping[0][0] - now) if self._sleeping else None
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    item, delay = self._next_send()
+                    if item is not None:
+                        break
+                    if self._closing and not self._chats:
+                        return
+                    self._cond.wait(delay)
+            if self.loop is not None:
+                asyncio.run_coroutine_threadsafe(self._call_async(*item), self.loop)
+            else:
+                self._executor.submit(self._call, *item)
+
+    def _call(self, chat_id, chat, send):
+        if not self._begin(chat_id, chat, send):
+            return
+        if send.on_dispatch is not None and not self._dispatching(chat_id, chat, send):
+            return
+        try:
+            result = getattr(self.bot, send.method)(*send.args, **send.kwargs)
+        except Exception as e:
+            self._failed(chat_id, chat, send, e)
+        else:
+            self._finish(chat_id, chat, send, None, 'sent')
+            send.future.set_result(result)
+
+    async def _call_async(self, chat_id, chat, send):
+        if not self._begin(chat_id, chat, send):
+            return
+        # The hook may write to the database; keep it off the loop
+        if send.on_dispatch is not None and not await self.loop.run_in_executor(
+                None, self._dispatching, chat_id, chat, send):
+            return
+        try:
+            result = await getattr(self.bot, send.method)(*send.args, **send.kwargs)
+        except Exception as e:
+            self._failed(chat_id, chat, send, e)
+        else:
+            self._finish(chat_id, chat, send, None, 'sent')
+            send.future.set_result(result)
+
+    def _begin(self, chat_id, chat, send):
+        if send.attempts == 0 and not send.future.set_running_or_notify_cancel():
+            self._finish(chat_id, chat, send, None, 'failed')
+            return False
+        send.attempts += 1
+        return True
+
+    def _dispatching(self, chat_id, chat, send):
+        """Run the send's on_dispatch hook before its first attempt; False if it was withdrawn."""
+        if send.attempts > 1:
+            return True
+        try:
+            approved = send.on_dispatch() is not False
+            error = None if approved else RuntimeError(f"{send.method} to {chat_id} withdrawn before sending")
+        except Exception as e:
+            error = e
+        if error is None:
+            return True
+        self._finish(chat_id, chat, send, None, 'failed')
+        send.future.set_exception(error)
+        return False
+
+    def _failed(self, chat_id, chat, send, error):
+        # TeleBot and AsyncTeleBot raise different ApiTelegramException
+        # classes; both carry error_code and result_json.
+        error_code = getattr(error, 'error_code', None)
+        if error_code == 429:
+            retry_after = ((getattr(error, 'result_json', None) or {}).get('parameters') or {}).get('retry_after', 1)
+            self._finish(chat_id, chat, send, retry_after, 'retried', throttled=True)
+            logging.warning(f"Outbox {send.method} to {chat_id} rate limited, retrying in {retry_after}s")
+            return
+
+        # Network errors (no error_code) may or may not have reached Telegram
+        retry = error_code is None or error_code >= 500
+        if retry and send.attempts <= self.max_retries:
+            self._finish(chat_id, chat, send, 2 ** send.attempts, 'retried')
+            logging.warning(f"Outbox {send.method} to {chat_id} failed, retrying: {error}")
+            return
+        self._finish(chat_id, chat, send, None, 'failed')
+        logging.error(f"Outbox {send.method} to {chat_id} failed: {error}")
+        send.future.set_exception(error)
+
+    def _finish(self, chat_id, chat, send, retry_in, outcome, throttled=False):
+        """Book one attempt and let the chat's next call be scheduled."""
+        counters = self._counters[send.lane]
+        with self._cond:
+            chat.busy = False
+            counters[outcome] += 1
+            if retry_in is not None:
+                chat.next_at = time.monotonic() + retry_in
+                heapq.heappush(chat.sends, send)
+                if throttled:
+                    # Telegram is pushing back; spend no saved-up burst
+                    self._tokens = 0.0
+            else:
+                self._depth[send.lane] -= 1
+                counters['wait'] += time.monotonic() - send.queued_at
+            if chat.sends:
+                self._schedule_chat(chat_id, chat)
+            else:
+                del self._chats[chat_id]
+            self._cond.notify()
+
+    def stats(self):
+        """Per-lane queue depth and counters."""
+        with self._cond:
+            lanes = {}
+            for lane, name in enumerate(LANE_NAMES):
+                counters = dict(self._counters[lane])
+                done = counters['sent'] + counters['failed']
+                counters['depth'] = self._depth[lane]
+                wait_total = counters.pop('wait')
+                counters['avg_wait'] = wait_total / done if done else 0.0
+                lanes[name] = counters
+            return lanes
+
+    def close(self, wait=True):
+        """Stop accepting sends; with wait=True deliver what is queued first."""
+        with self._cond:
+            self._closing = True
+            if not wait:
+                for chat in self._chats.values():
+                    for send in chat.sends:
+                        if send.future.cancel():
+                            self._depth[send.lane] -= 1
+                            self._counters[send.lane]['failed'] += 1
+                    chat.sends = [send for send in chat.sends if not send.future.cancelled()]
+                self._chats = {chat_id: chat for chat_id, chat in self._chats.items() if chat.busy}
+            self._cond.notify()
+        self._thread.join()
+        if self._executor:
+            self._executor.shutdown(wait=True)
+        logging.info(f"Outbox closed: {self.stats()}")
@@ -5,7 +5,7 @@ import os
 import sys
 import subprocess
 from bot import TelegramBot
-from config import BOT_TOKEN, ADMIN_IDS
+from config import BOT_TOKEN, ADMIN_IDS, ASYNC_MODE, WEBHOOK_ENABLED
 
 def check_requirements():
     """Check and install required packages"""
@@ -99,7 +99,14 @@ def main():
     print("=" * 50)
     
     try:
-        bot = TelegramBot()
+        if ASYNC_MODE:
+            from async_bot import AsyncTelegramBot
+            bot = AsyncTelegramBot()
+        elif WEBHOOK_ENABLED:
+            from webhook import WebhookTelegramBot
+            bot = WebhookTelegramBot()
+        else:
+            bot = TelegramBot()
         print("✅ Bot is online and running!")
         print("📱 Ready to receive messages...")
         print("🛑 Press Ctrl+C to stop the bot")
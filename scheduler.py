@@ -0,0 +1,204 @@
+# scheduler.py - Min-heap timer scheduler
+
+import time
+import heapq
+import logging
+import itertools
+import threading
+from datetime import datetime
+from concurrent.futures import ThreadPoolExecutor
+
+class Scheduler:
+    """Runs callbacks at their deadlines from a single timer thread.
+
+    Deadlines live in a min-heap; the thread sleeps until the earliest one
+    and is woken early when a sooner job is added. Every job has a key
+    (e.g. ``('first_reminder', user_id)``): scheduling an existing key
+    replaces the old job and `cancel(key)` drops it. Cancelled entries are
+    skipped lazily when they reach the top of the heap.
+
+    Callbacks run on a small thread pool so a slow send never delays other
+    timers; with ``workers=0`` they run inline on the timer thread.
+    """
+
+    def __init__(self, workers=4, name="scheduler"):
+        self._heap = []          # (due, seq, key)
+        self._jobs = {}          # key -> (due, seq, func, args)
+        self._stale = 0          # cancelled/replaced entries still in the heap
+        self._seq = itertools.count()
+        self._cond = threading.Condition()
+        self._stopped = False
+
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix=name) if workers else None
+        self._thread = threading.Thread(target=self._run, name=name, daemon=True)
+        self._thread.start()
+
+    def schedule(self, when, func, *args, key=None):
+        """Run ``func(*args)`` at `when` (datetime or epoch seconds); returns the key."""
+        due = when.timestamp() if isinstance(when, datetime) else float(when)
+        with self._cond:
+            seq = next(self._seq)
+            if key is None:
+                key = ('job', seq)
+            if key in self._jobs:
+                self._stale += 1
+            self._jobs[key] = (due, seq, func, args)
+            heapq.heappush(self._heap, (due, seq, key))
+            if self._heap[0][1] == seq:
+                self._cond.notify()
+        return key
+
+    def schedule_in(self, delay, func, *args, key=None):
+        return self.schedule(time.time() + delay, func, *args, key=key)
+
+    def cancel(self, key):
+        """Drop a pending job; returns False if it was not scheduled."""
+        with self._cond:
+            if self._jobs.pop(key, None) is None:
+                return False
+            self._stale += 1
+            self._compact()
+            return True
+
+    def due_at(self, key):
+        """Deadline (epoch seconds) of a pending job, or None."""
+        with self._cond:
+            job = self._jobs.get(key)
+            return job[0] if job else None
+
+    def __len__(self):
+        with self._cond:
+            return len(self._jobs)
+
+    def _compact(self):
+        # Rebuild once dead entries dominate, keeping memory O(pending jobs)
+        if self._stale > 1024 and self._stale > len(self._jobs):
+            self._heap = [(due, seq, key) for key, (due, seq, _, _) in self._jobs.items()]
+            heapq.heapify(self._heap)
+            self._stale = 0
+
+    def _run(self):
+        while True:
+            with self._cond:
+                while True:
+                    if self._stopped:
+                        return
+                    if not self._heap:
+                        self._cond.wait()
+                        continue
+                    due, seq, key = self._heap[0]
+                    job = self._jobs.get(key)
+                    if job is None or job[1] != seq:
+                        heapq.heappop(self._heap)
+                        self._stale -= 1
+                        continue
+                    delay = due - time.time()
+                    if delay > 0:
+                        self._cond.wait(delay)
+                        continue
+                    heapq.heappop(self._heap)
+                    del self._jobs[key]
+                    break
+
+            _, _, func, args = job
+            if self._executor:
+                self._executor.submit(self._call, key, func, args)
+            else:
+                self._call(key, func, args)
+
+    def _call(self, key, func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            logging.error(f"Error in scheduled job {key}: {e}")
+
+    def stop(self, wait=True):
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._executor:
+            self._executor.shutdown(wait=wait)
+
+class LoopScheduler:
+    """`Scheduler` interface on an asyncio event loop.
+
+    Each job is a `loop.call_later` timer instead of an entry on a timer
+    thread's heap; when it fires the callback is handed to `executor` so
+    blocking work (DB claims, sends that wait for a result) stays off the
+    loop. Safe to call from any thread.
+    """
+
+    def __init__(self, loop, executor):
+        self._loop = loop
+        self._executor = executor
+        self._lock = threading.Lock()
+        self._jobs = {}       # key -> (due, token); the source of truth
+        self._handles = {}    # key -> TimerHandle, touched on the loop thread only
+        self._seq = itertools.count()
+
+    def schedule(self, when, func, *args, key=None):
+        due = when.timestamp() if isinstance(when, datetime) else float(when)
+        with self._lock:
+            token = next(self._seq)
+            if key is None:
+                key = ('job', token)
+            self._jobs[key] = (due, token)
+        self._loop.call_soon_threadsafe(self._arm, key, token, due, func, args)
+        return key
+
+    def schedule_in(self, delay, func, *args, key=None):
+        return self.schedule(time.time() + delay, func, *args, key=key)
+
+    def _arm(self, key, token, due, func, args):
+        handle = self._handles.pop(key, None)
+        if handle:
+            handle.cancel()
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job[1] != token:
+                return
+        self._handles[key] = self._loop.call_later(max(0.0, due - time.time()), self._fire, key, token, func, args)
+
+    def _fire(self, key, token, func, args):
+        self._handles.pop(key, None)
+        with self._lock:
+            job = self._jobs.get(key)
+            if job is None or job[1] != token:
+                return
+            del self._jobs[key]
+        self._loop.run_in_executor(self._executor, self._call, key, func, args)
+
+    def _call(self, key, func, args):
+        try:
+            func(*args)
+        except Exception as e:
+            logging.error(f"Error in scheduled job {key}: {e}")
+
+    def cancel(self, key):
+        with self._lock:
+            if self._jobs.pop(key, None) is None:
+                return False
+        self._loop.call_soon_threadsafe(self._disarm, key)
+        return True
+
+    def _disarm(self, key):
+        handle = self._handles.pop(key, None)
+        if handle:
+            handle.cancel()
+
+    def due_at(self, key):
+        with self._lock:
+            job = self._jobs.get(key)
+            return job[0] if job else None
+
+    def __len__(self):
+        with self._lock:
+            return len(self._jobs)
+
+    def stop(self, wait=True):
+        with self._lock:
+            keys = list(self._jobs)
+            self._jobs.clear()
+        if not self._loop.is_closed():
+            for key in keys:
+                self._loop.call_soon_threadsafe(self._disarm, key)
@@ -0,0 +1,97 @@
+# sequences.py - Delayed message sequences run from scheduled jobs
+
+import time
+import logging
+from concurrent.futures import Future
+
+class SequenceRunner:
+    """Runs named lists of steps with pauses between them, without sleeping.
+
+    A sequence is declared once as ``[(delay, step), ...]`` where `delay`
+    is the pause in seconds before the step and `step` is called as
+    ``step(chat_id, user_id, context)``. Steps up to the first non-zero
+    delay run in the caller's thread; each later step is a 'sequence' job
+    in the database, so a handler returns immediately and an unfinished
+    sequence carries on after a restart.
+
+    A user runs at most one sequence: starting another one (or `cancel`)
+    drops the pending step of the previous one. `context` must be JSON
+    serializable since it is stored with the job.
+
+    When a step falls due, `submit(user_id, func, *args)` (the bot's
+    per-user lanes) runs it, so it never interleaves with the user's own
+    updates. The job waits for it and sees its errors, so a failed step
+    is retried. Without `submit` steps run on the job thread.
+    """
+
+    JOB_TYPE = 'sequence'
+
+    def __init__(self, jobs, submit=None):
+        self.jobs = jobs
+        self.submit = submit
+        self.sequences = {}
+        jobs.register(self.JOB_TYPE, self._run_job)
+
+    def define(self, name, steps):
+        self.sequences[name] = list(steps)
+
+    def start(self, sequence, user_id, chat_id, **context):
+        if sequence not in self.sequences:
+            raise KeyError(f"Unknown sequence {sequence}")
+        self.cancel(user_id)
+        try:
+            delay = self.sequences[sequence][0][0]
+            if delay > 0:
+                self._schedule(sequence, 0, user_id, chat_id, context, delay)
+            else:
+                self._advance(sequence, 0, user_id, chat_id, context)
+        except Exception as e:
+            logging.error(f"Error in sequence {sequence} for user {user_id}: {e}")
+
+    def cancel(self, user_id):
+        """Drop the user's pending sequence step, if any."""
+        return self.jobs.cancel(user_id, (self.JOB_TYPE,))
+
+    def _run_job(self, job):
+        payload = job['payload']
+        name = payload['sequence']
+        if name not in self.sequences:
+            logging.error(f"Dropping step of unknown sequence {name} for user {job['user_id']}")
+            return
+        args = (name, payload['step'], job['user_id'], payload['chat_id'], payload.get('context', {}))
+        if self.submit is None:
+            self._advance(*args)
+            return
+        done = Future()
+        self.submit(job['user_id'], self._advance_on_lane, done, args)
+        done.result()
+
+    def _advance_on_lane(self, done, args):
+        try:
+            self._advance(*args)
+        except Exception as e:
+            done.set_exception(e)
+        else:
+            done.set_result(None)
+
+    def _advance(self, name, index, user_id, chat_id, context):
+        """Run step `index` and any zero-delay steps after it, then schedule the next one."""
+        steps = self.sequences[name]
+        while True:
+            _, step = steps[index]
+            step(chat_id, user_id, context)
+            index += 1
+            if index >= len(steps):
+                return
+            delay = steps[index][0]
+            if delay > 0:
+                break
+        self._schedule(name, index, user_id, chat_id, context, delay)
+
+    def _schedule(self, name, index, user_id, chat_id, context, delay):
+        self.jobs.add(self.JOB_TYPE, user_id, time.time() + delay, {
+            'sequence': name,
+            'step': index,
+            'chat_id': chat_id,
+            'context': context
+        })
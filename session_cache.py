@@ -0,0 +1,74 @@
+# session_cache.py - Bounded LRU cache of user records
+
+import threading
+from collections import OrderedDict
+
+class SessionCache:
+    """LRU map of user_id -> immutable `models.User` record with hit/miss counters.
+
+    Writers keep cached records current through `update`; a record loaded
+    from the database is only stored if no write happened while it was
+    being read, so a slow load can never overwrite a newer value.
+    """
+
+    def __init__(self, max_size):
+        self.max_size = max_size
+        self.hits = 0
+        self.misses = 0
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes = 0
+
+    def get(self, user_id):
+        with self._lock:
+            record = self._data.get(user_id)
+            if record is None:
+                self.misses += 1
+                return None
+            self._data.move_to_end(user_id)
+            self.hits += 1
+            return record
+
+    def load_token(self):
+        """Snapshot of the write counter, taken before reading from the DB."""
+        with self._lock:
+            return self._writes
+
+    def put(self, user_id, record, token=None):
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            if token is not None and token != self._writes:
+                return
+            self._data[user_id] = record
+            self._data.move_to_end(user_id)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def update(self, user_id, columns):
+        """Apply written column values to a cached record, if present."""
+        with self._lock:
+            self._writes += 1
+            record = self._data.get(user_id)
+            if record is not None:
+                self._data[user_id] = record.replace(columns)
+
+    def invalidate(self, user_id=None):
+        """Drop one user, or everything when no user_id is given."""
+        with self._lock:
+            self._writes += 1
+            if user_id is None:
+                self._data.clear()
+            else:
+                self._data.pop(user_id, None)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'size': len(self._data),
+                'max_size': self.max_size,
+                'hits': self.hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0
+            }
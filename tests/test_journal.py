@@ -0,0 +1,47 @@
+# test_journal.py - A rebuild from the change journal restores every user column
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import journal
+from database import DatabaseManager
+
+class JournalRebuildTest(unittest.TestCase):
+    def setUp(self):
+        # The journal and snapshot files live in the working directory
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.mkdtemp()
+        os.chdir(self.workdir)
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        shutil.rmtree(self.workdir)
+
+    def test_rebuild_restores_state_expert_and_channel_link(self):
+        db = DatabaseManager("live.db", write_behind=False)
+        db.add_user(1, "user1", "User", None)
+        db.add_user(2, "user2", "User", None)
+        db.update_user_state(1, "question_3")
+        db.save_selected_expert(1, "sadegh")
+        db.update_channel_link(1, "https://t.me/+link")
+        db.set_user_blocked(2)
+        db.close()
+
+        journal.rebuild("rebuilt.db")
+        db = DatabaseManager("rebuilt.db", journal=False, write_behind=False)
+        try:
+            self.assertEqual(
+                db._fetchall("SELECT user_id, state, selected_expert, channel_link, is_blocked FROM users ORDER BY user_id"),
+                [(1, "question_3", "sadegh", "https://t.me/+link", 0), (2, "start", None, None, 1)]
+            )
+            self.assertEqual(db.get_stats()['total_users'], 2)
+        finally:
+            db.close()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,43 @@
+# test_restore_users.py - Restoring rows must keep user_counters in step with users
+
+import os
+import sys
+import shutil
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from database import DatabaseManager
+
+class RestoreUsersTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.mkdtemp()
+        self.db = DatabaseManager(os.path.join(self.workdir, "test.db"), journal=False, write_behind=False)
+        for user_id in range(1, 21):
+            self.db.add_user(user_id, f"user{user_id}", f"User {user_id}", None)
+
+    def tearDown(self):
+        self.db.close()
+        shutil.rmtree(self.workdir)
+
+    def assertCountersMatch(self):
+        stats = self.db.get_stats()
+        self.assertEqual(stats['total_users'], self.db._fetchone("SELECT COUNT(*) FROM users")[0])
+        self.assertEqual(stats['vip_users'], self.db._fetchone("SELECT COUNT(*) FROM users WHERE is_vip = 1")[0])
+
+    def test_restore_existing_users(self):
+        self.db.restore_users([
+            {'user_id': 1, 'name': 'Restored', 'is_vip': 1, 'state': 'completed'},
+            {'user_id': 2, 'name': 'Restored'},
+        ])
+        self.assertEqual(self.db._fetchone("SELECT name, is_vip FROM users WHERE user_id = 1"), ('Restored', 1))
+        self.assertCountersMatch()
+
+    def test_restore_new_and_existing_users(self):
+        self.db.restore_users([{'user_id': user_id, 'is_vip': user_id % 2} for user_id in range(15, 31)])
+        self.assertEqual(self.db._fetchone("SELECT COUNT(*) FROM users")[0], 30)
+        self.assertCountersMatch()
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,349 @@
+# webhook.py - Webhook ingestion server with a bounded work queue
+
+import sys
+import json
+import time
+import queue
+import sqlite3
+import logging
+import argparse
+import itertools
+import threading
+import urllib.request
+import urllib.error
+from types import SimpleNamespace
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from concurrent.futures import ThreadPoolExecutor
+import telebot
+from telebot import apihelper
+from config import (
+    WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_PATH, WEBHOOK_URL, WEBHOOK_SECRET,
+    WEBHOOK_WORKERS, WEBHOOK_QUEUE_SIZE, WEBHOOK_ENQUEUE_TIMEOUT, WEBHOOK_MAX_BODY, DB_FILE, UserState
+)
+from bot import TelegramBot
+
+class _HTTPServer(ThreadingHTTPServer):
+    daemon_threads = True
+    # socketserver's default listen backlog of 5 turns bursts into SYN retries
+    request_queue_size = 128
+
+class WebhookServer:
+    """HTTP endpoint that acknowledges updates at once and processes them later.
+
+    A POST to `path` is checked against the secret token, put on a bounded
+    queue as raw bytes and answered with 200 before any parsing or handler
+    work. A fixed pool of workers drains the queue into `process`, which
+    blocks while the update's lane is full, so slow handlers back up into
+    this queue. When it stays full for `enqueue_timeout` seconds the
+    request gets a 503, which makes Telegram back off and redeliver later
+    instead of us buffering without limit.
+    """
+
+    def __init__(self, process, host=WEBHOOK_HOST, port=WEBHOOK_PORT, path=WEBHOOK_PATH,
+                 secret=WEBHOOK_SECRET, workers=WEBHOOK_WORKERS, queue_size=WEBHOOK_QUEUE_SIZE,
+                 enqueue_timeout=WEBHOOK_ENQUEUE_TIMEOUT, metrics=None):
+        self.process = process
+        self.metrics = metrics or {}
+        self.path = path
+        self.secret = secret
+        self.enqueue_timeout = enqueue_timeout
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.workers = workers
+
+        self._lock = threading.Lock()
+        # 'dispatched': handed to the lanes (handler completions are the lanes' 'done')
+        self.counters = {'accepted': 0, 'rejected': 0, 'dispatched': 0, 'errors': 0, 'max_depth': 0}
+        self._ack_time = 0.0
+
+        self.httpd = _HTTPServer((host, port), self._handler_class())
+        self._threads = [threading.Thread(target=self._work, name=f"webhook-{i}", daemon=True)
+                         for i in range(workers)]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def do_POST(self):
+                started = time.perf_counter()
+                status = server.ingest(self.path, self.headers, self.rfile)
+                self.send_response(status)
+                self.send_header("Content-Length", "0")
+                if status != 200:
+                    # The body may be unread; don't parse it as the next request
+                    self.send_header("Connection", "close")
+                    self.close_connection = True
+                self.end_headers()
+                server._book_ack(time.perf_counter() - started)
+
+            def do_GET(self):
+                body = json.dumps(server.stats()).encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
+
+    def ingest(self, path, headers, body):
+        """Queue one update; returns the HTTP status to answer with."""
+        if path != self.path:
+            return 404
+        if self.secret and headers.get('X-Telegram-Bot-Api-Secret-Token') != self.secret:
+            return 403
+        try:
+            length = int(headers.get('Content-Length') or 0)
+        except ValueError:
+            return 400
+        if length <= 0 or length > WEBHOOK_MAX_BODY:
+            return 413 if length else 400
+        data = body.read(length)
+
+        try:
+            self.queue.put(data, timeout=self.enqueue_timeout)
+        except queue.Full:
+            with self._lock:
+                self.counters['rejected'] += 1
+            logging.warning("Webhook queue full, asking Telegram to retry")
+            return 503
+
+        with self._lock:
+            self.counters['accepted'] += 1
+            self.counters['max_depth'] = max(self.counters['max_depth'], self.queue.qsize())
+        return 200
+
+    def _book_ack(self, seconds):
+        with self._lock:
+            self._ack_time += seconds
+
+    def _work(self):
+        while True:
+            data = self.queue.get()
+            if data is None:
+                return
+            try:
+                self.process(json.loads(data))
+                outcome = 'dispatched'
+            except Exception as e:
+                logging.error(f"Error processing webhook update: {e}")
+                outcome = 'errors'
+            with self._lock:
+                self.counters[outcome] += 1
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.counters)
+            answered = stats['accepted'] + stats['rejected']
+            stats['avg_ack_ms'] = self._ack_time / answered * 1000 if answered else 0.0
+        stats['depth'] = self.queue.qsize()
+        stats['workers'] = self.workers
+        for name, source in self.metrics.items():
+            stats[name] = source()
+        return stats
+
+    def serve_forever(self):
+        for thread in self._threads:
+            thread.start()
+        logging.info(f"Webhook server listening on {self.httpd.server_address} {self.path}")
+        self.httpd.serve_forever()
+
+    def stop(self):
+        """Stop accepting requests, then let the workers finish the queue."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        for _ in self._threads:
+            self.queue.put(None)
+        for thread in self._threads:
+            if thread.is_alive():
+                thread.join()
+        logging.info(f"Webhook server stopped: {self.stats()}")
+
+class WebhookTelegramBot(TelegramBot):
+    """TelegramBot fed by WebhookServer instead of long polling."""
+
+    def process_update(self, payload):
+        self.bot.process_new_updates([telebot.types.Update.de_json(payload)])
+
+    def start_bot(self, register=True):
+        self.server = WebhookServer(self.process_update, metrics={
+            'lanes': self.lanes.stats, 'callbacks': self.callback_gate.stats,
+            'invites': self.invites.stats, 'media': self.media.report})
+        if register and WEBHOOK_URL:
+            self.call_api('set_webhook', url=WEBHOOK_URL.rstrip('/') + WEBHOOK_PATH,
+                          secret_token=WEBHOOK_SECRET or None, max_connections=WEBHOOK_WORKERS)
+        try:
+            self.server.serve_forever()
+        except KeyboardInterrupt:
+            logging.info("Interrupted")
+        finally:
+            self.server.stop()
+            self.shutdown()
+
+class DryRunApi:
+    """Answers Bot API requests locally (apihelper.CUSTOM_REQUEST_SENDER).
+
+    Sends get a plausible Message back and everything is counted, so the
+    whole pipeline can run against recorded updates without Telegram.
+    """
+
+    def __init__(self):
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+        self.calls = {}
+
+    def __call__(self, method, url, params=None, files=None, **kwargs):
+        name = url.rsplit('/', 1)[-1]
+        params = params or {}
+        with self._lock:
+            self.calls[name] = self.calls.get(name, 0) + 1
+            message_id = next(self._ids)
+
+        if name == 'getMe':
+            result = {'id': 1, 'is_bot': True, 'first_name': 'dry-run', 'username': 'dry_run_bot'}
+        elif name == 'createChatInviteLink':
+            result = {'invite_link': f'https://t.me/+dryrun{message_id}',
+                      'creator': {'id': 1, 'is_bot': True, 'first_name': 'dry-run'},
+                      'creates_join_request': False, 'is_primary': False, 'is_revoked': False,
+                      'member_limit': 1}
+        elif name == 'getFile':
+            result = {'file_id': params.get('file_id'), 'file_unique_id': f'dryrun{message_id}'}
+        elif name.startswith(('send', 'copy', 'edit')):
+            result = {'message_id': message_id, 'date': int(time.time()),
+                      'chat': {'id': int(params.get('chat_id') or 0), 'type': 'private'}}
+        else:
+            result = True
+
+        text = json.dumps({'ok': True, 'result': result})
+        return SimpleNamespace(status_code=200, text=text, reason='OK', json=lambda: json.loads(text))
+
+SYNTHETIC_START_ID = 10_000_000
+
+def _signup_update(step, update_id, i, user_id):
+    user = {'id': user_id, 'is_bot': False, 'first_name': f'User{i}'}
+    chat = {'id': user_id, 'type': 'private'}
+    if step == 'start':
+        return {'update_id': update_id, 'message': {
+            'message_id': 1, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': '/start',
+            'entities': [{'type': 'bot_command', 'offset': 0, 'length': 6}]}}
+    if step == 'name':
+        return {'update_id': update_id, 'message': {
+            'message_id': 2, 'date': int(time.time()), 'chat': chat, 'from': user, 'text': f'Name {i}'}}
+    return {'update_id': update_id, 'callback_query': {
+        'id': str(user_id), 'from': user, 'chat_instance': str(user_id), 'data': 'q1_0',
+        'message': {'message_id': 3, 'date': int(time.time()), 'chat': chat}}}
+
+# A signup: each step is one update per user, and the state every user
+# is in once it has been handled (the next step only makes sense then)
+SIGNUP_STEPS = (
+    ('start', UserState.WAITING_NAME),
+    ('name', UserState.QUESTION_1),
+    ('answer', UserState.QUESTION_2),
+)
+
+def synthetic_updates(step, users, start_id=SYNTHETIC_START_ID):
+    """One signup step (a /start, a name or a first answer) for each user."""
+    first = [name for name, _ in SIGNUP_STEPS].index(step) * users + 1
+    for i in range(users):
+        yield _signup_update(step, first + i, i, start_id + i)
+
+def wait_for_state(db_file, users, state, timeout, start_id=SYNTHETIC_START_ID):
+    """Poll the bot's database until the synthetic users are all in `state`; returns how many are."""
+    conn = sqlite3.connect(f"file:{db_file}?mode=ro", uri=True, timeout=5)
+    deadline = time.monotonic() + timeout
+    try:
+        while True:
+            reached = conn.execute("SELECT COUNT(*) FROM users WHERE user_id BETWEEN ? AND ? AND state = ?",
+                                   (start_id, start_id + users - 1, state)).fetchone()[0]
+            if reached >= users or time.monotonic() >= deadline:
+                return reached
+            time.sleep(0.5)
+    finally:
+        conn.close()
+
+def replay(url, updates, concurrency=8, secret=WEBHOOK_SECRET):
+    """POST updates to a webhook server; returns status counts and ack latencies."""
+    statuses = {}
+    latencies = []
+    lock = threading.Lock()
+
+    def post(update):
+        request = urllib.request.Request(url, data=json.dumps(update).encode(), method='POST',
+                                         headers={'Content-Type': 'application/json'})
+        if secret:
+            request.add_header('X-Telegram-Bot-Api-Secret-Token', secret)
+        started = time.perf_counter()
+        try:
+            with urllib.request.urlopen(request, timeout=30) as response:
+                status = response.status
+        except urllib.error.HTTPError as e:
+            status = e.code
+        except Exception:
+            status = 'error'
+        with lock:
+            statuses[status] = statuses.get(status, 0) + 1
+            latencies.append(time.perf_counter() - started)
+
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        for update in updates:
+            pool.submit(post, update)
+    latencies.sort()
+    return statuses, latencies
+
+def _report(label, url, updates, concurrency):
+    started = time.perf_counter()
+    statuses, latencies = replay(url, updates, concurrency)
+    elapsed = time.perf_counter() - started
+    total = sum(statuses.values())
+    print(f"{label}: posted {total} updates in {elapsed:.2f}s ({total / elapsed:,.0f}/s): {statuses}")
+    if latencies:
+        print(f"{label}: ack latency p50={latencies[len(latencies) // 2] * 1000:.1f}ms "
+              f"p99={latencies[int(len(latencies) * 0.99)] * 1000:.1f}ms")
+
+def _read_updates(path):
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            if line.strip():
+                yield json.loads(line)
+
+def main():
+    parser = argparse.ArgumentParser(description="Webhook server, and a replay client for recorded updates")
+    parser.add_argument('--dry-run', action='store_true', help="answer Bot API calls locally, never contact Telegram")
+    parser.add_argument('--db', help="database file (defaults to config.DB_FILE)")
+    parser.add_argument('--replay', metavar='UPDATES_JSONL', help="post updates from a JSON-lines file to --url")
+    parser.add_argument('--synthetic', type=int, metavar='USERS', help="post a generated signup burst to --url")
+    parser.add_argument('--url', default=f"http://127.0.0.1:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--step-timeout', type=float, default=600.0,
+                        help="seconds to wait for the synthetic users to reach each step's state")
+    args = parser.parse_args()
+
+    if args.replay:
+        _report("replay", args.url, _read_updates(args.replay), args.concurrency)
+        return
+    if args.synthetic:
+        # Each step is posted once the previous one has been handled, so
+        # the updates reach the handlers for the state they were meant for
+        for step, state in SIGNUP_STEPS:
+            _report(step, args.url, synthetic_updates(step, args.synthetic), args.concurrency)
+            started = time.perf_counter()
+            reached = wait_for_state(args.db or DB_FILE, args.synthetic, state, args.step_timeout)
+            print(f"{step}: {reached}/{args.synthetic} users in {state} after {time.perf_counter() - started:.1f}s")
+            if reached < args.synthetic:
+                sys.exit(1)
+        return
+
+    api = DryRunApi() if args.dry_run else None
+    if api:
+        apihelper.CUSTOM_REQUEST_SENDER = api
+    bot = WebhookTelegramBot(db_file=args.db)
+    bot.start_bot(register=api is None)
+    if api:
+        print(f"Bot API calls answered locally: {api.calls}", file=sys.stderr)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,148 @@
+# write_behind.py - Coalescing write-behind queue with group commit
+
+import time
+import logging
+import threading
+
+class WriteBehindQueue:
+    """Buffers per-user column updates and commits them in batches.
+
+    Updates to the same user are merged (last value per column wins), so a
+    button tap that writes an answer, the next state and a message id costs
+    one row update inside a shared transaction instead of three commits.
+    Pending values stay readable through `pending_user`/`pending_message_id`
+    until the batch holding them is committed.
+    """
+
+    def __init__(self, db, interval_ms, batch_size):
+        self.db = db
+        self.interval = interval_ms / 1000
+        self.batch_size = batch_size
+
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._users = {}        # user_id -> {column: value}
+        self._messages = {}     # (user_id, message_type) -> message_id
+        self._journal = set()   # user_ids whose row must be journaled after commit
+        self._ops = 0
+
+        # The batch currently being committed; still visible to readers.
+        self._flushing_users = {}
+        self._flushing_messages = {}
+
+        self._stopped = False
+        self._thread = threading.Thread(target=self._run, name="db-write-behind", daemon=True)
+        self._thread.start()
+
+    def update_user(self, user_id, columns, journal=True):
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("write-behind queue is closed")
+            self._users.setdefault(user_id, {}).update(columns)
+            if journal:
+                self._journal.add(user_id)
+            self._bump()
+
+    def save_message_id(self, user_id, message_id, message_type):
+        with self._cond:
+            if self._stopped:
+                raise RuntimeError("write-behind queue is closed")
+            self._messages[(user_id, message_type)] = message_id
+            self._bump()
+
+    def _bump(self):
+        self._ops += 1
+        if self._ops >= self.batch_size:
+            self._cond.notify()
+
+    def pending_user(self, user_id):
+        """Return uncommitted column values for a user (empty if none)."""
+        with self._cond:
+            pending = dict(self._flushing_users.get(user_id, ()))
+            pending.update(self._users.get(user_id, ()))
+            return pending
+
+    def pending_message_id(self, user_id, message_type):
+        key = (user_id, message_type)
+        with self._cond:
+            if key in self._messages:
+                return self._messages[key]
+            return self._flushing_messages.get(key)
+
+    def _run(self):
+        while True:
+            with self._cond:
+                if not self._stopped and self._ops < self.batch_size:
+                    self._cond.wait(self.interval)
+                if self._stopped:
+                    return
+            self.flush()
+
+    def flush(self):
+        """Commit everything queued so far in a single transaction."""
+        with self._flush_lock:
+            with self._cond:
+                if not self._users and not self._messages:
+                    return 0
+                users, self._users = self._users, {}
+                messages, self._messages = self._messages, {}
+                journal, self._journal = self._journal, set()
+                ops, self._ops = self._ops, 0
+                self._flushing_users, self._flushing_messages = users, messages
+
+            try:
+                with self.db._write() as cursor:
+                    for user_id, columns in users.items():
+                        assignments = ', '.join(f"{column} = ?" for column in columns)
+                        sql = f"UPDATE users SET {assignments} WHERE user_id = ?"
+                        params = (*columns.values(), user_id)
+                        if self.db.explain_queries:
+                            self.db._explain(sql, params)
+                        cursor.execute(sql, params)
+                    cursor.executemany("""
+                        INSERT OR REPLACE INTO user_messages
+                        (user_id, message_id, message_type)
+                        VALUES (?, ?, ?)
+                    """, [(user_id, message_id, message_type)
+                          for (user_id, message_type), message_id in messages.items()])
+            except Exception as e:
+                logging.error(f"Error flushing write-behind batch ({ops} ops), will retry: {e}")
+                with self._cond:
+                    # Requeue underneath anything written since the swap.
+                    for user_id, columns in users.items():
+                        merged = dict(columns)
+                        merged.update(self._users.get(user_id, ()))
+                        self._users[user_id] = merged
+                    for key, message_id in messages.items():
+                        self._messages.setdefault(key, message_id)
+                    self._journal |= journal
+                    self._ops += ops
+                    self._flushing_users, self._flushing_messages = {}, {}
+                time.sleep(self.interval)
+                return 0
+
+            with self._cond:
+                self._flushing_users, self._flushing_messages = {}, {}
+
+            for user_id in journal:
+                self.db._journal_user(user_id)
+            return ops
+
+    def close(self):
+        """Stop the writer thread and commit whatever is still pending."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify()
+        if self._thread is not threading.current_thread():
+            self._thread.join()
+
+        while True:
+            with self._cond:
+                if not self._users and not self._messages:
+                    return
+            if not self.flush():
+                # flush() already logged the failure; give up after the
+                # database itself is gone rather than spinning forever.
+                if self.db._closed:
+                    logging.error("Dropping write-behind batch: database already closed")
+                    return